@@ -1,14 +1,31 @@
-from flask import Blueprint, request, current_app
+from flask import Blueprint, Response, request, current_app, stream_with_context
 from flask_jwt_extended import jwt_required
-from utils.userutils import load_users, save_users, get_user, update_user
+from utils.userutils import get_user, update_user, update_users, list_users, USER_SORT_KEYS
 from utils.authutils import admin_required, api_response
-from utils.sessionutils import validate_session, emit_to_user
+from utils.sessionutils import invalidate_session, invalidate_sessions, emit_to_user, emit_to_users
+from utils.config import Config
 from utils.decorators import api_error_handler, require_fields
+from utils.ratelimit import rate_limit
+import base64
+import json
 import time
 from utils.logutils import log_info, log_error
+from utils.metrics import registry
+from utils.profiler import profiler
 
 admin_bp = Blueprint('admin', __name__)
 
+def _force_logout_data(suspend):
+    # The same payload for one user or a batch; it goes to the user's own room, so it needs no user ID
+    reason = 'suspended' if suspend else 'unsuspended'
+    message = 'Your account has been suspended by an administrator' if suspend else 'Your account has been unsuspended. Please log in again.'
+    
+    return {
+        'reason': reason,
+        'message': message,
+        'timestamp': int(time.time())
+    }
+
 def update_user_suspension_status(username=None, user_id=None, suspend=True):
     """
     Centralized function to handle user suspension/unsuspension
@@ -21,14 +38,13 @@ def update_user_suspension_status(username=None, user_id=None, suspend=True):
     Returns:
         tuple: (success, response_or_error)
     """
-    users = load_users()
     target_user = None
     
     # Find user by either username or ID
     if username:
-        target_user = get_user(username, 'username', users)
+        target_user = get_user(username, 'username')
     elif user_id:
-        target_user = get_user(user_id, 'id', users)
+        target_user = get_user(user_id, 'id')
     
     if not target_user:
         return False, api_response(False, 'User not found', status_code=404)
@@ -44,29 +60,115 @@ def update_user_suspension_status(username=None, user_id=None, suspend=True):
     user_id = target_user['id']
     update_user(user_id, updates)
     
-    # Handle session validation
-    validate_session(user_id)
+    # Suspension revokes every token issued so far
+    if suspend:
+        invalidate_session(user_id)
     
     # Notify user via Socket.IO if connected
     target_username = target_user['username']
     if hasattr(current_app, 'socketio'):
-        reason = 'suspended' if suspend else 'unsuspended'
-        message = 'Your account has been suspended by an administrator' if suspend else 'Your account has been unsuspended. Please log in again.'
-        
-        emit_data = {
-            'reason': reason,
-            'message': message,
-            'timestamp': int(time.time()),
-            'user_id': user_id
-        }
-        emit_to_user(target_username, 'force_logout', emit_data)
+        emit_to_user(target_username, 'force_logout', _force_logout_data(suspend))
     
     action = 'suspended' if suspend else 'unsuspended'
     return True, api_response(True, f"User {target_username} has been {action}")
 
+def update_users_suspension_status(identifiers, identifier_type='username', suspend=True):
+    """
+    Suspend or unsuspend many users with a single store write
+    
+    All changes go to the user store as one batch, sessions are
+    revoked in one write and the force_logout notifications are sent
+    with batched emits
+    
+    Args:
+        identifiers: List of usernames or user IDs
+        identifier_type: 'username' or 'id'
+        suspend: True to suspend, False to unsuspend
+    
+    Returns:
+        list: Result per identifier, in request order
+    """
+    key = 'username' if identifier_type == 'username' else 'user_id'
+    results = []
+    targets = {}  # user ID -> result of the first identifier naming it
+    
+    for identifier in identifiers:
+        result = {key: identifier, 'success': False}
+        results.append(result)
+        
+        target_user = get_user(identifier, identifier_type)
+        if not target_user:
+            result['error'] = 'User not found'
+        elif target_user['id'] in targets:
+            result['error'] = 'Duplicate user'
+        else:
+            targets[target_user['id']] = result
+    
+    if not targets:
+        return results
+    
+    updates = {'is_suspended': suspend}
+    if suspend:
+        updates['suspended_at'] = int(time.time())
+    
+    updated_users = update_users([(user_id, updates) for user_id in targets], wait=True)
+    
+    updated = {}
+    for (user_id, result), user in zip(targets.items(), updated_users):
+        if isinstance(user, Exception):
+            log_error("Bulk suspension update of user ID %s failed: %s", user_id, user)
+            result['error'] = 'Update failed'
+        elif user:
+            result['success'] = True
+            result['user_id'] = user_id
+            result['username'] = user['username']
+            updated[user['username']] = user_id
+        else:
+            result['error'] = 'User not found'
+    
+    # Suspension revokes every token issued so far
+    if suspend:
+        invalidate_sessions(updated.values())
+    
+    # One shared payload so it is encoded once per batch
+    if updated and hasattr(current_app, 'socketio'):
+        delivered = emit_to_users(updated, 'force_logout', _force_logout_data(suspend))
+        for result in targets.values():
+            if result['success']:
+                result['notified'] = delivered[result['username']]
+    
+    action = 'suspended' if suspend else 'unsuspended'
+    log_info("Bulk %s %s of %s users", action, len(updated), len(identifiers))
+    return results
+
+def _bulk_identifiers(data, field, identifier_type):
+    """Validate the identifier list of a bulk request, returning (identifiers, error_response)"""
+    identifiers = data.get(field)
+    if not isinstance(identifiers, list) or not identifiers:
+        return None, api_response(False, f'{field} must be a non-empty list', status_code=400)
+    if len(identifiers) > Config.ADMIN_BULK_MAX_USERS:
+        return None, api_response(False, f'At most {Config.ADMIN_BULK_MAX_USERS} users per request', status_code=400)
+    if identifier_type == 'id':
+        try:
+            identifiers = [int(identifier) for identifier in identifiers]
+        except (TypeError, ValueError):
+            return None, api_response(False, f'{field} must contain integer IDs', status_code=400)
+    return identifiers, None
+
+def _bulk_suspension_response(field, identifier_type, suspend):
+    identifiers, error = _bulk_identifiers(request.get_json(), field, identifier_type)
+    if error:
+        return error
+    
+    results = update_users_suspension_status(identifiers, identifier_type, suspend)
+    succeeded = sum(1 for result in results if result['success'])
+    action = 'suspended' if suspend else 'unsuspended'
+    return api_response(True, f"{succeeded} of {len(results)} users {action}", {'results': results})
+
 @admin_bp.route('/suspend', methods=['POST'])
 @jwt_required()
 @admin_required
+@rate_limit('admin', key='user')
 @api_error_handler
 @require_fields('username')
 def suspend_user():
@@ -77,6 +179,7 @@ def suspend_user():
 @admin_bp.route('/unsuspend', methods=['POST'])
 @jwt_required()
 @admin_required
+@rate_limit('admin', key='user')
 @api_error_handler
 @require_fields('username')
 def unsuspend_user():
@@ -87,6 +190,7 @@ def unsuspend_user():
 @admin_bp.route('/ban', methods=['POST'])
 @jwt_required()
 @admin_required
+@rate_limit('admin', key='user')
 @api_error_handler
 @require_fields('user_id')
 def ban_user():
@@ -97,9 +201,219 @@ def ban_user():
 @admin_bp.route('/unban', methods=['POST'])
 @jwt_required()
 @admin_required
+@rate_limit('admin', key='user')
 @api_error_handler
 @require_fields('user_id')
 def unban_user():
     data = request.get_json()
     success, response = update_user_suspension_status(user_id=int(data.get('user_id')), suspend=False)
     return response
+
+@admin_bp.route('/suspend/bulk', methods=['POST'])
+@jwt_required()
+@admin_required
+@rate_limit('admin', key='user')
+@api_error_handler
+@require_fields('usernames')
+def bulk_suspend_users():
+    return _bulk_suspension_response('usernames', 'username', suspend=True)
+
+@admin_bp.route('/unsuspend/bulk', methods=['POST'])
+@jwt_required()
+@admin_required
+@rate_limit('admin', key='user')
+@api_error_handler
+@require_fields('usernames')
+def bulk_unsuspend_users():
+    return _bulk_suspension_response('usernames', 'username', suspend=False)
+
+@admin_bp.route('/ban/bulk', methods=['POST'])
+@jwt_required()
+@admin_required
+@rate_limit('admin', key='user')
+@api_error_handler
+@require_fields('user_ids')
+def bulk_ban_users():
+    return _bulk_suspension_response('user_ids', 'id', suspend=True)
+
+@admin_bp.route('/unban/bulk', methods=['POST'])
+@jwt_required()
+@admin_required
+@rate_limit('admin', key='user')
+@api_error_handler
+@require_fields('user_ids')
+def bulk_unban_users():
+    return _bulk_suspension_response('user_ids', 'id', suspend=False)
+
+_LISTING_FIELDS = ('id', 'username', 'is_admin', 'is_suspended', 'created_at', 'profile_picture')
+
+def _encode_cursor(sort, order, key):
+    payload = json.dumps({'sort': sort, 'order': order, 'key': key}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+def _decode_cursor(cursor, sort, order):
+    """Decode a listing cursor, returning its sort key or raising ValueError"""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except Exception:
+        raise ValueError('Invalid cursor')
+    if not isinstance(payload, dict) or payload.get('sort') != sort or payload.get('order') != order:
+        raise ValueError('Cursor does not match the requested sort order')
+    key = payload.get('key')
+    # The key reaches the index comparisons as is, so check its shape per sort
+    if sort == 'created_at':
+        if not (isinstance(key, list) and len(key) == 2 and all(_is_int(part) for part in key)):
+            raise ValueError('Invalid cursor')
+        return tuple(key)
+    if not (_is_int(key) if sort == 'id' else isinstance(key, str)):
+        raise ValueError('Invalid cursor')
+    return key
+
+def _is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+def _parse_bool(value, name):
+    if value.lower() in ('1', 'true', 'yes'):
+        return True
+    if value.lower() in ('0', 'false', 'no'):
+        return False
+    raise ValueError(f'{name} must be true or false')
+
+def _listing_filters(args):
+    """Build listing filters from query parameters, raising ValueError on bad input"""
+    filters = {}
+    if 'suspended' in args:
+        filters['is_suspended'] = _parse_bool(args['suspended'], 'suspended')
+    if 'admin' in args:
+        filters['is_admin'] = _parse_bool(args['admin'], 'admin')
+    for name in ('created_after', 'created_before'):
+        if name in args:
+            try:
+                filters[name] = int(args[name])
+            except ValueError:
+                raise ValueError(f'{name} must be a unix timestamp')
+    if args.get('username_prefix'):
+        filters['username_prefix'] = args['username_prefix']
+    return filters
+
+@admin_bp.route('/users', methods=['GET'])
+@jwt_required()
+@admin_required
+@rate_limit('admin', key='user')
+@api_error_handler
+def list_users_page():
+    """
+    List users one page at a time
+    
+    Query parameters: sort (id, username, created_at), order (asc,
+    desc), limit, cursor (next_cursor of the previous page) and the
+    filters suspended, admin, created_after, created_before and
+    username_prefix. Pages are read from the store's sorted indexes
+    and streamed, so no page is built in memory.
+    """
+    args = request.args
+    sort = args.get('sort', 'id')
+    order = args.get('order', 'asc')
+    if sort not in USER_SORT_KEYS:
+        return api_response(False, f"sort must be one of: {', '.join(USER_SORT_KEYS)}", status_code=400)
+    if order not in ('asc', 'desc'):
+        return api_response(False, 'order must be asc or desc', status_code=400)
+    
+    try:
+        limit = int(args.get('limit', Config.ADMIN_USERS_PAGE_SIZE))
+        if not 1 <= limit <= Config.ADMIN_USERS_PAGE_MAX:
+            raise ValueError
+    except ValueError:
+        return api_response(False, f'limit must be between 1 and {Config.ADMIN_USERS_PAGE_MAX}', status_code=400)
+    
+    try:
+        filters = _listing_filters(args)
+        after = _decode_cursor(args['cursor'], sort, order) if args.get('cursor') else None
+    except ValueError as e:
+        return api_response(False, str(e), status_code=400)
+    
+    # One extra user tells whether another page follows
+    users = list_users(sort, order == 'desc', after, filters, limit + 1)
+    sort_key = USER_SORT_KEYS[sort][0]
+    
+    def generate():
+        yield '{"success":true,"users":['
+        count = 0
+        last = None
+        for user in users:
+            if count == limit:
+                break
+            if count:
+                yield ','
+            yield json.dumps({field: user.get(field) for field in _LISTING_FIELDS})
+            last = user
+            count += 1
+        else:
+            # Ran out before the extra user, this is the last page
+            last = None
+        next_cursor = _encode_cursor(sort, order, sort_key(last)) if last is not None else None
+        yield f'],"count":{count},"next_cursor":{json.dumps(next_cursor)}}}'
+    
+    return Response(stream_with_context(generate()), mimetype='application/json')
+
+@admin_bp.route('/metrics', methods=['GET'])
+@jwt_required()
+@admin_required
+@api_error_handler
+def metrics():
+    """
+    Expose request, user store, hashing and Socket.IO metrics
+    
+    Served in the Prometheus text format. Values are per worker
+    process, so with several workers each one reports its own.
+    """
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+@admin_bp.route('/profiler', methods=['POST'])
+@jwt_required()
+@admin_required
+@rate_limit('admin', key='user')
+@api_error_handler
+def start_profiler():
+    """
+    Start sampling live requests for a time window
+    
+    JSON body: duration in seconds, optional interval_ms, route (URL
+    rule or path) and header ('Name' or 'Name: value'). Without route
+    or header every request in the window is sampled. Profiles are
+    written to Config.PROFILES_DIR when the window ends.
+    """
+    data = request.get_json(silent=True) or {}
+    interval_ms = data.get('interval_ms')
+    if interval_ms is not None and not isinstance(interval_ms, (int, float)):
+        return api_response(False, 'interval_ms must be a number', status_code=400)
+    
+    try:
+        session = profiler.start(data.get('duration'),
+                                 interval_ms / 1000 if interval_ms is not None else None,
+                                 route=data.get('route'), header=data.get('header'))
+    except ValueError as e:
+        return api_response(False, str(e), status_code=400)
+    except RuntimeError as e:
+        return api_response(False, str(e), status_code=409)
+    
+    return api_response(True, 'Profiling started', {'profile': session})
+
+@admin_bp.route('/profiler', methods=['GET'])
+@jwt_required()
+@admin_required
+@api_error_handler
+def profiler_status():
+    """Describe the running profiling session and the files of the last one"""
+    return api_response(True, 'Profiler status', profiler.status())
+
+@admin_bp.route('/profiler/stop', methods=['POST'])
+@jwt_required()
+@admin_required
+@api_error_handler
+def stop_profiler():
+    """End the running profiling session early and write its profiles"""
+    result = profiler.stop()
+    if result is None:
+        return api_response(False, 'No profiling session is running', status_code=409)
+    return api_response(True, 'Profiling stopped', {'profile': result})
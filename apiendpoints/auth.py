@@ -1,14 +1,16 @@
 from flask import Blueprint, request, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from werkzeug.security import generate_password_hash
 import time
 import re
-from utils.pfputils import save_profile_picture
+from utils.pfputils import save_profile_picture, process_profile_picture, release_profile_picture, UploadRejected
 from utils.authutils import admin_required, api_response, validate_username, validate_password # Added validate_username, validate_password
 from utils.sessionutils import invalidate_session # Added import
-from utils.userutils import load_users, save_users, get_user, update_user
+from utils.userutils import get_user, username_exists, add_user, UsernameTaken
 from utils.auth_manager import authenticate_user, login_user, logout_user
-from utils.ratelimit import login_limiter
+from utils.ratelimit import rate_limit
+from utils.passwordutils import hash_password
+from utils.workerpool import PoolSaturated
+from utils.responseutils import busy_response
 from utils.logutils import log_info, log_error
 from utils.decorators import api_error_handler, require_fields
 
@@ -17,24 +19,25 @@ auth_bp = Blueprint('auth', __name__)
 # Removed validate_username and validate_password function definitions
 
 @auth_bp.route('/login', methods=['POST'])
+@rate_limit('login', message='Too many login attempts. Please try again later.')
 @api_error_handler
 @require_fields('username', 'password')
 def login():
     data = request.get_json()
     
-    ip = request.remote_addr
-    if login_limiter.is_rate_limited(ip):
-        return api_response(False, 'Too many login attempts. Please try again later.', status_code=429)
-    
-    user, error = authenticate_user(data.get('username'), data.get('password'))
+    try:
+        user, error = authenticate_user(data.get('username'), data.get('password'))
+    except PoolSaturated:
+        return busy_response()
     
     if error:
         return api_response(False, error, status_code=401)
     
     resp = api_response(True, 'Login successful')
-    return login_user(user['username'], resp)
+    return login_user(user, resp)
 
 @auth_bp.route('/register', methods=['POST'])
+@rate_limit('register')
 @api_error_handler
 def register():
     if request.content_type and 'multipart/form-data' in request.content_type:
@@ -61,21 +64,26 @@ def register():
     if not valid:
         return api_response(False, error, status_code=400)
     
-    users = load_users()
-    
-    if get_user(username, 'username', users):
+    if username_exists(username):
         return api_response(False, 'Username already exists', status_code=400)
     
+    try:
+        password_hash = hash_password(password)
+    except PoolSaturated:
+        return busy_response()
+    
     profile_picture_path = None
     if profile_picture:
-        profile_picture_path = save_profile_picture(profile_picture)
+        try:
+            profile_picture_path = save_profile_picture(profile_picture)
+        except UploadRejected as e:
+            return api_response(False, str(e), status_code=e.status_code)
         if profile_picture_path:
-            log_info(f"Profile picture saved: {profile_picture_path}")
+            log_info("Profile picture saved: %s", profile_picture_path)
     
     new_user = {
-        'id': len(users) + 1,
         'username': username,
-        'password': generate_password_hash(password),
+        'password': password_hash,
         'is_admin': False,
         'is_suspended': False,
         'created_at': int(time.time())
@@ -84,11 +92,18 @@ def register():
     if profile_picture_path:
         new_user['profile_picture'] = profile_picture_path
     
-    users.append(new_user)
-    save_users(users)
+    try:
+        add_user(new_user, wait=True)
+    except UsernameTaken:
+        # Taken by a concurrent registration since the check above
+        if profile_picture_path:
+            release_profile_picture({'profile_picture': profile_picture_path})
+        return api_response(False, 'Username already exists', status_code=400)
+    if profile_picture_path:
+        process_profile_picture(new_user['id'], profile_picture_path)
     
     resp = api_response(True, 'Registration successful')
-    return login_user(username, resp)
+    return login_user(new_user, resp)
 
 @auth_bp.route('/logout', methods=['POST'])
 def logout():
@@ -98,6 +113,7 @@ def logout():
 @auth_bp.route('/force-logout', methods=['POST'])
 @jwt_required()
 @admin_required
+@rate_limit('admin', key='user')
 @api_error_handler
 @require_fields('user_id')
 def force_logout():
@@ -1,9 +1,11 @@
 from flask import Blueprint, request, current_app
 from flask_jwt_extended import jwt_required
-from werkzeug.security import generate_password_hash, check_password_hash
-from utils.userutils import load_users, save_users
+from utils.userutils import update_user
 from utils.authutils import auth_middleware
-from utils.responseutils import api_response
+from utils.responseutils import api_response, busy_response
+from utils.passwordutils import hash_password, verify_password
+from utils.workerpool import PoolSaturated
+from utils.ratelimit import rate_limit
 from utils.logutils import log_error, log_info
 import time
 from utils.authutils import validate_password # Changed import
@@ -12,6 +14,7 @@ password_bp = Blueprint('password', __name__)
 
 @password_bp.route('/change', methods=['POST'])
 @jwt_required()
+@rate_limit('password_change', key='user')
 def change_password():
     try:
         user, error_response = auth_middleware()
@@ -31,37 +34,31 @@ def change_password():
         if not valid:
             return api_response(False, error, status_code=400)
 
-        if not check_password_hash(user['password'], current_password):
-            return api_response(False, 'Current password is incorrect', status_code=401)
+        try:
+            if not verify_password(user['password'], current_password):
+                return api_response(False, 'Current password is incorrect', status_code=401)
+            new_password_hash = hash_password(new_password)
+        except PoolSaturated:
+            return busy_response()
 
-        users = load_users()
         current_username = user['username']
-        
-        for i, u in enumerate(users):
-            if u['username'] == current_username:
-                users[i]['password'] = generate_password_hash(new_password)
-                users[i]['password_changed_at'] = int(time.time())
-                save_users(users)
-                break
+        update_user(user['id'], {
+            'password': new_password_hash,
+            'password_changed_at': int(time.time())
+        }, wait=True)
 
-        from utils.sessionutils import invalidate_session
+        from utils.sessionutils import invalidate_session, emit_to_user
         invalidate_session(user['id'])
 
-        # Notify user via Socket.IO if connected
-        if hasattr(current_app, 'user_sessions'):
-            if current_username in current_app.user_sessions:
-                try:
-                    current_app.socketio.emit('force_logout', {
-                        'reason': 'password_changed',
-                        'message': 'Your password has been changed. Please log in again with your new password.',
-                        'timestamp': int(time.time()),
-                        'user_id': user['id']
-                    }, room=current_username)
-                except Exception as e:
-                    log_error(f"Error sending force logout after password change: {str(e)}")
+        # Notify all of the user's connected sessions via Socket.IO
+        emit_to_user(current_username, 'force_logout', {
+            'reason': 'password_changed',
+            'message': 'Your password has been changed. Please log in again with your new password.',
+            'timestamp': int(time.time())
+        })
         
-        log_info(f"Password changed successfully for user {current_username}")
+        log_info("Password changed successfully for user %s", current_username)
         return api_response(True, 'Password changed successfully. All sessions have been invalidated for security.')
     except Exception as e:
-        log_error(f"Password change error: {str(e)}")
+        log_error("Password change error: %s", e)
         return api_response(False, 'An error occurred while changing password', status_code=500)
@@ -1,12 +1,16 @@
 from flask import Blueprint, request, current_app
-from flask_jwt_extended import jwt_required, create_access_token, set_access_cookies
+from flask_jwt_extended import jwt_required, set_access_cookies
+from utils.auth_manager import create_user_token
 import time
-from utils.pfputils import save_profile_picture, delete_profile_picture
-from utils.userutils import load_users, save_users, get_user, update_user
+from utils.pfputils import (save_profile_picture, save_profile_picture_file, release_profile_picture,
+                            process_profile_picture, UploadRejected)
+from utils.uploadutils import create_upload, get_upload, append_upload, completed_upload_path, delete_upload
+from utils.userutils import update_user, username_exists, UsernameTaken
 from utils.authutils import auth_middleware, api_response
-from utils.decorators import api_error_handler
+from utils.decorators import api_error_handler, require_fields
+from utils.ratelimit import rate_limit
 from utils.logutils import log_info, log_error
-from utils.sessionutils import emit_to_user
+from utils.sessionutils import emit_to_user, rename_user_sessions
 from utils.authutils import validate_username # Changed import
 
 user_bp = Blueprint('user', __name__)
@@ -17,7 +21,8 @@ def get_user_profile_data(user, include_admin=False):
         'id': user['id'],
         'username': user['username'],
         'created_at': user['created_at'],
-        'profile_picture': user.get('profile_picture')
+        'profile_picture': user.get('profile_picture'),
+        'profile_picture_variants': user.get('profile_picture_variants')
     }
     
     if include_admin:
@@ -27,6 +32,7 @@ def get_user_profile_data(user, include_admin=False):
 
 @user_bp.route('/profile', methods=['GET'])
 @jwt_required()
+@rate_limit('api', key='user')
 @api_error_handler
 def get_profile():
     user, error_response = auth_middleware()
@@ -39,6 +45,7 @@ def get_profile():
 
 @user_bp.route('/me', methods=['GET'])
 @jwt_required()
+@rate_limit('api', key='user')
 @api_error_handler
 def get_me():
     user, error_response = auth_middleware()
@@ -51,6 +58,7 @@ def get_me():
 
 @user_bp.route('/update-username', methods=['POST'])
 @jwt_required()
+@rate_limit('profile_update', key='user')
 @api_error_handler
 def update_username():
     user, error_response = auth_middleware()
@@ -73,8 +81,7 @@ def update_username():
     
     # Only check for duplicates if username is actually changing
     if new_username != current_username:
-        users = load_users()
-        if any(u['username'] == new_username for u in users):
+        if username_exists(new_username):
             return api_response(False, 'Username already exists', status_code=400)
         
         old_username = current_username
@@ -84,18 +91,17 @@ def update_username():
             'username': new_username,
             'username_changed_at': int(time.time())
         }
-        update_user(user['id'], updates)
+        try:
+            updated_user = update_user(user['id'], updates)
+        except UsernameTaken:
+            # Taken by another request since the check above
+            return api_response(False, 'Username already exists', status_code=400)
         
         # Update session mapping
-        if hasattr(current_app, 'user_sessions'):
-            if old_username in current_app.user_sessions:
-                session_id = current_app.user_sessions[old_username]
-                del current_app.user_sessions[old_username]
-                current_app.user_sessions[new_username] = session_id
-                log_info(f"Session ID {session_id} remapped from {old_username} to {new_username}")
+        rename_user_sessions(old_username, new_username)
         
         # Create new access token with updated identity
-        access_token = create_access_token(identity=new_username)
+        access_token = create_user_token(updated_user)
         
         resp = api_response(True, 'Username updated successfully', data={'new_username': new_username})
         set_access_cookies(resp[0], access_token)
@@ -104,8 +110,34 @@ def update_username():
     else:
         return api_response(False, 'New username must be different from current username', status_code=400)
 
+def set_profile_picture(user, profile_picture_path):
+    """
+    Point a user at a newly saved profile picture and start processing it
+    
+    Args:
+        user: User object
+        profile_picture_path: Filename returned by save_profile_picture
+    """
+    # Captured before the update, the user object may be the live record
+    previous_picture = {
+        'profile_picture': user.get('profile_picture'),
+        'profile_picture_variants': user.get('profile_picture_variants')
+    }
+    
+    # Update user record with new profile picture path
+    updates = {
+        'profile_picture': profile_picture_path,
+        'profile_picture_variants': None
+    }
+    update_user(user['id'], updates)
+    
+    # The old picture's files go away once no other user shares them
+    release_profile_picture(previous_picture)
+    process_profile_picture(user['id'], profile_picture_path)
+
 @user_bp.route('/update-profile-picture', methods=['POST'])
 @jwt_required()
+@rate_limit('upload', key='user')
 @api_error_handler
 def update_profile_picture():
     user, error_response = auth_middleware()
@@ -120,19 +152,90 @@ def update_profile_picture():
     if not profile_picture.filename:
         return api_response(False, 'No profile picture selected', status_code=400)
     
-    # Delete old profile picture if exists
-    if 'profile_picture' in user:
-        delete_profile_picture(user['profile_picture'])
+    try:
+        profile_picture_path = save_profile_picture(profile_picture)
+    except UploadRejected as e:
+        return api_response(False, str(e), status_code=e.status_code)
+    
+    if not profile_picture_path:
+        return api_response(False, 'Failed to save profile picture', status_code=500)
     
-    profile_picture_path = save_profile_picture(profile_picture)
+    set_profile_picture(user, profile_picture_path)
+    
+    return api_response(True, 'Profile picture updated successfully', data={'profile_picture': profile_picture_path})
+
+@user_bp.route('/profile-picture/uploads', methods=['POST'])
+@jwt_required()
+@rate_limit('upload', key='user')
+@api_error_handler
+@require_fields('size')
+def start_profile_picture_upload():
+    """Start a resumable profile picture upload for slow or unreliable connections"""
+    user, error_response = auth_middleware()
+    if error_response:
+        return error_response
+    
+    try:
+        upload = create_upload(user['id'], request.get_json().get('size'))
+    except UploadRejected as e:
+        return api_response(False, str(e), status_code=e.status_code)
+    
+    return api_response(True, 'Upload started', data=upload, status_code=201)
+
+@user_bp.route('/profile-picture/uploads/<upload_id>', methods=['GET'])
+@jwt_required()
+@rate_limit('api', key='user')
+@api_error_handler
+def get_profile_picture_upload(upload_id):
+    """Report how many bytes of an upload have arrived, to resume from there"""
+    user, error_response = auth_middleware()
+    if error_response:
+        return error_response
+    
+    upload = get_upload(upload_id, user['id'])
+    if not upload:
+        return api_response(False, 'Upload not found', status_code=404)
+    
+    return api_response(True, data=upload)
+
+@user_bp.route('/profile-picture/uploads/<upload_id>', methods=['PATCH'])
+@jwt_required()
+@rate_limit('api', key='user')
+@api_error_handler
+def append_profile_picture_upload(upload_id):
+    """
+    Append the request body to an upload at the offset in the Upload-Offset header
+    
+    The chunk that completes the upload also sets the profile picture
+    """
+    user, error_response = auth_middleware()
+    if error_response:
+        return error_response
+    
+    try:
+        offset = int(request.headers.get('Upload-Offset', ''))
+    except ValueError:
+        return api_response(False, 'Upload-Offset header required', status_code=400)
+    
+    try:
+        upload = append_upload(upload_id, user['id'], offset, request.stream)
+        if not upload:
+            return api_response(False, 'Upload not found', status_code=404)
+        
+        path = completed_upload_path(upload)
+        if not path:
+            return api_response(True, 'Chunk received', data=upload)
+        
+        try:
+            profile_picture_path = save_profile_picture_file(path)
+        finally:
+            delete_upload(upload_id)
+    except UploadRejected as e:
+        return api_response(False, str(e), status_code=e.status_code)
     
     if not profile_picture_path:
         return api_response(False, 'Failed to save profile picture', status_code=500)
     
-    # Update user record with new profile picture path
-    updates = {
-        'profile_picture': profile_picture_path
-    }
-    update_user(user['id'], updates)
+    set_profile_picture(user, profile_picture_path)
     
     return api_response(True, 'Profile picture updated successfully', data={'profile_picture': profile_picture_path})
@@ -0,0 +1,10 @@
+"""
+Benchmarks for the HTTP API, the user store and Socket.IO
+
+    python -m benchmarks.fixtures --users 100k
+    python -m benchmarks.http_bench --users 100k --backend sqlite
+    python -m benchmarks.socketio_load --clients 2000 --users 100k
+    python -m benchmarks.compare results/old.json results/new.json
+
+Run from the repository root. See each module for its options.
+"""
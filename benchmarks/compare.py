@@ -0,0 +1,74 @@
+"""
+Compare two benchmark results
+
+    python -m benchmarks.compare BASE.json NEW.json [--metric p95_ms] [--threshold 10]
+
+Prints each scenario and store operation side by side with the change
+in percent, and exits with status 1 if any got slower than the
+threshold allows.
+"""
+import argparse
+import json
+import sys
+
+_LOWER_IS_BETTER = {'p50_ms', 'p95_ms', 'p99_ms', 'mean_ms', 'max_ms'}
+
+def _rows(results):
+    rows = dict(results.get('scenarios', {}))
+    rows.update((f"store.{name}", summary) for name, summary in results.get('store', {}).items())
+    return rows
+
+def compare(base, new, metric='p95_ms', threshold=10.0):
+    """
+    Compare one metric between two result sets
+
+    Args:
+        base: Baseline results dict
+        new: New results dict
+        metric: Summary field to compare, e.g. 'p95_ms' or 'rps'
+        threshold: Percent change beyond which a row counts as a regression
+
+    Returns:
+        list: (name, base value, new value, change percent, regressed) tuples
+    """
+    base_rows, new_rows = _rows(base), _rows(new)
+    comparison = []
+    for name in base_rows:
+        if name not in new_rows:
+            continue
+        old_value, new_value = base_rows[name].get(metric), new_rows[name].get(metric)
+        if not old_value or new_value is None:
+            continue
+        change = (new_value - old_value) / old_value * 100
+        worse = change if metric in _LOWER_IS_BETTER else -change
+        comparison.append((name, old_value, new_value, change, worse > threshold))
+    return comparison
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('base', help="baseline results file")
+    parser.add_argument('new', help="results file to check")
+    parser.add_argument('--metric', default='p95_ms', help="p50_ms, p95_ms, p99_ms, mean_ms, max_ms or rps")
+    parser.add_argument('--threshold', type=float, default=10.0, help="allowed slowdown in percent")
+    args = parser.parse_args(argv)
+
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+
+    for label, results in (('base', base), ('new', new)):
+        meta = results.get('meta', {})
+        print(f"{label}: {meta.get('commit') or '?'}{' (dirty)' if meta.get('dirty') else ''} "
+              f"{meta.get('users')} users, {meta.get('backend') or meta.get('transport')}, {meta.get('timestamp')}")
+
+    comparison = compare(base, new, args.metric, args.threshold)
+    print(f"\n{'':<28}{'base ' + args.metric:>16}{'new ' + args.metric:>16}{'change':>10}")
+    for name, old_value, new_value, change, regressed in comparison:
+        print(f"{name:<28}{old_value:>16.3f}{new_value:>16.3f}{change:>+9.1f}%{'  REGRESSION' if regressed else ''}")
+
+    if any(regressed for *_, regressed in comparison):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
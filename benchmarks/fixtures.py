@@ -0,0 +1,148 @@
+"""
+Synthetic users.json fixtures
+
+Every user shares one precomputed password hash, so generating a
+million users takes seconds instead of a million hashing rounds.
+A given size always has the same users, so fixtures are cached.
+
+    python -m benchmarks.fixtures --users 1m [--data-dir DIR]
+"""
+import argparse
+import json
+import os
+import shutil
+import time
+from werkzeug.security import generate_password_hash
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.fixtures')
+SIZES = {'1k': 1_000, '100k': 100_000, '1m': 1_000_000}
+
+PASSWORD = 'bench123'
+ADMIN_USERNAME = 'bench_admin'
+
+def is_suspended(index):
+    """One user in a hundred starts out suspended"""
+    return index % 100 == 50
+
+def is_admin(index):
+    """User 0 and one user in a thousand are admins"""
+    return index % 1000 == 0
+
+def is_regular(index):
+    """Whether a fixture user is an active non-admin, usable by any scenario"""
+    return not is_suspended(index) and not is_admin(index)
+
+def parse_size(value):
+    """
+    Parse a fixture size
+
+    Args:
+        value: One of SIZES ('1k', '100k', '1m') or a plain number
+
+    Returns:
+        int: Number of users
+    """
+    value = str(value).lower()
+    if value in SIZES:
+        return SIZES[value]
+    count = int(value)
+    if count < 1:
+        raise ValueError('A fixture needs at least one user')
+    return count
+
+def username_for(index):
+    """
+    Get the username of a fixture user
+
+    Args:
+        index: Zero-based user index, 0 is the admin
+
+    Returns:
+        str: Username
+    """
+    return ADMIN_USERNAME if index == 0 else f"bench_user_{index:07d}"
+
+def write_users(path, count):
+    """
+    Write a users.json fixture
+
+    User 0 is an admin named ADMIN_USERNAME, a small share of the
+    others are suspended or admins and creation times are spread over
+    three years, so the admin listing filters have realistic data.
+    Users are written one at a time and never held in memory together.
+
+    Args:
+        path: Output file
+        count: Number of users
+    """
+    password_hash = generate_password_hash(PASSWORD)
+    now = int(time.time())
+    start = now - 3 * 365 * 86400
+
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w') as f:
+        f.write('[\n')
+        for index in range(count):
+            user = {
+                'id': index + 1,
+                'username': username_for(index),
+                'password': password_hash,
+                'is_admin': is_admin(index),
+                'is_suspended': is_suspended(index),
+                'created_at': start + (now - start) * index // count,
+                'profile_picture': None,
+            }
+            if index:
+                f.write(',\n')
+            f.write(json.dumps(user))
+        f.write('\n]\n')
+    os.replace(temp_path, path)
+
+def fixture_path(count):
+    """
+    Get the cached fixture for a size, generating it on first use
+
+    Args:
+        count: Number of users
+
+    Returns:
+        str: Path of the users.json fixture
+    """
+    path = os.path.join(FIXTURES_DIR, f"users-{count}.json")
+    if not os.path.exists(path):
+        os.makedirs(FIXTURES_DIR, exist_ok=True)
+        started = time.perf_counter()
+        write_users(path, count)
+        print(f"Generated {count} users in {time.perf_counter() - started:.1f}s: {path}")
+    return path
+
+def install(count, data_dir):
+    """
+    Copy a fixture into a data directory as its users.json
+
+    Args:
+        count: Number of users
+        data_dir: Directory the server is started with (DATA_DIR)
+
+    Returns:
+        str: Path of the installed users.json
+    """
+    os.makedirs(data_dir, exist_ok=True)
+    target = os.path.join(data_dir, 'users.json')
+    shutil.copyfile(fixture_path(count), target)
+    return target
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', default='1k', help="fixture size: 1k, 100k, 1m or a number")
+    parser.add_argument('--data-dir', help="also install the fixture as DIR/users.json")
+    args = parser.parse_args(argv)
+
+    count = parse_size(args.users)
+    path = fixture_path(count)
+    if args.data_dir:
+        path = install(count, args.data_dir)
+    print(path)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,474 @@
+"""
+HTTP benchmark of the main API flows
+
+Drives the app in-process through the Flask test client (default), or
+a running server with --url. In-process runs copy the fixture into a
+temporary DATA_DIR with rate limiting off, and also time the user
+store calls load_users, get_user and save_users directly.
+
+    python -m benchmarks.http_bench --users 100k --backend json
+    python -m benchmarks.http_bench --users 1m --scenarios login,me --requests 5000
+    python -m benchmarks.http_bench --url http://127.0.0.1:5000 --users 100k
+
+For --url, start the server with DATA_DIR holding the same fixture
+(python -m benchmarks.fixtures --users 100k --data-dir DIR) and
+RATE_LIMIT_ENABLED=0.
+
+Results are printed and saved as JSON (see benchmarks.compare).
+"""
+import argparse
+import atexit
+import datetime
+import http.client
+import http.cookies
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import uuid
+import zlib
+from benchmarks.fixtures import (PASSWORD, ADMIN_USERNAME, parse_size, username_for,
+                                 is_regular, install)
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+SCENARIOS = ('login', 'register', 'me', 'update_username', 'update_profile_picture', 'admin_suspend')
+
+class _Transport:
+    """Cookie-carrying client that adds the CSRF header JWT cookies require"""
+    def cookie(self, name):
+        raise NotImplementedError
+
+    def send(self, method, path, body, headers):
+        raise NotImplementedError
+
+    def call(self, method, path, json_body=None, files=None):
+        """
+        Send one request
+
+        Args:
+            method: HTTP method
+            path: Request path
+            json_body: Optional JSON body
+            files: Optional {field: (filename, bytes)} sent as multipart
+
+        Returns:
+            int: Response status code
+        """
+        headers = {}
+        body = None
+        if method != 'GET':
+            csrf = self.cookie('csrf_access_token')
+            if csrf:
+                headers['X-CSRF-TOKEN'] = csrf
+        if files:
+            body, headers['Content-Type'] = _multipart(files)
+        elif json_body is not None:
+            body = json.dumps(json_body).encode()
+            headers['Content-Type'] = 'application/json'
+        return self.send(method, path, body, headers)
+
+class TestClientTransport(_Transport):
+    """Requests through the Flask test client, no sockets involved"""
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def cookie(self, name):
+        if hasattr(self.client, 'get_cookie'):
+            cookie = self.client.get_cookie(name)
+            return cookie.value if cookie else None
+        for cookie in self.client.cookie_jar or ():
+            if cookie.name == name:
+                return cookie.value
+        return None
+
+    def send(self, method, path, body, headers):
+        response = self.client.open(path, method=method, data=body, headers=headers)
+        status = response.status_code
+        response.close()
+        return status
+
+class HttpTransport(_Transport):
+    """
+    Requests to a running server over one keep-alive connection
+
+    Cookies are kept by hand: the JWT cookies are marked Secure, which
+    a standard cookie jar would not send back over plain HTTP
+    """
+    def __init__(self, url):
+        parsed = urllib.parse.urlsplit(url)
+        connection_class = http.client.HTTPSConnection if parsed.scheme == 'https' else http.client.HTTPConnection
+        self.connection = connection_class(parsed.hostname, parsed.port)
+        self.prefix = parsed.path.rstrip('/')
+        self.cookies = {}
+        self.last_body = None
+
+    def cookie(self, name):
+        return self.cookies.get(name)
+
+    def send(self, method, path, body, headers):
+        if self.cookies:
+            headers['Cookie'] = '; '.join(f"{name}={value}" for name, value in self.cookies.items())
+        try:
+            self.connection.request(method, self.prefix + path, body=body, headers=headers)
+            response = self.connection.getresponse()
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            # The server closed the idle connection, retry once on a new one
+            self.connection.close()
+            self.connection.request(method, self.prefix + path, body=body, headers=headers)
+            response = self.connection.getresponse()
+        self.last_body = response.read()
+
+        for header in response.headers.get_all('Set-Cookie') or ():
+            for name, morsel in http.cookies.SimpleCookie(header).items():
+                if morsel.value:
+                    self.cookies[name] = morsel.value
+                else:
+                    self.cookies.pop(name, None)
+        return response.status
+
+def _multipart(files):
+    boundary = uuid.uuid4().hex
+    parts = []
+    for field, (filename, content) in files.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+                     f'Content-Type: application/octet-stream\r\n\r\n'.encode() + content + b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+def _png(width, height, seed):
+    """Build a valid RGB PNG whose content differs per seed"""
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+    rng = random.Random(seed)
+    row = bytes(rng.randrange(256) for _ in range(width * 3))
+    raw = b''.join(b'\x00' + row for _ in range(height))
+    return (b'\x89PNG\r\n\x1a\n'
+            + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(raw))
+            + chunk(b'IEND', b''))
+
+class _Context:
+    """What scenarios need to set up their workers"""
+    def __init__(self, new_transport, users):
+        self.new_transport = new_transport
+        self.users = users
+        self.run_id = uuid.uuid4().hex[:8]
+        self._next_user = 1
+        self._lock = threading.Lock()
+
+    def take_user(self):
+        """Reserve a fixture user no other worker or scenario touches"""
+        with self._lock:
+            index = self._next_user
+            while not is_regular(index):
+                index += 1
+            if index >= self.users:
+                raise RuntimeError('Not enough fixture users for this many workers')
+            self._next_user = index + 1
+            return index
+
+    def login(self, username):
+        transport = self.new_transport()
+        status = transport.call('POST', '/api/auth/login', {'username': username, 'password': PASSWORD})
+        if status != 200:
+            raise RuntimeError(f"Could not log in as {username}: HTTP {status}")
+        return transport
+
+# Each scenario sets up one worker and returns its operation, called
+# with the iteration number and returning the response status
+
+def _scenario_login(ctx, worker):
+    transport = ctx.new_transport()
+    rng = random.Random(worker)
+    def op(i):
+        index = rng.randrange(1, ctx.users)
+        while not is_regular(index):
+            index = rng.randrange(1, ctx.users)
+        return transport.call('POST', '/api/auth/login', {'username': username_for(index), 'password': PASSWORD})
+    return op
+
+def _scenario_register(ctx, worker):
+    transport = ctx.new_transport()
+    def op(i):
+        username = f"bench_new_{ctx.run_id}_{worker}_{i}"
+        return transport.call('POST', '/api/auth/register', {'username': username, 'password': PASSWORD})
+    return op
+
+def _scenario_me(ctx, worker):
+    transport = ctx.login(username_for(ctx.take_user()))
+    return lambda i: transport.call('GET', '/api/user/me')
+
+def _scenario_update_username(ctx, worker):
+    username = username_for(ctx.take_user())
+    transport = ctx.login(username)
+    names = (f"{username}_{ctx.run_id}", username)
+    return lambda i: transport.call('POST', '/api/user/update-username', {'new_username': names[i % 2]})
+
+def _scenario_update_profile_picture(ctx, worker):
+    transport = ctx.login(username_for(ctx.take_user()))
+    def op(i):
+        image = _png(64, 64, f"{ctx.run_id}-{worker}-{i}")
+        return transport.call('POST', '/api/user/update-profile-picture',
+                              files={'profile_picture': ('avatar.png', image)})
+    return op
+
+def _scenario_admin_suspend(ctx, worker):
+    transport = ctx.login(ADMIN_USERNAME)
+    target = username_for(ctx.take_user())
+    paths = ('/api/admin/suspend', '/api/admin/unsuspend')
+    return lambda i: transport.call('POST', paths[i % 2], {'username': target})
+
+_SCENARIO_SETUP = {name: globals()[f"_scenario_{name}"] for name in SCENARIOS}
+
+def summarize(latencies, errors, wall):
+    """
+    Summarize latencies in seconds
+
+    Args:
+        latencies: Latencies in seconds
+        errors: Number of failed operations
+        wall: Seconds the operations took in total
+
+    Returns:
+        dict: Count, errors, p50/p95/p99/mean/max in milliseconds and requests per second
+    """
+    count = len(latencies)
+    result = {'requests': count, 'errors': errors, 'seconds': round(wall, 4),
+              'rps': round(count / wall, 1) if wall > 0 else None}
+    if count >= 2:
+        cuts = statistics.quantiles(latencies, n=100, method='inclusive')
+        result.update(p50_ms=cuts[49] * 1000, p95_ms=cuts[94] * 1000, p99_ms=cuts[98] * 1000)
+    elif count:
+        result.update(p50_ms=latencies[0] * 1000, p95_ms=latencies[0] * 1000, p99_ms=latencies[0] * 1000)
+    if count:
+        result.update(mean_ms=statistics.fmean(latencies) * 1000, max_ms=max(latencies) * 1000)
+    for key in ('p50_ms', 'p95_ms', 'p99_ms', 'mean_ms', 'max_ms'):
+        if key in result:
+            result[key] = round(result[key], 3)
+    return result
+
+def run_scenario(name, ctx, requests, concurrency, warmup, expected=200):
+    """
+    Run one scenario with a number of concurrent workers
+
+    Setup (logins) and warmup requests are not timed. Throughput is
+    measured from the moment all workers are ready until the last
+    one finishes.
+
+    Args:
+        name: Scenario name from SCENARIOS
+        ctx: Benchmark context
+        requests: Total timed requests across all workers
+        concurrency: Number of worker threads
+        warmup: Untimed requests per worker before measuring
+        expected: Status code that counts as success
+
+    Returns:
+        dict: Summary from summarize
+    """
+    ops = [_SCENARIO_SETUP[name](ctx, worker) for worker in range(concurrency)]
+    shares = [requests // concurrency + (worker < requests % concurrency) for worker in range(concurrency)]
+    latencies = [[] for _ in range(concurrency)]
+    errors = [0] * concurrency
+    ready = threading.Barrier(concurrency + 1)
+
+    def work(worker):
+        op = ops[worker]
+        for i in range(warmup):
+            op(i)
+        ready.wait()
+        timings = latencies[worker]
+        # Continue the iteration numbers, alternating scenarios stay in step
+        for i in range(warmup, warmup + shares[worker]):
+            started = time.perf_counter()
+            status = op(i)
+            timings.append(time.perf_counter() - started)
+            if status != expected:
+                errors[worker] += 1
+
+    threads = [threading.Thread(target=work, args=(worker,)) for worker in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    ready.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    result = summarize([value for timings in latencies for value in timings], sum(errors), wall)
+    result['concurrency'] = concurrency
+    return result
+
+def _time_calls(fn, iterations):
+    latencies = []
+    started = time.perf_counter()
+    for i in range(iterations):
+        call_started = time.perf_counter()
+        fn(i)
+        latencies.append(time.perf_counter() - call_started)
+    return summarize(latencies, 0, time.perf_counter() - started)
+
+def run_store(users, lookups, iterations):
+    """
+    Time the user store functions directly
+
+    Args:
+        users: Number of fixture users
+        lookups: Number of get_user calls
+        iterations: Number of load_users and save_users calls
+
+    Returns:
+        dict: Operation -> summary
+    """
+    from utils.userutils import get_user, load_users, save_users
+
+    results = {}
+    # The first lookup also loads or opens the store
+    results['first_get_user'] = _time_calls(lambda i: get_user(ADMIN_USERNAME), 1)
+
+    rng = random.Random(0)
+    names = [username_for(rng.randrange(users)) for _ in range(lookups)]
+    results['get_user'] = _time_calls(lambda i: get_user(names[i]), lookups)
+
+    snapshot = []
+    def load(i):
+        snapshot[:] = [load_users()]
+    results['load_users'] = _time_calls(load, iterations)
+    results['save_users'] = _time_calls(lambda i: save_users(snapshot[0]), iterations)
+    return results
+
+def git_revision():
+    """
+    Get the commit the benchmark runs on
+
+    Returns:
+        tuple: (commit hash, whether tracked files are modified), both None outside git
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=root, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=root,
+                                    capture_output=True, text=True, check=True).stdout.strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+def _prepare_app(users, backend, data_dir):
+    """Point the app at a fixture copy, import it and return (app, setup timings)"""
+    setup = {}
+    started = time.perf_counter()
+    install(users, data_dir)
+    setup['install_seconds'] = round(time.perf_counter() - started, 3)
+
+    # Read by utils.config at import, so set before the app is imported
+    os.environ.update({
+        'DATA_DIR': data_dir,
+        'PROFILE_PICTURES_DIR': os.path.join(data_dir, 'pfps'),
+        'PROFILES_DIR': os.path.join(data_dir, 'profiles'),
+        'SHARED_STATE_DB': os.path.join(data_dir, 'shared_state.db'),
+        'USERS_DB_FILE': os.path.join(data_dir, 'users.db'),
+        'USER_STORAGE_BACKEND': backend,
+        'RATE_LIMIT_ENABLED': '0',
+    })
+    os.environ.setdefault('LOG_LEVEL', 'ERROR')
+
+    import main
+    if backend == 'sqlite':
+        from utils.userutils import migrate_users_to_sqlite
+        started = time.perf_counter()
+        migrate_users_to_sqlite()
+        setup['migrate_seconds'] = round(time.perf_counter() - started, 3)
+    return main.app, setup
+
+def _print_results(results):
+    print(f"\n{'scenario':<28}{'requests':>9}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'rps':>10}")
+    rows = [(name, summary) for name, summary in results['scenarios'].items()]
+    rows += [(f"store.{name}", summary) for name, summary in results.get('store', {}).items()]
+    for name, summary in rows:
+        print(f"{name:<28}{summary['requests']:>9}{summary['errors']:>8}"
+              f"{summary.get('p50_ms', 0):>10.3f}{summary.get('p95_ms', 0):>10.3f}"
+              f"{summary.get('p99_ms', 0):>10.3f}{summary['rps'] or 0:>10.1f}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', default='1k', help="fixture size: 1k, 100k, 1m or a number")
+    parser.add_argument('--backend', choices=('json', 'sqlite'), default='json', help="user store backend")
+    parser.add_argument('--url', help="benchmark a running server instead of the test client")
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help="comma-separated subset of: " + ', '.join(SCENARIOS))
+    parser.add_argument('--requests', type=int, default=500, help="timed requests per scenario")
+    parser.add_argument('--concurrency', type=int, default=1, help="worker threads per scenario")
+    parser.add_argument('--warmup', type=int, default=10, help="untimed requests per worker")
+    parser.add_argument('--lookups', type=int, default=10000, help="direct get_user calls")
+    parser.add_argument('--store-iterations', type=int, default=3, help="direct load_users/save_users calls, 0 to skip")
+    parser.add_argument('--output', help="results file, defaults to benchmarks/results/<time>-<commit>-<users>-<backend>.json")
+    parser.add_argument('--keep-data', action='store_true', help="keep the temporary DATA_DIR")
+    args = parser.parse_args(argv)
+
+    users = parse_size(args.users)
+    scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    if args.concurrency < 1 or args.requests < 1:
+        parser.error('--requests and --concurrency must be positive')
+
+    commit, dirty = git_revision()
+    results = {
+        'meta': {
+            'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+            'commit': commit,
+            'dirty': dirty,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'users': users,
+            'backend': args.backend if not args.url else None,
+            'transport': 'http' if args.url else 'test_client',
+            'url': args.url,
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+            'warmup': args.warmup,
+        },
+        'scenarios': {},
+    }
+
+    if args.url:
+        ctx = _Context(lambda: HttpTransport(args.url), users)
+    else:
+        data_dir = tempfile.mkdtemp(prefix='chat-bench-')
+        if not args.keep_data:
+            # Registered before the app is imported so it runs after the
+            # app's own exit handlers have flushed their pending writes
+            atexit.register(shutil.rmtree, data_dir, True)
+        app, results['setup'] = _prepare_app(users, args.backend, data_dir)
+        ctx = _Context(lambda: TestClientTransport(app), users)
+        if args.store_iterations:
+            print(f"Timing user store with {users} users...", file=sys.stderr)
+            results['store'] = run_store(users, args.lookups, args.store_iterations)
+
+    for name in scenarios:
+        print(f"Running {name}...", file=sys.stderr)
+        results['scenarios'][name] = run_scenario(name, ctx, args.requests, args.concurrency, args.warmup)
+
+    output = args.output
+    if not output:
+        stamp = datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+        output = os.path.join(RESULTS_DIR, f"{stamp}-{(commit or 'nogit')[:10]}-{users}-{results['meta']['backend'] or 'http'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    _print_results(results)
+    print(f"\nSaved {output}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,462 @@
+"""
+Socket.IO load harness
+
+Opens many python-socketio clients against a server, registers them
+and measures:
+
+- connect and register_user latency
+- force_logout delivery for bulk and single suspensions and for
+  password changes, from the moment the HTTP request is sent until
+  each of the user's clients has the event
+- server and client memory per connection
+- how long the server takes to process a storm of clients that all
+  disconnect and reconnect at once, read from the admin metrics
+
+By default a server is started on a free local port with a copy of
+the fixture and rate limiting off:
+
+    python -m benchmarks.socketio_load --clients 2000 --users 100k
+
+Or against a running server started with the same fixture and
+RATE_LIMIT_ENABLED=0 (memory is then only measured with --server-pid):
+
+    python -m benchmarks.socketio_load --url http://127.0.0.1:5000 --clients 500
+
+Every client runs its own threads, so thousands of clients need a
+matching thread limit (ulimit -u) and file descriptor limit (ulimit -n).
+"""
+import argparse
+import atexit
+import datetime
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import socketio
+from benchmarks.fixtures import PASSWORD, ADMIN_USERNAME, parse_size, username_for, is_regular, install
+from benchmarks.http_bench import HttpTransport, RESULTS_DIR, summarize, git_revision
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CHANGED_PASSWORD = 'bench456'
+
+def _rss_bytes(pid):
+    """Resident memory of a process, or None where /proc is unavailable"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+class LoadClient:
+    """One Socket.IO connection registered as a fixture user"""
+    def __init__(self, url, username):
+        self.url = url
+        self.username = username
+        self.sio = socketio.Client(reconnection=False)
+        self.registered = threading.Event()
+        self.logouts = []  # (perf_counter time, reason)
+        self._condition = threading.Condition()
+        self.sio.on('registration_confirmed', lambda data: self.registered.set())
+        self.sio.on('force_logout', self._on_force_logout)
+
+    def _on_force_logout(self, data):
+        received = time.perf_counter()
+        with self._condition:
+            self.logouts.append((received, (data or {}).get('reason')))
+            self._condition.notify_all()
+
+    def connect(self, timeout):
+        """Connect over WebSocket and return the seconds it took"""
+        started = time.perf_counter()
+        self.sio.connect(self.url, transports=['websocket'], wait_timeout=timeout)
+        return time.perf_counter() - started
+
+    def register(self, timeout):
+        """Send register_user and return the seconds until it was confirmed, None on timeout"""
+        self.registered.clear()
+        started = time.perf_counter()
+        self.sio.emit('register_user', {'username': self.username})
+        if not self.registered.wait(timeout):
+            return None
+        return time.perf_counter() - started
+
+    def wait_logout(self, reason, since, timeout):
+        """
+        Wait for a force_logout received after a point in time
+
+        Args:
+            reason: Expected reason field
+            since: perf_counter time the trigger was sent
+            timeout: Maximum seconds to wait
+
+        Returns:
+            float: Seconds from `since` until the event arrived, None on timeout
+        """
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while True:
+                for received, received_reason in self.logouts:
+                    if received >= since and received_reason == reason:
+                        return received - since
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._condition.wait(remaining)
+
+    def disconnect(self):
+        if self.sio.connected:
+            self.sio.disconnect()
+
+class LocalServer:
+    """The app served on a free local port from a temporary DATA_DIR"""
+    def __init__(self, users):
+        self.users = users
+        self.data_dir = tempfile.mkdtemp(prefix='chat-socketio-')
+        self.process = None
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            self.port = sock.getsockname()[1]
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.log_path = os.path.join(self.data_dir, 'server.log')
+
+    def start(self, timeout=120):
+        install(self.users, self.data_dir)
+        env = dict(os.environ,
+                   DATA_DIR=self.data_dir,
+                   PROFILE_PICTURES_DIR=os.path.join(self.data_dir, 'pfps'),
+                   PROFILES_DIR=os.path.join(self.data_dir, 'profiles'),
+                   SHARED_STATE_DB=os.path.join(self.data_dir, 'shared_state.db'),
+                   USERS_DB_FILE=os.path.join(self.data_dir, 'users.db'),
+                   RATE_LIMIT_ENABLED='0')
+        env.setdefault('LOG_LEVEL', 'ERROR')
+        with open(self.log_path, 'wb') as log:
+            self.process = subprocess.Popen([sys.executable, '-m', 'benchmarks.socketio_load', '--serve', str(self.port)],
+                                            cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"Server exited with status {self.process.returncode}, see {self.log_path}")
+            try:
+                if HttpTransport(self.url).call('GET', '/login') == 200:
+                    return
+            except OSError:
+                pass
+            time.sleep(0.2)
+        raise RuntimeError(f"Server did not start within {timeout}s, see {self.log_path}")
+
+    def stop(self):
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        shutil.rmtree(self.data_dir, ignore_errors=True)
+
+def _serve(port):
+    import main
+    main.socketio.run(main.app, host='127.0.0.1', port=port, allow_unsafe_werkzeug=True, log_output=False)
+
+def _login(url, username, password=PASSWORD):
+    transport = HttpTransport(url)
+    status = transport.call('POST', '/api/auth/login', {'username': username, 'password': password})
+    if status != 200:
+        raise RuntimeError(f"Could not log in as {username}: HTTP {status}")
+    return transport
+
+def _read_metrics(admin):
+    """Fetch the admin metrics as {'name{labels}': value}"""
+    if admin.call('GET', '/api/admin/metrics') != 200:
+        raise RuntimeError('Could not read /api/admin/metrics')
+    values = {}
+    for line in admin.last_body.decode().splitlines():
+        if line and not line.startswith('#'):
+            key, _, value = line.rpartition(' ')
+            values[key] = float(value)
+    return values
+
+_DISCONNECTS = 'socketio_events_total{event="disconnect"}'
+_REGISTERS = 'socketio_events_total{event="register_user"}'
+_REGISTERED = 'socketio_registered_sessions'
+
+class _MetricsWatcher(threading.Thread):
+    """Poll the metrics and note when each condition first holds"""
+    def __init__(self, admin, conditions, started, timeout, interval=0.05):
+        super().__init__(daemon=True)
+        self.admin = admin
+        self.conditions = conditions  # name -> predicate(metrics)
+        self.started = started
+        self.timeout = timeout
+        self.interval = interval
+        self.reached = {}  # name -> seconds after `started`
+
+    def run(self):
+        while len(self.reached) < len(self.conditions) and time.perf_counter() - self.started < self.timeout:
+            metrics = _read_metrics(self.admin)
+            now = time.perf_counter() - self.started
+            for name, predicate in self.conditions.items():
+                if name not in self.reached and predicate(metrics):
+                    self.reached[name] = round(now, 4)
+            time.sleep(self.interval)
+
+def _connect_all(clients, concurrency, timeout):
+    def connect(client):
+        try:
+            connected = client.connect(timeout)
+        except Exception:
+            return None, None
+        return connected, client.register(timeout)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(connect, clients))
+    wall = time.perf_counter() - started
+
+    connects = [connected for connected, _ in results if connected is not None]
+    registers = [registered for _, registered in results if registered is not None]
+    return {
+        'connect': summarize(connects, len(clients) - len(connects), wall),
+        'register_user': summarize(registers, len(clients) - len(registers), wall),
+    }
+
+def _await_fanout(targets, reason, since, timeout):
+    latencies = [client.wait_logout(reason, since, timeout) for client in targets]
+    delivered = [latency for latency in latencies if latency is not None]
+    return summarize(delivered, len(latencies) - len(delivered), max(delivered, default=0))
+
+def _suspend_bulk(url, admin, by_user, usernames, timeout):
+    targets = [client for username in usernames for client in by_user[username]]
+    started = time.perf_counter()
+    for start in range(0, len(usernames), 1000):
+        admin.call('POST', '/api/admin/suspend/bulk', {'usernames': usernames[start:start + 1000]})
+    request_seconds = time.perf_counter() - started
+    result = _await_fanout(targets, 'suspended', started, timeout)
+    result['request_seconds'] = round(request_seconds, 4)
+
+    restored = time.perf_counter()
+    for start in range(0, len(usernames), 1000):
+        admin.call('POST', '/api/admin/unsuspend/bulk', {'usernames': usernames[start:start + 1000]})
+    _await_fanout(targets, 'unsuspended', restored, timeout)
+    return result
+
+def _suspend_single(url, admin, by_user, usernames, timeout):
+    latencies, errors = [], 0
+    started_all = time.perf_counter()
+    for username in usernames:
+        started = time.perf_counter()
+        admin.call('POST', '/api/admin/suspend', {'username': username})
+        for client in by_user[username]:
+            latency = client.wait_logout('suspended', started, timeout)
+            if latency is None:
+                errors += 1
+            else:
+                latencies.append(latency)
+        restored = time.perf_counter()
+        admin.call('POST', '/api/admin/unsuspend', {'username': username})
+        for client in by_user[username]:
+            client.wait_logout('unsuspended', restored, timeout)
+    return summarize(latencies, errors, time.perf_counter() - started_all)
+
+def _password_changes(url, admin, by_user, usernames, timeout):
+    latencies, errors = [], 0
+    started_all = time.perf_counter()
+    for username in usernames:
+        transport = _login(url, username)
+        started = time.perf_counter()
+        transport.call('POST', '/api/password/change',
+                       {'current_password': PASSWORD, 'new_password': CHANGED_PASSWORD})
+        for client in by_user[username]:
+            latency = client.wait_logout('password_changed', started, timeout)
+            if latency is None:
+                errors += 1
+            else:
+                latencies.append(latency)
+        # Restore the fixture password for later runs
+        transport = _login(url, username, CHANGED_PASSWORD)
+        transport.call('POST', '/api/password/change',
+                       {'current_password': CHANGED_PASSWORD, 'new_password': PASSWORD})
+    return summarize(latencies, errors, time.perf_counter() - started_all)
+
+def _storm(url, admin, clients, concurrency, timeout):
+    """
+    All clients disconnect and reconnect at once
+
+    A graceful client disconnect blocks until the close handshake is
+    done, so each old connection is closed in the background while a
+    fresh client for the same user connects, the way a crowd of
+    browsers reconnects after a network blip
+
+    Returns:
+        tuple: (summary, the reconnected clients)
+    """
+    before = _read_metrics(admin)
+    count = len(clients)
+    conditions = {
+        'disconnects_processed_seconds': lambda m: m.get(_DISCONNECTS, 0) >= before.get(_DISCONNECTS, 0) + count,
+        'all_registered_seconds': lambda m: (m.get(_REGISTERS, 0) >= before.get(_REGISTERS, 0) + count
+                                             and m.get(_REGISTERED, 0) >= count),
+    }
+    closers = []
+
+    def reconnect(client):
+        closer = threading.Thread(target=client.disconnect)
+        closer.start()
+        closers.append(closer)
+        replacement = LoadClient(url, client.username)
+        started = time.perf_counter()
+        try:
+            replacement.connect(timeout)
+        except Exception:
+            return replacement, None
+        registered = replacement.register(timeout)
+        return replacement, None if registered is None else time.perf_counter() - started
+
+    started = time.perf_counter()
+    watcher = _MetricsWatcher(admin, conditions, started, timeout)
+    watcher.start()
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(reconnect, clients))
+    wall = time.perf_counter() - started
+    watcher.join(timeout)
+    for closer in closers:
+        closer.join()
+
+    reconnects = [latency for _, latency in results if latency is not None]
+    result = {'reconnect': summarize(reconnects, count - len(reconnects), wall)}
+    for name in conditions:
+        result[name] = watcher.reached.get(name)
+    return result, [replacement for replacement, _ in results]
+
+def _print_results(results):
+    print(f"\n{'phase':<32}{'count':>8}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    rows = list(results['connect'].items()) + list(results['fanout'].items())
+    for index, storm in enumerate(results['storms']):
+        rows.append((f"storm{index + 1}.reconnect", storm['reconnect']))
+    for name, summary in rows:
+        print(f"{name:<32}{summary['requests']:>8}{summary['errors']:>8}"
+              f"{summary.get('p50_ms', 0):>10.3f}{summary.get('p95_ms', 0):>10.3f}{summary.get('p99_ms', 0):>10.3f}")
+    for index, storm in enumerate(results['storms']):
+        print(f"storm{index + 1}: disconnects processed after {storm['disconnects_processed_seconds']}s, "
+              f"all registered after {storm['all_registered_seconds']}s")
+    memory = results['memory']
+    for side in ('server', 'client'):
+        if memory.get(f"{side}_bytes_per_connection") is not None:
+            print(f"{side} memory per connection: {memory[f'{side}_bytes_per_connection'] / 1024:.1f} KiB")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--url', help="use a running server instead of starting one")
+    parser.add_argument('--server-pid', type=int, help="pid of the --url server, for memory figures")
+    parser.add_argument('--users', default='1k', help="fixture size: 1k, 100k, 1m or a number")
+    parser.add_argument('--clients', type=int, default=200, help="concurrent Socket.IO clients")
+    parser.add_argument('--tabs', type=int, default=1, help="clients per user")
+    parser.add_argument('--connect-concurrency', type=int, default=50, help="clients connecting at the same time")
+    parser.add_argument('--bulk-suspend', type=int, default=100, help="users suspended in one bulk request")
+    parser.add_argument('--single-suspend', type=int, default=20, help="users suspended one request at a time")
+    parser.add_argument('--password-changes', type=int, default=10, help="users changing their password")
+    parser.add_argument('--storms', type=int, default=3, help="disconnect/reconnect storms")
+    parser.add_argument('--storm-concurrency', type=int, default=200, help="clients reconnecting at the same time")
+    parser.add_argument('--timeout', type=float, default=60, help="seconds to wait for any one event")
+    parser.add_argument('--output', help="results file, defaults to benchmarks/results/<time>-<commit>-socketio-<clients>.json")
+    parser.add_argument('--serve', type=int, metavar='PORT', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.serve:
+        _serve(args.serve)
+        return
+
+    users = parse_size(args.users)
+    user_count = -(-args.clients // args.tabs)
+    usernames = [username_for(index) for index in range(1, users) if is_regular(index)][:user_count]
+    if len(usernames) < user_count:
+        parser.error(f"{users} fixture users are not enough for {args.clients} clients")
+
+    server = None
+    if args.url:
+        url, server_pid = args.url, args.server_pid
+    else:
+        server = LocalServer(users)
+        atexit.register(server.stop)
+        print(f"Starting server on {server.url}...", file=sys.stderr)
+        server.start()
+        url, server_pid = server.url, server.process.pid
+
+    admin = _login(url, ADMIN_USERNAME)
+    commit, dirty = git_revision()
+    results = {
+        'meta': {
+            'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+            'commit': commit,
+            'dirty': dirty,
+            'url': args.url,
+            'users': users,
+            'clients': args.clients,
+            'tabs': args.tabs,
+        },
+    }
+
+    clients = [LoadClient(url, usernames[index // args.tabs]) for index in range(args.clients)]
+    by_user = {}
+    for client in clients:
+        by_user.setdefault(client.username, []).append(client)
+
+    server_before, client_before = _rss_bytes(server_pid) if server_pid else None, _rss_bytes(os.getpid())
+    print(f"Connecting {args.clients} clients...", file=sys.stderr)
+    results['connect'] = _connect_all(clients, args.connect_concurrency, args.timeout)
+    time.sleep(1)  # let late allocations settle before reading memory
+    server_after, client_after = _rss_bytes(server_pid) if server_pid else None, _rss_bytes(os.getpid())
+    connected = sum(1 for client in clients if client.sio.connected)
+    results['memory'] = {
+        'connected': connected,
+        'server_rss_before': server_before,
+        'server_rss_after': server_after,
+        'server_bytes_per_connection': (server_after - server_before) // connected
+        if server_before and server_after and connected else None,
+        'client_bytes_per_connection': (client_after - client_before) // connected
+        if client_before and client_after and connected else None,
+    }
+
+    # Disjoint users per phase, so one phase's events never count in another
+    print('Measuring force_logout fan-out...', file=sys.stderr)
+    remaining = list(by_user)
+    phases = (('suspend_bulk', _suspend_bulk, args.bulk_suspend),
+              ('suspend_single', _suspend_single, args.single_suspend),
+              ('password_change', _password_changes, args.password_changes))
+    results['fanout'] = {}
+    for name, run, count in phases:
+        targets, remaining = remaining[:count], remaining[count:]
+        if targets:
+            results['fanout'][name] = run(url, admin, by_user, targets, args.timeout)
+
+    results['storms'] = []
+    for index in range(args.storms):
+        print(f"Reconnect storm {index + 1}...", file=sys.stderr)
+        result, clients = _storm(url, admin, clients, args.storm_concurrency, args.timeout)
+        results['storms'].append(result)
+
+    with ThreadPoolExecutor(args.storm_concurrency) as pool:
+        list(pool.map(LoadClient.disconnect, clients))
+
+    output = args.output
+    if not output:
+        stamp = datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+        output = os.path.join(RESULTS_DIR, f"{stamp}-{(commit or 'nogit')[:10]}-socketio-{args.clients}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    _print_results(results)
+    print(f"\nSaved {output}")
+
+if __name__ == '__main__':
+    main()
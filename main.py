@@ -1,46 +1,60 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for
-from flask_jwt_extended import JWTManager, verify_jwt_in_request, get_jwt_identity
+from flask import Flask, render_template, request, jsonify, redirect, url_for, g
+from flask_jwt_extended import JWTManager
 from flask_socketio import SocketIO, emit, join_room, leave_room
 import os
-from utils.userutils import load_users, get_user
-from utils.authutils import is_session_valid
+import time
+import uuid
+from utils.userutils import load_users, get_user, migrate_users_to_sqlite
 from utils.responseutils import api_response
 from utils.config import Config
 from utils.logutils import log_error, log_info
-from utils.sessionutils import get_current_user
+from utils.sessionutils import get_current_user, get_request_user, prune_revocations
+from utils.ratelimit import rate_limit
+from utils.presenceutils import PresenceRegistry
+from utils.socketqueue import socketio_queue_options, queue_enabled
+from utils.pfputils import send_profile_picture
+from utils.profiler import profiler
+from utils.metrics import (registry, http_requests_total, http_request_duration_seconds,
+                           http_requests_in_flight, socketio_events_total, socketio_connected_sids)
 
 app = Flask(__name__)
 Config.init_app(app)
 
 jwt = JWTManager(app)
 socketio = SocketIO(app, cors_allowed_origins="*", logger=False, engineio_logger=False, 
-                   ping_timeout=60, ping_interval=60000)
+                   ping_timeout=60, ping_interval=60000, **socketio_queue_options())
 
-user_sessions = {}
+user_sessions = PresenceRegistry()
+registry.gauge('socketio_registered_sessions', 'Socket.IO sessions registered to a user on this process',
+               callback=user_sessions.session_count)
 
 @socketio.on('connect')
 def handle_connect():
-    log_info(f"Client connected with SID: {request.sid}")
+    socketio_events_total.inc('connect')
+    socketio_connected_sids.inc()
+    log_info("Client connected with SID: %s", request.sid)
 
 @socketio.on('register_user')
 def handle_register_user(data):
+    socketio_events_total.inc('register_user')
     username = data.get('username')
     if username:
-        user_sessions[username] = request.sid
+        user_sessions.register(username, request.sid)
         join_room(username)
-        log_info(f"User {username} registered with session {request.sid}")
+        log_info("User %s registered with session %s", username, request.sid)
         emit('registration_confirmed', {'username': username, 'status': 'registered'}, room=request.sid)
 
 @socketio.on('disconnect')
 def handle_disconnect():
-    log_info(f"Client disconnected: {request.sid}")
-    for username, sid in list(user_sessions.items()):
-        if sid == request.sid:
-            del user_sessions[username]
-            log_info(f"User {username} disconnected")
-            break
+    socketio_events_total.inc('disconnect')
+    socketio_connected_sids.dec()
+    log_info("Client disconnected: %s", request.sid)
+    username = user_sessions.unregister(request.sid)
+    if username:
+        log_info("User %s disconnected", username)
 
 @app.route('/api/test/emit', methods=['POST'])
+@rate_limit('api')
 def test_emit():
     data = request.get_json()
     username = data.get('username')
@@ -50,9 +64,10 @@ def test_emit():
     if not username:
         return api_response(False, 'Username required', status_code=400)
     
-    if username in user_sessions:
-        sid = user_sessions[username]
-        log_info(f"Emitting {event} to {username} with SID {sid}")
+    # With a message queue the user may be connected to another node
+    if username in user_sessions or queue_enabled():
+        sids = user_sessions.get_sids(username)
+        log_info("Emitting %s to %s with SIDs %s", event, username, sids)
         socketio.emit(event, payload, room=username)
         return api_response(True, f'Event {event} emitted to {username}')
     else:
@@ -75,6 +90,10 @@ app.register_blueprint(password_bp, url_prefix='/api/password')
 def index():
     return render_template('index.html')
 
+@app.route('/static/pfps/<path:filename>')
+def profile_picture(filename):
+    return send_profile_picture(filename)
+
 @app.route('/login')
 def login():
     message = request.args.get('message')
@@ -87,24 +106,24 @@ def register():
 @app.route('/dashboard')
 def dashboard():
     try:
-        verify_jwt_in_request()
-        current_user = get_jwt_identity()
-        if current_user and is_session_valid(current_user):
+        user, session_valid = get_request_user()
+        if user and session_valid:
+            current_user = user['username']
             return render_template('dashboard.html', username=current_user)
     except Exception as e:
-        log_error(f"Dashboard access error: {str(e)}")
+        log_error("Dashboard access error: %s", e)
     
     return redirect(url_for('login'))
 
 @app.route('/profile_settings')
 def profile_settings():
     try:
-        verify_jwt_in_request()
-        current_user = get_jwt_identity()
-        if current_user and is_session_valid(current_user):
+        user, session_valid = get_request_user()
+        if user and session_valid:
+            current_user = user['username']
             return render_template('profile_settings.html', current_user={'username': current_user})
     except Exception as e:
-        log_error(f"Profile settings access error: {str(e)}")
+        log_error("Profile settings access error: %s", e)
     
     return redirect(url_for('login'))
 
@@ -118,18 +137,56 @@ def logout():
     resp = api_response(True, 'Logout successful')
     return logout_user(resp), 200
 
+@app.cli.command('migrate-users')
+def migrate_users_command():
+    """Import data/users.json into the SQLite user store"""
+    count = migrate_users_to_sqlite()
+    print(f"Imported {count} users into {Config.USERS_DB_FILE}")
+
+@app.cli.command('prune-revocations')
+def prune_revocations_command():
+    """Drop revoked-session records of deleted users"""
+    count = prune_revocations()
+    print(f"Pruned {count} deleted users")
+
+@app.errorhandler(413)
+def handle_request_too_large(e):
+    return api_response(False, 'Request is too large', status_code=413)
+
 @app.errorhandler(Exception)
 def handle_exception(e):
-    log_error(f"Unhandled exception: {str(e)}")
+    log_error("Unhandled exception: %s", e, exc_info=True)
     return api_response(False, 'An unexpected error occurred', status_code=500)
 
+@app.before_request
+def before_request():
+    # Attached to every log record of the request, see utils.logutils
+    g.request_id = request.headers.get('X-Request-ID', '')[:128] or uuid.uuid4().hex
+    g.request_started = time.perf_counter()
+    g.metric_labels = (request.blueprint or '', request.endpoint or '')
+    http_requests_in_flight.inc(*g.metric_labels)
+    profiler.begin_request(request)
+
 @app.after_request
 def after_request(response):
+    response.headers['X-Request-ID'] = g.get('request_id', '')
+    log_info("%s %s %s", request.method, request.path, response.status_code)
+    labels = g.get('metric_labels')
+    if labels is not None:
+        http_requests_total.inc(*labels, request.method, str(response.status_code))
+        http_request_duration_seconds.observe(time.perf_counter() - g.request_started, *labels)
     response.headers.add('Access-Control-Allow-Origin', request.headers.get('Origin', '*'))
     response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization')
     response.headers.add('Access-Control-Allow-Methods', 'GET,PUT,POST,DELETE,OPTIONS')
     response.headers.add('Access-Control-Allow-Credentials', 'true')
     return response
 
+@app.teardown_request
+def teardown_request(exc):
+    profiler.end_request()
+    labels = g.pop('metric_labels', None)
+    if labels is not None:
+        http_requests_in_flight.dec(*labels)
+
 if __name__ == '__main__':
     socketio.run(app, host='0.0.0.0', port=5000, debug=True)
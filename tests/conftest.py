@@ -0,0 +1,12 @@
+import os
+import sys
+import tempfile
+
+# Point the app at a scratch data directory before utils.config is imported;
+# spawned worker processes inherit it through the environment
+os.environ.setdefault('DATA_DIR', tempfile.mkdtemp(prefix='chat-tests-'))
+os.environ.setdefault('SESSION_STORE', 'memory')
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
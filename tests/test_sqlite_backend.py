@@ -0,0 +1,106 @@
+import multiprocessing
+import os
+import threading
+
+import pytest
+
+from utils.userutils import SqliteUserBackend, UsernameTaken
+
+def _backend(directory):
+    return SqliteUserBackend(os.path.join(directory, 'users.db'))
+
+def _add_from_threads(directory, worker, threads, count):
+    backend = _backend(directory)
+
+    def add(thread):
+        for index in range(count):
+            backend.add_user({'username': f"p{worker}_t{thread}_{index}", 'password': 'x'}, wait=True)
+
+    pool = [threading.Thread(target=add, args=(thread,)) for thread in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+
+def test_concurrent_inserts_get_unique_ids(tmp_path):
+    context = multiprocessing.get_context('spawn')
+    processes = [context.Process(target=_add_from_threads, args=(str(tmp_path), worker, 4, 10))
+                 for worker in range(3)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(120)
+        assert process.exitcode == 0
+
+    users = _backend(str(tmp_path)).load_users()
+    assert sorted(user['id'] for user in users) == list(range(1, 3 * 4 * 10 + 1))
+    assert len({user['username'] for user in users}) == len(users)
+
+def test_insert_never_replaces_an_existing_user(tmp_path):
+    backend = _backend(str(tmp_path))
+    alice = backend.add_user({'username': 'alice', 'password': 'x'}, wait=True)
+
+    with pytest.raises(UsernameTaken):
+        backend.add_user({'username': 'alice', 'password': 'y'}, wait=True)
+    with pytest.raises(UsernameTaken):
+        backend.add_user({'id': alice['id'], 'username': 'bob', 'password': 'y'}, wait=True)
+
+    users = backend.load_users()
+    assert [(user['id'], user['username'], user['password']) for user in users] == [(alice['id'], 'alice', 'x')]
+
+def test_rename_to_taken_username_fails(tmp_path):
+    backend = _backend(str(tmp_path))
+    backend.add_user({'username': 'alice', 'password': 'x'}, wait=True)
+    bob = backend.add_user({'username': 'bob', 'password': 'x'}, wait=True)
+
+    with pytest.raises(UsernameTaken):
+        backend.update_user(bob['id'], {'username': 'alice'})
+
+    assert backend.get_user('alice')['id'] != bob['id']
+    assert backend.update_user(bob['id'], {'username': 'carol'})['username'] == 'carol'
+
+def test_failed_write_does_not_undo_its_batch(tmp_path):
+    backend = _backend(str(tmp_path))
+    backend.add_user({'username': 'alice', 'password': 'x'}, wait=True)
+    errors = []
+
+    def add(username):
+        try:
+            backend.add_user({'username': username, 'password': 'x'}, wait=True)
+        except UsernameTaken:
+            errors.append(username)
+
+    # Submitted together, so most of them share one group commit
+    pool = [threading.Thread(target=add, args=(username,)) for username in ['alice', 'bob', 'carol', 'dave']]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+
+    assert errors == ['alice']
+    assert sorted(user['username'] for user in backend.load_users()) == ['alice', 'bob', 'carol', 'dave']
+
+def test_save_users_keeps_lazy_cold_fields(tmp_path):
+    backend = _backend(str(tmp_path))
+    backend.add_user({'username': 'alice', 'password': 'hash', 'password_changed_at': 5, 'theme': 'dark'}, wait=True)
+
+    # Records from load_users fetch their cold fields only when accessed
+    assert backend.save_users(backend.load_users())
+
+    alice = _backend(str(tmp_path)).get_user('alice')
+    assert (alice['password'], alice['password_changed_at'], alice['theme']) == ('hash', 5, 'dark')
+
+def test_bulk_update_fails_rows_independently(tmp_path):
+    backend = _backend(str(tmp_path))
+    ids = [backend.add_user({'username': name, 'password': 'x'}, wait=True)['id'] for name in ['alice', 'bob', 'carol']]
+
+    results = backend.update_users([(ids[0], {'is_suspended': True}),
+                                    (ids[1], {'username': 'alice'}),
+                                    (999, {'is_suspended': True}),
+                                    (ids[2], {'is_suspended': True})], wait=True)
+
+    assert results[0]['is_suspended'] and results[3]['is_suspended']
+    assert isinstance(results[1], UsernameTaken)
+    assert results[2] is None
+    assert backend.get_user('bob')['id'] == ids[1]
+    assert [user['is_suspended'] for user in backend.load_users()] == [True, False, True]
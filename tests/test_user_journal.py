@@ -0,0 +1,209 @@
+import json
+import multiprocessing
+import os
+import threading
+
+import pytest
+
+from utils.config import Config
+from utils.metrics import user_store_duration_seconds
+from utils.userutils import JsonUserBackend, UsernameTaken
+
+def _backend(directory):
+    return JsonUserBackend(os.path.join(directory, 'users.json'), os.path.join(directory, 'users.journal'))
+
+def _reloaded(directory):
+    backend = _backend(directory)
+    return backend, backend.load_users()
+
+def _assert_consistent(backend, users):
+    usernames = [user['username'] for user in users]
+    assert len(set(usernames)) == len(usernames)
+    assert len({user['id'] for user in users}) == len(users)
+    for user in users:
+        assert backend.get_user(user['username'])['id'] == user['id']
+        assert backend.get_user(user['id'], 'id')['username'] == user['username']
+
+def _churn(directory, worker, operations):
+    """Add users and fight over a small pool of shared names"""
+    backend = _backend(directory)
+    mine = []
+    for step in range(operations):
+        if step % 4 == 0 or not mine:
+            mine.append(backend.add_user({'username': f"w{worker}_{step}", 'password': 'x'}, wait=True)['id'])
+        elif step % 4 == 1:
+            backend.update_user(mine[step % len(mine)], {'is_suspended': step % 2 == 0})
+        else:
+            try:
+                backend.update_user(mine[step % len(mine)], {'username': f"shared_{step % 5}"})
+            except UsernameTaken:
+                pass
+    backend.flush()
+    return len(mine)
+
+def _add_users(directory, worker, count):
+    backend = _backend(directory)
+    for index in range(count):
+        backend.add_user({'username': f"p{worker}_{index}", 'password': 'x'}, wait=True)
+    backend.flush()
+
+def _run_processes(target, args_list):
+    context = multiprocessing.get_context('spawn')
+    processes = [context.Process(target=target, args=args) for args in args_list]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(120)
+        assert process.exitcode == 0
+
+def test_concurrent_renames_never_share_a_username(tmp_path):
+    _run_processes(_churn, [(str(tmp_path), worker, 200) for worker in range(4)])
+
+    backend, users = _reloaded(str(tmp_path))
+    assert len(users) == 4 * 50
+    _assert_consistent(backend, users)
+
+def test_rename_to_taken_username_fails(tmp_path):
+    first, second = _backend(str(tmp_path)), _backend(str(tmp_path))
+    alice = first.add_user({'username': 'alice', 'password': 'x'}, wait=True)
+    bob = first.add_user({'username': 'bob', 'password': 'x'}, wait=True)
+    # Renamed through another process, so only the journal knows 'carol' is taken
+    second.update_user(alice['id'], {'username': 'carol'})
+
+    with pytest.raises(UsernameTaken):
+        first.update_user(bob['id'], {'username': 'carol'})
+
+    backend, users = _reloaded(str(tmp_path))
+    assert sorted(user['username'] for user in users) == ['bob', 'carol']
+    _assert_consistent(backend, users)
+
+def _add_from_threads(directory, worker, threads, count):
+    backend = _backend(directory)
+
+    def add(thread):
+        for index in range(count):
+            backend.add_user({'username': f"p{worker}_t{thread}_{index}", 'password': 'x'}, wait=True)
+
+    pool = [threading.Thread(target=add, args=(thread,)) for thread in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    backend.flush()
+
+def test_concurrent_inserts_get_unique_ids(tmp_path):
+    _run_processes(_add_from_threads, [(str(tmp_path), worker, 4, 10) for worker in range(3)])
+
+    backend, users = _reloaded(str(tmp_path))
+    assert sorted(user['id'] for user in users) == list(range(1, 3 * 4 * 10 + 1))
+    _assert_consistent(backend, users)
+
+def test_insert_of_existing_username_fails(tmp_path):
+    backend = _backend(str(tmp_path))
+    backend.add_user({'username': 'alice', 'password': 'x'}, wait=True)
+
+    with pytest.raises(UsernameTaken):
+        _backend(str(tmp_path)).add_user({'username': 'alice', 'password': 'y'}, wait=True)
+
+    _, users = _reloaded(str(tmp_path))
+    assert [(user['username'], user['password']) for user in users] == [('alice', 'x')]
+
+def test_replay_ignores_torn_and_corrupt_records(tmp_path):
+    backend = _backend(str(tmp_path))
+    backend.add_user({'username': 'alice', 'password': 'x'}, wait=True)
+    with open(os.path.join(str(tmp_path), 'users.journal'), 'ab') as f:
+        f.write(b'not json\n')
+        f.write(b'{"op":"insert","user":{"id":99,"userna')
+
+    writer, users = _reloaded(str(tmp_path))
+    assert [user['username'] for user in users] == ['alice']
+
+    # The next append replaces the torn tail instead of writing after it
+    writer.add_user({'username': 'bob', 'password': 'x'}, wait=True)
+    backend, users = _reloaded(str(tmp_path))
+    assert [(user['id'], user['username']) for user in users] == [(1, 'alice'), (2, 'bob')]
+    with open(os.path.join(str(tmp_path), 'users.journal'), 'rb') as f:
+        assert f.read().endswith(b'\n')
+
+def test_compaction_folds_journal_into_snapshot(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, 'USERS_JOURNAL_MAX_RECORDS', 5)
+    reader = _backend(str(tmp_path))
+    reader.load_users()
+
+    backend = _backend(str(tmp_path))
+    for index in range(12):
+        user = backend.add_user({'username': f"u{index}", 'password': 'x'}, wait=True)
+        backend.update_user(user['id'], {'is_suspended': True}, wait=True)
+
+    with open(os.path.join(str(tmp_path), 'users.json')) as f:
+        snapshot = json.load(f)
+    assert len(snapshot) >= 10
+    assert os.path.getsize(os.path.join(str(tmp_path), 'users.journal')) < 1000
+
+    # A process that loaded before the compactions follows the rotated journal
+    users = reader.load_users()
+    assert len(users) == 12
+    assert all(user['is_suspended'] for user in users)
+    _assert_consistent(reader, users)
+
+def test_replay_after_interrupted_compaction(tmp_path):
+    backend = _backend(str(tmp_path))
+    for index in range(3):
+        backend.add_user({'username': f"u{index}", 'password': 'x'}, wait=True)
+    backend.update_user(2, {'is_admin': True}, wait=True)
+
+    # The snapshot was written but the crash came before the journal was emptied
+    with open(os.path.join(str(tmp_path), 'users.json'), 'w') as f:
+        json.dump([dict(user) for user in backend.load_users()], f)
+
+    backend, users = _reloaded(str(tmp_path))
+    assert [user['username'] for user in users] == ['u0', 'u1', 'u2']
+    assert backend.get_user(2, 'id')['is_admin']
+    _assert_consistent(backend, users)
+
+def test_group_commit_persists_concurrent_updates(tmp_path):
+    backend = _backend(str(tmp_path))
+    ids = [backend.add_user({'username': f"u{index}", 'password': 'x'}, wait=True)['id'] for index in range(20)]
+
+    def update(user_id):
+        for round_ in range(10):
+            backend.update_user(user_id, {'logins': round_})
+
+    pool = [threading.Thread(target=update, args=(user_id,)) for user_id in ids]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    backend.flush()
+
+    _, users = _reloaded(str(tmp_path))
+    assert [user.get('logins') for user in users] == [9] * 20
+
+def test_bulk_update_fails_renames_independently(tmp_path):
+    backend = _backend(str(tmp_path))
+    ids = [backend.add_user({'username': name, 'password': 'x'}, wait=True)['id'] for name in ['alice', 'bob']]
+
+    results = backend.update_users([(ids[0], {'username': 'bob'}), (ids[1], {'username': 'carol'})], wait=True)
+
+    assert isinstance(results[0], UsernameTaken)
+    assert results[1]['username'] == 'carol'
+    _, users = _reloaded(str(tmp_path))
+    assert [user['username'] for user in users] == ['alice', 'carol']
+
+def _observations(operation):
+    counts, _ = user_store_duration_seconds.collect().get((operation,), ([0], 0.0))
+    return sum(counts)
+
+def test_commits_and_journal_appends_are_timed(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, 'USERS_JOURNAL_MAX_RECORDS', 2)
+    before = {operation: _observations(operation) for operation in ('commit', 'journal_append', 'compact')}
+
+    backend = _backend(str(tmp_path))
+    for index in range(3):
+        # Inserts append under the journal lock, updates go through the group committer
+        user = backend.add_user({'username': f"u{index}", 'password': 'x'}, wait=True)
+        backend.update_user(user['id'], {'is_suspended': True}, wait=True)
+
+    assert _observations('commit') >= before['commit'] + 3
+    assert _observations('journal_append') >= before['journal_append'] + 6
+    assert _observations('compact') > before['compact']
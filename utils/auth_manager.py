@@ -1,12 +1,11 @@
 from flask_jwt_extended import create_access_token, set_access_cookies, unset_jwt_cookies
-from werkzeug.security import check_password_hash
-from utils.userutils import load_users
-from utils.sessionutils import invalidate_session
+from utils.passwordutils import verify_password
+from utils.userutils import get_user
+from utils.sessionutils import token_claims
 from utils.logutils import log_error
 
 def authenticate_user(username, password):
-    users = load_users()
-    user = next((u for u in users if u['username'] == username), None)
+    user = get_user(username)
     
     if not user:
         return None, "Invalid username or password"
@@ -14,23 +13,35 @@ def authenticate_user(username, password):
     if user.get('is_suspended', False):
         return None, "Account suspended"
     
-    if not check_password_hash(user['password'], password):
+    if not verify_password(user['password'], password):
         return None, "Invalid username or password"
     
     return user, None
 
-def login_user(username, response):
+def create_user_token(user):
+    """
+    Create a JWT access token bound to the user's token generation
+    
+    Args:
+        user: User object the token is issued for
+        
+    Returns:
+        str: Encoded access token
+    """
+    return create_access_token(identity=user['username'], additional_claims=token_claims(user))
+
+def login_user(user, response):
     """
     Set JWT access token cookies on response object
     
     Args:
-        username: User identity for JWT token
+        user: User object the token is issued for
         response: Response object or tuple from api_response
         
     Returns:
         Response object with JWT cookies set
     """
-    access_token = create_access_token(identity=username)
+    access_token = create_user_token(user)
     
     # Fix for critical registration error - handle tuple response
     if isinstance(response, tuple):
@@ -39,7 +50,7 @@ def login_user(username, response):
     try:
         set_access_cookies(response, access_token)
     except Exception as e:
-        log_error(f"Error setting access cookies: {str(e)}")
+        log_error("Error setting access cookies: %s", e)
         
     return response
 
@@ -60,6 +71,6 @@ def logout_user(response):
     try:
         unset_jwt_cookies(response)
     except Exception as e:
-        log_error(f"Error unsetting JWT cookies: {str(e)}")
+        log_error("Error unsetting JWT cookies: %s", e)
     
     return response
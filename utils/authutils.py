@@ -1,11 +1,9 @@
-from utils.userutils import get_user
 from functools import wraps
-from flask_jwt_extended import get_jwt_identity, verify_jwt_in_request
 import re # Added import for validate_username
 from utils.logutils import log_error, log_info
 from flask import jsonify
 from .responseutils import api_response
-from .sessionutils import is_session_valid # Added import
+from .sessionutils import get_request_user
 
 # Moved from apiendpoints/auth.py
 def validate_username(username):
@@ -47,19 +45,17 @@ def auth_middleware():
             - If not authenticated: (None, error_response)
     """
     try:
-        verify_jwt_in_request()
-        username = get_jwt_identity()
+        user, session_valid = get_request_user()
         
-        if not is_session_valid(username):
+        if not session_valid:
             return None, api_response(False, 'Unauthorized', status_code=401)
             
-        user = get_user(username)
         if not user:
             return None, api_response(False, 'Unauthorized', status_code=401)
             
         return user, None
     except Exception as e:
-        log_error(f"Authentication error: {str(e)}")
+        log_error("Authentication error: %s", e)
         return None, api_response(False, 'Unauthorized', status_code=401)
 
 def admin_required(f):
@@ -74,8 +70,7 @@ def admin_required(f):
     """
     @wraps(f)
     def decorated(*args, **kwargs):
-        username = get_jwt_identity()
-        user = get_user(username)
+        user, _ = get_request_user()
         
         if not user or not user.get('is_admin', False):
             return api_response(False, 'Unauthorized', status_code=401)
@@ -14,9 +14,58 @@ class Config:
     JWT_ACCESS_TOKEN_EXPIRES_DAYS = 365
     SECRET_KEY = os.environ.get('SECRET_KEY', 'dev_secret_key')
     ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'webp'}
-    DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data')
-    PROFILE_PICTURES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'static', 'pfps')
+    DATA_DIR = os.environ.get('DATA_DIR', os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data'))
+    PROFILE_PICTURES_DIR = os.environ.get('PROFILE_PICTURES_DIR', os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'static', 'pfps'))
     USERS_FILE = os.path.join(DATA_DIR, 'users.json')
+    MAX_CONTENT_LENGTH = 8 * 1024 * 1024  # Larger request bodies are refused with a 413 before parsing
+    PROFILE_PICTURE_MAX_BYTES = 5 * 1024 * 1024
+    UPLOADS_DIR = os.path.join(DATA_DIR, 'uploads')  # Partial resumable uploads
+    UPLOAD_SESSION_TTL = 24 * 3600  # Seconds an unfinished resumable upload is kept
+    SHARED_STATE_DB = os.environ.get('SHARED_STATE_DB', os.path.join(DATA_DIR, 'shared_state.db'))
+    SESSION_STORE = os.environ.get('SESSION_STORE', 'sqlite')  # 'sqlite' (shared by workers) or 'memory'
+    SESSION_REVOCATION_CACHE_TTL = 1.0  # Max seconds before other workers see a revocation
+    SOCKETIO_MESSAGE_QUEUE = os.environ.get('SOCKETIO_MESSAGE_QUEUE')  # e.g. redis://localhost:6379/0 or sqlite:///path/queue.db
+    SOCKETIO_QUEUE_CHANNEL = os.environ.get('SOCKETIO_QUEUE_CHANNEL', 'chat-socketio')
+    SOCKETIO_EMIT_BATCH_SIZE = 500  # rooms addressed per multi-user emit
+    USERS_JOURNAL_FILE = os.path.join(DATA_DIR, 'users.journal')
+    USERS_JOURNAL_MAX_RECORDS = 1000  # Compact once the journal holds this many records
+    USERS_COMPACT_INTERVAL = 300  # Seconds between compactions of a non-empty journal
+    USERS_DB_FILE = os.environ.get('USERS_DB_FILE', os.path.join(DATA_DIR, 'users.db'))
+    USER_STORAGE_BACKEND = os.environ.get('USER_STORAGE_BACKEND', 'json')  # 'json' or 'sqlite'
+    USERS_COMMIT_INTERVAL = 0.005  # Seconds a group commit waits for more writes
+    USERS_COMMIT_BATCH_SIZE = 256  # Pending writes that force an immediate commit
+    USERS_COMMIT_TIMEOUT = 5  # Seconds a caller waits for its write to become durable
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))
+    PASSWORD_HASH_MAX_PENDING = int(os.environ.get('PASSWORD_HASH_MAX_PENDING', 32))  # Beyond this, requests get a 503
+    PASSWORD_HASH_TIMEOUT = 10  # Seconds a request waits for a hashing job
+    AVATAR_SIZES = (256, 64)  # Square WebP variants generated per profile picture, largest first
+    AVATAR_QUALITY = 80
+    AVATAR_MAX_PIXELS = 40_000_000  # Larger uploads are rejected before decoding
+    AVATAR_CACHE_MAX_AGE = 31536000  # Avatar variants are content-addressed, so clients may cache them for a year
+    AVATAR_UPLOAD_MAX_AGE = 300  # Uploads turn into their largest variant once processed, so they are cached briefly
+    AVATAR_WORKERS = int(os.environ.get('AVATAR_WORKERS', 1))
+    AVATAR_MAX_PENDING = int(os.environ.get('AVATAR_MAX_PENDING', 16))  # Beyond this, uploads keep the original
+    ADMIN_BULK_MAX_USERS = 1000  # Max users per bulk moderation request
+    ADMIN_USERS_PAGE_SIZE = 50  # Default page size of the admin user listing
+    ADMIN_USERS_PAGE_MAX = 1000
+    PROFILES_DIR = os.environ.get('PROFILES_DIR', os.path.join(DATA_DIR, 'profiles'))  # Output of the sampling profiler
+    PROFILER_INTERVAL = 0.005  # Default seconds between stack samples
+    PROFILER_MAX_DURATION = 600  # Longest profiling window an admin can request, in seconds
+    RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', '1') != '0'
+    RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'memory')  # 'memory' (per process) or 'mmap' (shared)
+    RATE_LIMIT_SHM_FILE = os.environ.get('RATE_LIMIT_SHM_FILE', os.path.join(
+        '/dev/shm' if os.path.isdir('/dev/shm') else DATA_DIR, 'chat_ratelimit.shm'))
+    RATE_LIMIT_SHM_SLOTS = 65536  # Fixed table size, 32 bytes per slot
+    RATE_LIMITS = {  # Policy name -> (requests, window in seconds)
+        'login': (5, 60),
+        'register': (10, 3600),
+        'password_change': (5, 300),
+        'profile_update': (10, 60),
+        'upload': (10, 60),
+        'admin': (120, 60),
+        'api': (300, 60),
+    }
     
     @classmethod
     def init_app(cls, app):
@@ -41,10 +90,12 @@ class Config:
             
             # Flask configuration
             app.config['SECRET_KEY'] = cls.SECRET_KEY
+            app.config['MAX_CONTENT_LENGTH'] = cls.MAX_CONTENT_LENGTH
             
             # Ensure directories exist
             os.makedirs(cls.DATA_DIR, exist_ok=True)
             os.makedirs(cls.PROFILE_PICTURES_DIR, exist_ok=True)
+            os.makedirs(cls.UPLOADS_DIR, exist_ok=True)
             
             # Initialize users file if it doesn't exist
             if not os.path.exists(cls.USERS_FILE):
@@ -53,5 +104,5 @@ class Config:
                     
             log_info("Application configuration initialized successfully")
         except Exception as e:
-            log_error(f"Error initializing application configuration: {str(e)}")
+            log_error("Error initializing application configuration: %s", e)
             raise
@@ -0,0 +1,85 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+class SqliteConnectionPool:
+    """
+    Per-thread SQLite connections in WAL mode
+
+    Each thread (and each forked worker process) gets its own
+    connection, so connections are never shared across threads.
+    Connections run in autocommit mode; use transaction() for
+    multi-statement writes.
+    """
+    def __init__(self, path, schema=None):
+        """
+        Initialize connection pool
+
+        Args:
+            path: Path of the SQLite database file
+            schema: Optional SQL script run once per new connection
+        """
+        self.path = path
+        self.schema = schema
+        self._local = threading.local()
+
+    def connection(self):
+        """
+        Get the calling thread's connection, opening it on first use
+
+        Returns:
+            sqlite3.Connection
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # Repeated SQL strings reuse the connection's prepared statement cache
+        conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False,
+                               timeout=30, cached_statements=256)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        if self.schema:
+            conn.executescript(self.schema)
+
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def execute(self, sql, params=()):
+        return self.connection().execute(sql, params)
+
+    @contextmanager
+    def transaction(self):
+        """
+        Run statements in a single write transaction
+
+        Yields:
+            sqlite3.Connection for the calling thread
+        """
+        conn = self.connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    @contextmanager
+    def snapshot(self):
+        """
+        Run reads against one consistent snapshot without taking the write lock
+
+        Yields:
+            sqlite3.Connection for the calling thread
+        """
+        conn = self.connection()
+        conn.execute('BEGIN DEFERRED')
+        try:
+            yield conn
+        finally:
+            conn.execute('COMMIT')
@@ -1,6 +1,7 @@
 from functools import wraps
 from utils.logutils import log_error
 from flask import jsonify
+from werkzeug.exceptions import HTTPException
 
 def api_error_handler(f):
     """
@@ -19,8 +20,11 @@ def api_error_handler(f):
     def decorated(*args, **kwargs):
         try:
             return f(*args, **kwargs)
+        except HTTPException:
+            # Left to the app's error handlers, e.g. 413 for oversized uploads
+            raise
         except Exception as e:
-            log_error(f"Error in {f.__name__}: {str(e)}")
+            log_error("Error in %s: %s", f.__name__, e)
             from utils.responseutils import api_response
             return api_response(False, 'An error occurred while processing your request', status_code=500)
     return decorated
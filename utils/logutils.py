@@ -1,15 +1,132 @@
+import atexit
+import datetime
+import json
 import logging
+import logging.handlers
 import os
+import queue
+import threading
+import time
+from flask import g, request, has_request_context
 
 log_level = os.environ.get('LOG_LEVEL', 'ERROR')
-logging.basicConfig(level=getattr(logging, log_level))
 
-def log_error(message):
-    logging.error(message)
+logger = logging.getLogger('chat')
 
-def log_info(message):
-    if log_level in ['INFO', 'DEBUG']:
-        logging.info(message)
+class JsonFormatter(logging.Formatter):
+    """
+    Format records as single-line JSON objects
 
-def log_warning(message):
-    logging.warning(message)
+    Request fields attached by ContextQueueHandler are included when
+    the record was logged while handling a request
+    """
+    _CONTEXT_FIELDS = ('request_id', 'method', 'route', 'latency_ms')
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for field in self._CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+class ContextQueueHandler(logging.handlers.QueueHandler):
+    """
+    Hand records to a background listener thread
+
+    Runs on the logging thread, so it only captures the request
+    context and the %-formatted message; JSON encoding and I/O happen
+    in the listener. The listener is (re)started lazily in each
+    process, as threads do not survive a fork.
+    """
+    def __init__(self, log_queue, handlers):
+        """
+        Initialize handler
+
+        Args:
+            log_queue: Queue shared with the listener
+            handlers: Handlers the listener writes records to
+        """
+        super().__init__(log_queue)
+        self.handlers = handlers
+        self._listener = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _ensure_listener(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._listener = logging.handlers.QueueListener(self.queue, *self.handlers,
+                                                                respect_handler_level=True)
+                self._listener.start()
+                self._pid = os.getpid()
+
+    def stop(self):
+        """Flush queued records and stop the listener thread"""
+        with self._lock:
+            if self._listener is not None and self._pid == os.getpid():
+                self._listener.stop()
+            self._pid = None
+
+    def prepare(self, record):
+        if has_request_context():
+            record.request_id = g.get('request_id')
+            record.method = request.method
+            record.route = request.url_rule.rule if request.url_rule else request.path
+            started = g.get('request_started')
+            if started is not None:
+                record.latency_ms = round((time.perf_counter() - started) * 1000, 3)
+
+        # Merge the arguments now, they may change once the call returns
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        self._ensure_listener()
+        super().enqueue(record)
+
+def _configure():
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(JsonFormatter())
+    handler = ContextQueueHandler(queue.SimpleQueue(), [stream_handler])
+
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(getattr(logging, log_level))
+    atexit.register(handler.stop)
+    return handler
+
+_handler = _configure()
+
+def log_error(message, *args, **kwargs):
+    """
+    Log an error
+
+    Args:
+        message: %-style format string
+        *args: Values for the format string, only merged if the level is enabled
+        **kwargs: Passed to Logger.error, e.g. exc_info=True
+    """
+    logger.error(message, *args, **kwargs)
+
+def log_info(message, *args, **kwargs):
+    logger.info(message, *args, **kwargs)
+
+def log_warning(message, *args, **kwargs):
+    logger.warning(message, *args, **kwargs)
+
+def log_debug(message, *args, **kwargs):
+    logger.debug(message, *args, **kwargs)
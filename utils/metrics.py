@@ -0,0 +1,238 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Latency buckets in seconds, from sub-millisecond lookups to slow hashing
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Metric:
+    """
+    Base for metrics aggregated per thread
+
+    Each thread updates its own shard without locking; the shards are
+    only summed when the metrics are rendered. Shards of finished
+    threads are folded into a retired total whenever a new thread
+    registers, so there are never more shards than live threads.
+    """
+    type_name = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        """
+        Initialize metric
+
+        Args:
+            name: Prometheus metric name
+            documentation: Help text
+            labelnames: Names of the labels, values are passed positionally
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards = []  # (thread, shard) pairs
+        self._retired = {}
+        self._lock = threading.Lock()
+
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._retire_finished()
+                self._shards.append((threading.current_thread(), shard))
+            return shard
+
+    def _retire_finished(self):
+        """Fold shards of finished threads into the retired total, holding _lock"""
+        live = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                live.append((thread, shard))
+            else:
+                self._merge(self._retired, shard)
+        self._shards = live
+
+    def _merge(self, target, shard):
+        raise NotImplementedError
+
+    def collect(self):
+        """
+        Sum the shards of all threads
+
+        Returns:
+            dict: Label values tuple -> aggregated value
+        """
+        with self._lock:
+            self._retire_finished()
+            totals = {}
+            self._merge(totals, self._retired)
+            for _, shard in self._shards:
+                self._merge(totals, shard)
+        return totals
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type_name}']
+        for labelvalues, value in sorted(self.collect().items(), key=lambda item: tuple(map(str, item[0]))):
+            lines.extend(self._render_sample(labelvalues, value))
+        return lines
+
+    def _render_sample(self, labelvalues, value):
+        return [f'{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(value)}']
+
+class Counter(_Metric):
+    """Monotonic count, e.g. requests served"""
+    type_name = 'counter'
+
+    def inc(self, *labelvalues, amount=1):
+        shard = self._shard()
+        shard[labelvalues] = shard.get(labelvalues, 0) + amount
+
+    def _merge(self, target, shard):
+        # list() copies the items in one step, the owning thread may be adding keys
+        for labelvalues, value in list(shard.items()):
+            target[labelvalues] = target.get(labelvalues, 0) + value
+
+class Gauge(Counter):
+    """
+    Value that goes up and down, e.g. requests in flight
+
+    With a callback the value is read from it at render time instead
+    """
+    type_name = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+
+    def dec(self, *labelvalues, amount=1):
+        self.inc(*labelvalues, amount=-amount)
+
+    def collect(self):
+        if self.callback is not None:
+            return {(): self.callback()}
+        return super().collect()
+
+class Histogram(_Metric):
+    """Distribution of observed values, e.g. latencies in seconds"""
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labelvalues):
+        shard = self._shard()
+        entry = shard.get(labelvalues)
+        if entry is None:
+            # Per-bucket counts (last one is +Inf) and the running sum
+            entry = shard[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0]
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+    @contextmanager
+    def time(self, *labelvalues):
+        """Observe the duration of a with-block"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labelvalues)
+
+    def _merge(self, target, shard):
+        for labelvalues, (counts, total) in list(shard.items()):
+            merged = target.get(labelvalues)
+            if merged is None:
+                merged = target[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0]
+            merged[0] = [a + b for a, b in zip(merged[0], list(counts))]
+            merged[1] += total
+
+    def _render_sample(self, labelvalues, value):
+        counts, total = value
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            labels = _format_labels(self.labelnames, labelvalues, f'le="{_format_value(bound)}"')
+            lines.append(f'{self.name}_bucket{labels} {cumulative}')
+        labels = _format_labels(self.labelnames, labelvalues)
+        lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+        lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+class MetricsRegistry:
+    """
+    Set of metrics rendered together in Prometheus text format
+
+    Values are per process; with several workers each one reports its
+    own, so scrape every worker or aggregate by instance
+    """
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric already registered: {metric.name}")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=(), callback=None):
+        return self._register(Gauge(name, documentation, labelnames, callback))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        """
+        Render all metrics
+
+        Returns:
+            str: Prometheus text exposition format
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+registry = MetricsRegistry()
+
+http_requests_total = registry.counter(
+    'http_requests_total', 'HTTP requests by endpoint and status',
+    ('blueprint', 'endpoint', 'method', 'status'))
+http_request_duration_seconds = registry.histogram(
+    'http_request_duration_seconds', 'HTTP request latency', ('blueprint', 'endpoint'))
+http_requests_in_flight = registry.gauge(
+    'http_requests_in_flight', 'HTTP requests being handled', ('blueprint', 'endpoint'))
+user_store_duration_seconds = registry.histogram(
+    'user_store_duration_seconds',
+    'Time spent in user store lookups and writes, group commits, journal appends (with fsync) and compactions',
+    ('operation',))
+password_hash_duration_seconds = registry.histogram(
+    'password_hash_duration_seconds', 'Time spent hashing and verifying passwords, including queueing',
+    ('operation',))
+socketio_events_total = registry.counter(
+    'socketio_events_total', 'Socket.IO events received', ('event',))
+socketio_connected_sids = registry.gauge(
+    'socketio_connected_sids', 'Socket.IO clients connected to this process')
@@ -0,0 +1,39 @@
+from werkzeug.security import generate_password_hash, check_password_hash
+from utils.config import Config
+from utils.metrics import password_hash_duration_seconds
+from utils.workerpool import BoundedProcessPool
+
+_hash_pool = BoundedProcessPool('password-hash', Config.PASSWORD_HASH_WORKERS, Config.PASSWORD_HASH_MAX_PENDING)
+
+def hash_password(password):
+    """
+    Hash a password in the hashing process pool
+
+    Args:
+        password: Plain text password
+
+    Returns:
+        str: Password hash
+
+    Raises:
+        PoolSaturated: If too many hashing jobs are pending or the job timed out
+    """
+    with password_hash_duration_seconds.time('hash'):
+        return _hash_pool.run(generate_password_hash, password, timeout=Config.PASSWORD_HASH_TIMEOUT)
+
+def verify_password(password_hash, password):
+    """
+    Check a password against its hash in the hashing process pool
+
+    Args:
+        password_hash: Stored password hash
+        password: Plain text password to check
+
+    Returns:
+        Boolean indicating if the password matches
+
+    Raises:
+        PoolSaturated: If too many hashing jobs are pending or the job timed out
+    """
+    with password_hash_duration_seconds.time('verify'):
+        return _hash_pool.run(check_password_hash, password_hash, password, timeout=Config.PASSWORD_HASH_TIMEOUT)
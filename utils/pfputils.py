@@ -1,7 +1,140 @@
+import hashlib
 import os
 import uuid
+from flask import send_from_directory
 from utils.config import Config
-from utils.logutils import log_info, log_error
+from utils.dbutils import SqliteConnectionPool
+from utils.logutils import log_info, log_error, log_warning, log_debug
+from utils.userutils import get_user, update_user
+from utils.workerpool import BoundedProcessPool, PoolSaturated
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional, uploads are then served as-is
+    Image = None
+
+_avatar_pool = BoundedProcessPool('avatar', Config.AVATAR_WORKERS, Config.AVATAR_MAX_PENDING)
+
+_UPLOAD_CHUNK_SIZE = 64 * 1024
+
+class UploadRejected(Exception):
+    """Raised when an upload is too large or not an accepted image"""
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+# Leading bytes of the accepted image formats -> stored extension
+_IMAGE_SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'\xff\xd8\xff', 'jpg'),
+)
+
+def detect_image_type(header):
+    """
+    Identify an image by its magic number
+    
+    Args:
+        header: At least the first 12 bytes of the file
+        
+    Returns:
+        str: File extension for the format, or None if not accepted
+    """
+    for signature, extension in _IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return extension
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+_AVATAR_REFS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS avatar_refs (
+    digest TEXT PRIMARY KEY,
+    refs INTEGER NOT NULL
+);
+"""
+
+class AvatarReferences:
+    """
+    Reference counts of content-addressed avatars, shared by all workers
+
+    An avatar (the upload and its variants) is named after the SHA-256
+    of the uploaded bytes, so identical uploads share one set of files.
+    Files are deleted inside the write transaction that drops the last
+    reference; a concurrent upload of the same content takes its
+    reference first and writes its files afterwards, so it never
+    loses them.
+    """
+    def __init__(self, db_path):
+        """
+        Initialize reference counts
+
+        Args:
+            db_path: Path of the shared SQLite database
+        """
+        self.db = SqliteConnectionPool(db_path, _AVATAR_REFS_SCHEMA)
+
+    def acquire(self, digest):
+        """Add a reference to an avatar"""
+        with self.db.transaction() as conn:
+            conn.execute('INSERT INTO avatar_refs (digest, refs) VALUES (?, 1) '
+                         'ON CONFLICT (digest) DO UPDATE SET refs = refs + 1', (digest,))
+
+    def release(self, digest, filenames):
+        """
+        Drop a reference, deleting the avatar's files with the last one
+
+        Avatars without a count (stored before counting) are unshared
+
+        Args:
+            digest: Avatar digest
+            filenames: Files of the avatar
+
+        Returns:
+            int: Remaining references
+        """
+        with self.db.transaction() as conn:
+            row = conn.execute('SELECT refs FROM avatar_refs WHERE digest = ?', (digest,)).fetchone()
+            refs = row['refs'] - 1 if row else 0
+            if refs > 0:
+                conn.execute('UPDATE avatar_refs SET refs = ? WHERE digest = ?', (refs, digest))
+            else:
+                conn.execute('DELETE FROM avatar_refs WHERE digest = ?', (digest,))
+                _delete_files(filenames)
+        return refs
+
+    def delete_if_unreferenced(self, digest, filenames):
+        """
+        Delete an avatar's files unless something references it
+
+        Returns:
+            Boolean indicating if the files were deleted
+        """
+        with self.db.transaction() as conn:
+            if conn.execute('SELECT 1 FROM avatar_refs WHERE digest = ?', (digest,)).fetchone():
+                return False
+            _delete_files(filenames)
+            return True
+
+avatar_refs = AvatarReferences(Config.SHARED_STATE_DB)
+
+def _delete_files(filenames):
+    for filename in filenames:
+        if filename:
+            delete_profile_picture(filename)
+
+def _avatar_digest(filename):
+    # "<digest>.<ext>" for uploads, "<digest>_<size>.webp" for variants
+    return filename.split('_', 1)[0].split('.', 1)[0]
+
+def _variant_names(digest):
+    return {str(size): f"{digest}_{size}.webp" for size in Config.AVATAR_SIZES}
+
+def _avatar_files(digest, filenames=()):
+    """All files an avatar may consist of, including given legacy names"""
+    files = set(filenames)
+    files.update(f"{digest}.{extension}" for extension in Config.ALLOWED_EXTENSIONS)
+    files.update(_variant_names(digest).values())
+    return files
 
 def allowed_file(filename):
     """
@@ -15,32 +148,275 @@ def allowed_file(filename):
     """
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in Config.ALLOWED_EXTENSIONS
 
+def _store_picture(stream):
+    """
+    Stream an image into the pictures directory under its SHA-256
+    
+    Raises:
+        UploadRejected: If the image is too large or of the wrong type
+    """
+    os.makedirs(Config.PROFILE_PICTURES_DIR, exist_ok=True)
+    temp_path = os.path.join(Config.PROFILE_PICTURES_DIR, f".upload-{uuid.uuid4().hex}.tmp")
+    try:
+        digest = hashlib.sha256()
+        size = 0
+        extension = None
+        header = b''
+        with open(temp_path, 'wb') as f:
+            for chunk in iter(lambda: stream.read(_UPLOAD_CHUNK_SIZE), b''):
+                size += len(chunk)
+                if size > Config.PROFILE_PICTURE_MAX_BYTES:
+                    raise UploadRejected('Profile picture is too large', status_code=413)
+                if extension is None:
+                    # Checked as soon as the first bytes arrive, before the rest is read
+                    header += chunk[:12]
+                    if len(header) >= 12:
+                        extension = detect_image_type(header)
+                        if extension is None:
+                            raise UploadRejected('Profile picture must be a PNG, JPEG or WebP image')
+                digest.update(chunk)
+                f.write(chunk)
+        
+        if extension is None:
+            raise UploadRejected('Profile picture must be a PNG, JPEG or WebP image')
+        
+        digest = digest.hexdigest()
+        filename = f"{digest}.{extension}"
+        
+        # Reference first, so a concurrent release cannot delete the file after it is placed
+        avatar_refs.acquire(digest)
+        os.replace(temp_path, os.path.join(Config.PROFILE_PICTURES_DIR, filename))
+        
+        log_info("Profile picture saved: %s", filename)
+        return filename
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
 def save_profile_picture(file):
     """
-    Save a profile picture to the configured directory
+    Save a profile picture under the SHA-256 of its content
+    
+    The upload is streamed to a temporary file in fixed-size chunks
+    while it is hashed and size-checked, and its magic number decides
+    the stored format. Identical content maps to the same name, so a
+    duplicate upload only adds a reference. The caller owns the
+    reference taken here and gives it back with release_profile_picture.
     
     Args:
         file: File object from request.files
         
     Returns:
         Filename of saved image or None if failed
+        
+    Raises:
+        UploadRejected: If the image is too large or of the wrong type
     """
     if not file or not allowed_file(file.filename):
         return None
     
     try:
-        filename = str(uuid.uuid4().hex) + '_' + os.path.basename(file.filename)
-        file_path = os.path.join(Config.PROFILE_PICTURES_DIR, filename)
+        return _store_picture(file.stream)
+    except UploadRejected:
+        raise
+    except Exception as e:
+        log_error("Error saving profile picture: %s", e)
+        return None
+
+def save_profile_picture_file(path):
+    """
+    Save a profile picture from a completed upload on disk
+    
+    Args:
+        path: Path of the uploaded file
         
-        os.makedirs(Config.PROFILE_PICTURES_DIR, exist_ok=True)
-        file.save(file_path)
+    Returns:
+        Filename of saved image or None if failed
         
-        log_info(f"Profile picture saved: {filename}")
-        return filename
+    Raises:
+        UploadRejected: If the image is too large or of the wrong type
+    """
+    try:
+        with open(path, 'rb') as f:
+            return _store_picture(f)
+    except UploadRejected:
+        raise
     except Exception as e:
-        log_error(f"Error saving profile picture: {str(e)}")
+        log_error("Error saving profile picture: %s", e)
         return None
 
+def release_profile_picture(user):
+    """
+    Give up a user's reference to their profile picture
+    
+    The files are only deleted when no other user references the
+    same content
+    
+    Args:
+        user: User object
+    """
+    filename = user.get('profile_picture')
+    if not filename:
+        return
+    
+    try:
+        variants = (user.get('profile_picture_variants') or {}).values()
+        digest = _avatar_digest(filename)
+        avatar_refs.release(digest, _avatar_files(digest, [filename, *variants]))
+    except Exception as e:
+        log_error("Error releasing profile picture: %s", e)
+
+def _render_avatar_variants(source_path, output_dir, variants, quality, max_pixels):
+    """
+    Decode an upload and write square WebP variants, in a worker process
+    
+    Variants already on disk (from identical content) are reused
+    
+    Args:
+        source_path: Path of the uploaded image
+        output_dir: Directory for the variants
+        variants: Size (as string) -> variant filename, largest first
+        quality: WebP quality
+        max_pixels: Largest accepted width * height
+        
+    Returns:
+        dict: The variants
+    """
+    def existing():
+        return all(os.path.exists(os.path.join(output_dir, name)) for name in variants.values())
+    
+    if existing():
+        return variants
+    
+    Image.MAX_IMAGE_PIXELS = max_pixels
+    largest = int(next(iter(variants)))
+    try:
+        with Image.open(source_path) as image:
+            if image.width * image.height > max_pixels:
+                raise ValueError(f"Image is {image.width}x{image.height}, too large")
+            # JPEGs decode straight at a reduced scale, still at least the largest size
+            image.draft('RGB', (largest, largest))
+            # Apply the EXIF orientation; metadata is not copied to the output
+            image = ImageOps.exif_transpose(image)
+            has_alpha = image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info
+            image = image.convert('RGBA' if has_alpha else 'RGB')
+    except FileNotFoundError:
+        # Removed by whoever finished the same content first
+        if existing():
+            return variants
+        raise
+    
+    for size, filename in variants.items():
+        temp_path = os.path.join(output_dir, f"{filename}.{os.getpid()}.tmp")
+        ImageOps.fit(image, (int(size), int(size)), Image.Resampling.LANCZOS).save(
+            temp_path, 'WEBP', quality=quality, method=4)
+        os.replace(temp_path, os.path.join(output_dir, filename))
+    return variants
+
+def process_profile_picture(user_id, filename):
+    """
+    Convert an uploaded profile picture to WebP avatars in the background
+    
+    The upload is decoded, cropped to a square and resized to each of
+    Config.AVATAR_SIZES in the avatar process pool. When done, the
+    user's record points at the variants and the original is removed.
+    Call after the record references the upload; until processing
+    finishes the original is served.
+    
+    Args:
+        user_id: ID of the user the picture belongs to
+        filename: Saved upload, as returned by save_profile_picture
+        
+    Returns:
+        Boolean indicating if processing was queued
+    """
+    if Image is None:
+        return False
+    
+    try:
+        future = _avatar_pool.submit(_render_avatar_variants,
+                                     os.path.join(Config.PROFILE_PICTURES_DIR, filename),
+                                     Config.PROFILE_PICTURES_DIR, _variant_names(_avatar_digest(filename)),
+                                     Config.AVATAR_QUALITY, Config.AVATAR_MAX_PIXELS)
+    except PoolSaturated:
+        log_warning("Avatar pool saturated, keeping original profile picture: %s", filename)
+        return False
+    
+    future.add_done_callback(lambda done: _finish_profile_picture(user_id, filename, done))
+    return True
+
+def _finish_profile_picture(user_id, filename, future):
+    digest = _avatar_digest(filename)
+    try:
+        user = get_user(user_id, 'id')
+        current = user.get('profile_picture') if user else None
+        if not current or _avatar_digest(current) != digest:
+            # Replaced while processing, the upload may already be gone; keep
+            # the variants only if someone else uses them
+            log_debug("Dropping superseded profile picture job %s", filename)
+            avatar_refs.delete_if_unreferenced(digest, _avatar_files(digest, [filename]))
+            return
+    except Exception as e:
+        log_error("Error updating processed profile picture: %s", e)
+        return
+    
+    invalid = False
+    try:
+        variants = future.result()
+    except FileNotFoundError as e:
+        log_error("Error processing profile picture %s: %s", filename, e)
+        return
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        log_error("Rejected profile picture %s: %s", filename, e)
+        variants, invalid = None, True
+    except Exception as e:
+        log_error("Error processing profile picture %s: %s", filename, e)
+        return
+    
+    try:
+        if variants:
+            update_user(user_id, {
+                'profile_picture': variants[str(Config.AVATAR_SIZES[0])],
+                'profile_picture_variants': variants
+            })
+            delete_profile_picture(filename)
+            log_info("Profile picture processed: %s", filename)
+        elif invalid:
+            # Not a decodable image, stop serving it
+            update_user(user_id, {'profile_picture': None, 'profile_picture_variants': None})
+            avatar_refs.release(digest, _avatar_files(digest, [filename]))
+    except Exception as e:
+        log_error("Error updating processed profile picture: %s", e)
+
+def send_profile_picture(filename):
+    """
+    Serve a profile picture with caching suited to its name
+    
+    Avatar variants are named after their content and never change,
+    so they are immutable for a year and the name serves as a strong
+    ETag. An upload's name stays valid after processing deletes it and
+    then resolves to its largest variant; as its bytes change at that
+    point, it is only cached briefly and revalidated by ETag.
+    
+    Args:
+        filename: Name of the picture
+        
+    Returns:
+        Flask response, 304 if the client's copy is current
+    """
+    variants = _variant_names(_avatar_digest(filename))
+    immutable = filename in variants.values()
+    if '_' not in filename and not os.path.exists(os.path.join(Config.PROFILE_PICTURES_DIR, filename)):
+        variant = variants[str(Config.AVATAR_SIZES[0])]
+        if os.path.exists(os.path.join(Config.PROFILE_PICTURES_DIR, variant)):
+            filename = variant
+    
+    max_age = Config.AVATAR_CACHE_MAX_AGE if immutable else Config.AVATAR_UPLOAD_MAX_AGE
+    response = send_from_directory(Config.PROFILE_PICTURES_DIR, filename,
+                                   etag=os.path.splitext(filename)[0], max_age=max_age)
+    response.headers['Cache-Control'] = f"public, max-age={max_age}" + (', immutable' if immutable else '')
+    return response
+
 def delete_profile_picture(filename):
     """
     Delete a profile picture from the configured directory
@@ -59,10 +435,10 @@ def delete_profile_picture(filename):
         
         if os.path.exists(file_path):
             os.remove(file_path)
-            log_info(f"Deleted profile picture: {filename}")
+            log_info("Deleted profile picture: %s", filename)
             return True
         
         return False
     except Exception as e:
-        log_error(f"Error deleting profile picture: {str(e)}")
+        log_error("Error deleting profile picture: %s", e)
         return False
@@ -0,0 +1,99 @@
+import threading
+
+class PresenceRegistry:
+    """
+    Connected Socket.IO sessions indexed in both directions
+
+    Maps each sid to its username and each username to the set of its
+    sids, so a user can be connected from several tabs or devices and
+    a disconnect is handled in O(1) without scanning all users
+    """
+    def __init__(self):
+        self._sid_to_user = {}
+        self._user_to_sids = {}
+        self._lock = threading.Lock()
+
+    def register(self, username, sid):
+        """
+        Associate a Socket.IO session with a user
+
+        Args:
+            username: Username the session belongs to
+            sid: Socket.IO session ID
+        """
+        with self._lock:
+            previous = self._sid_to_user.get(sid)
+            if previous is not None and previous != username:
+                self._discard(previous, sid)
+            self._sid_to_user[sid] = username
+            self._user_to_sids.setdefault(username, set()).add(sid)
+
+    def unregister(self, sid):
+        """
+        Remove a Socket.IO session
+
+        Args:
+            sid: Socket.IO session ID
+
+        Returns:
+            str: Username the session belonged to, or None
+        """
+        with self._lock:
+            username = self._sid_to_user.pop(sid, None)
+            if username is not None:
+                self._discard(username, sid)
+            return username
+
+    def _discard(self, username, sid):
+        sids = self._user_to_sids.get(username)
+        if sids is not None:
+            sids.discard(sid)
+            if not sids:
+                del self._user_to_sids[username]
+
+    def rename(self, old_username, new_username):
+        """
+        Move all sessions of a user to a new username
+
+        Args:
+            old_username: Current username
+            new_username: New username
+
+        Returns:
+            set: Session IDs that were moved
+        """
+        with self._lock:
+            sids = self._user_to_sids.pop(old_username, set())
+            for sid in sids:
+                self._sid_to_user[sid] = new_username
+            if sids:
+                self._user_to_sids.setdefault(new_username, set()).update(sids)
+            return set(sids)
+
+    def get_user(self, sid):
+        return self._sid_to_user.get(sid)
+
+    def get_sids(self, username):
+        """
+        Get all session IDs of a user
+
+        Args:
+            username: Username to look up
+
+        Returns:
+            set: Copy of the user's session IDs (empty if offline)
+        """
+        with self._lock:
+            return set(self._user_to_sids.get(username, ()))
+
+    def is_online(self, username):
+        return username in self._user_to_sids
+
+    def __contains__(self, username):
+        return self.is_online(username)
+
+    def __len__(self):
+        return len(self._user_to_sids)
+
+    def session_count(self):
+        return len(self._sid_to_user)
@@ -0,0 +1,275 @@
+import marshal
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from utils.config import Config
+from utils.logutils import log_info, log_error
+
+def _frame_key(code):
+    return (code.co_filename, code.co_firstlineno, code.co_name)
+
+def _stack(frame):
+    # Root first, the way flame graphs and pstats callers read it
+    stack = []
+    while frame is not None:
+        stack.append(_frame_key(frame.f_code))
+        frame = frame.f_back
+    stack.reverse()
+    return tuple(stack)
+
+def _collapsed_name(key):
+    filename, lineno, name = key
+    return f"{os.path.basename(filename)}:{name}:{lineno}".replace(';', ':').replace(' ', '_')
+
+class _SampledStats:
+    """
+    Convert sampled stacks into the table pstats files hold
+
+    Times are samples multiplied by the interval and call counts are
+    sample counts, so ratios are meaningful while absolute call
+    counts are not
+    """
+    def __init__(self, samples, interval):
+        self.samples = samples
+        self.interval = interval
+        self.stats = {}
+
+    def create_stats(self):
+        stats = {}
+        for (_, stack), count in self.samples.items():
+            if not stack:
+                continue
+            seconds = count * self.interval
+            seen = set()
+            for depth, func in enumerate(stack):
+                entry = stats.setdefault(func, [0, 0, 0.0, 0.0, {}])
+                is_leaf = depth == len(stack) - 1
+                if func not in seen:
+                    # Recursive frames count once towards cumulative time
+                    seen.add(func)
+                    entry[0] += count
+                    entry[1] += count
+                    entry[3] += seconds
+                if is_leaf:
+                    entry[2] += seconds
+                if depth:
+                    caller = stack[depth - 1]
+                    cc, nc, tt, ct = entry[4].get(caller, (0, 0, 0.0, 0.0))
+                    entry[4][caller] = (cc + count, nc + count, tt + (seconds if is_leaf else 0.0), ct + seconds)
+        self.stats = {func: tuple(entry) for func, entry in stats.items()}
+
+class _Session:
+    def __init__(self, duration, interval, route, header):
+        self.started_at = time.time()
+        self.deadline = time.monotonic() + duration
+        self.duration = duration
+        self.interval = interval
+        self.route = route
+        self.header = header  # (name, value or None)
+        self.samples = Counter()  # (request label, stack) -> samples
+        self.sample_count = 0
+        self.requests = 0
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def describe(self):
+        header = None
+        if self.header:
+            header = self.header[0] if self.header[1] is None else f"{self.header[0]}: {self.header[1]}"
+        return {
+            'started_at': int(self.started_at),
+            'duration': self.duration,
+            'interval_ms': round(self.interval * 1000, 3),
+            'route': self.route,
+            'header': header,
+            'requests': self.requests,
+            'samples': self.sample_count,
+        }
+
+class SamplingProfiler:
+    """
+    Statistical profiler for live requests
+
+    While a session runs, a background thread wakes every `interval`
+    seconds and records the Python stack of each thread that is
+    handling a matching request. Nothing is hooked into the profiled
+    code, so the overhead is the sampling thread alone and requests
+    outside the session pay a single attribute check. When the session
+    ends, the samples are written as collapsed stacks (for flame graph
+    tools) and as a pstats file.
+
+    Sessions are per process; with several workers, only the worker
+    that received the start request is profiled. Work handed to the
+    password hashing pool shows up as time waiting on the pool.
+    """
+    def __init__(self, output_dir):
+        """
+        Initialize profiler
+
+        Args:
+            output_dir: Directory the profiles are written to
+        """
+        self.output_dir = output_dir
+        self.active = False
+        self._session = None
+        self._last = None
+        self._tracked = {}  # thread ident -> request label
+        self._lock = threading.Lock()
+
+    def start(self, duration, interval=None, route=None, header=None):
+        """
+        Start a profiling session
+
+        Args:
+            duration: Seconds to profile for
+            interval: Seconds between samples, defaults to Config.PROFILER_INTERVAL
+            route: Only profile requests for this URL rule or path
+            header: Only profile requests carrying this header, as
+                'Name' or 'Name: value'
+
+        Returns:
+            dict: Description of the started session
+
+        Raises:
+            ValueError: If an argument is invalid
+            RuntimeError: If a session is already running
+        """
+        interval = Config.PROFILER_INTERVAL if interval is None else interval
+        if not isinstance(duration, (int, float)) or not 0 < duration <= Config.PROFILER_MAX_DURATION:
+            raise ValueError(f'duration must be between 0 and {Config.PROFILER_MAX_DURATION} seconds')
+        if not isinstance(interval, (int, float)) or not 0.001 <= interval <= 1:
+            raise ValueError('interval must be between 1 and 1000 milliseconds')
+
+        if route is not None and not isinstance(route, str):
+            raise ValueError('route must be a string')
+        if header is not None and not isinstance(header, str):
+            raise ValueError('header must be a string')
+        if header:
+            name, _, value = header.partition(':')
+            header = (name.strip(), value.strip() or None)
+            if not header[0]:
+                raise ValueError('header must be "Name" or "Name: value"')
+
+        session = _Session(duration, interval, route or None, header or None)
+        with self._lock:
+            if self._session is not None:
+                raise RuntimeError('A profiling session is already running')
+            os.makedirs(self.output_dir, exist_ok=True)
+            self._session = session
+            self._tracked.clear()
+            session.thread = threading.Thread(target=self._run, args=(session,),
+                                              name='sampling-profiler', daemon=True)
+            session.thread.start()
+            self.active = True
+
+        log_info("Profiling started for %ss (route=%s, header=%s)", duration, route, header)
+        return session.describe()
+
+    def stop(self):
+        """
+        End the running session early and write its profiles
+
+        Returns:
+            dict: Description of the finished session, or None if none was running
+        """
+        session = self._session
+        if session is None:
+            return None
+        session.stop_event.set()
+        session.thread.join()
+        return self._last
+
+    def status(self):
+        """
+        Describe the running session and the last finished one
+
+        Returns:
+            dict: 'running' and 'last' session descriptions, either may be None
+        """
+        session = self._session
+        return {
+            'running': session.describe() if session else None,
+            'last': self._last,
+        }
+
+    def _matches(self, session, request):
+        if session.route:
+            rule = request.url_rule.rule if request.url_rule else None
+            if session.route not in (rule, request.path):
+                return False
+        if session.header:
+            name, value = session.header
+            actual = request.headers.get(name)
+            if actual is None or (value is not None and actual != value):
+                return False
+        return True
+
+    def begin_request(self, request):
+        """
+        Track the current thread if a session wants this request
+
+        Args:
+            request: Flask request being handled
+        """
+        if not self.active:
+            return
+        session = self._session
+        if session is None or not self._matches(session, request):
+            return
+        rule = request.url_rule.rule if request.url_rule else request.path
+        self._tracked[threading.get_ident()] = f"{request.method} {rule}"
+        session.requests += 1
+
+    def end_request(self):
+        """Stop tracking the current thread"""
+        if self._tracked:
+            self._tracked.pop(threading.get_ident(), None)
+
+    def _run(self, session):
+        try:
+            while not session.stop_event.wait(session.interval) and time.monotonic() < session.deadline:
+                if not self._tracked:
+                    continue
+                frames = sys._current_frames()
+                for ident, label in list(self._tracked.items()):
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        session.samples[(label, _stack(frame))] += 1
+                        session.sample_count += 1
+                del frames
+        finally:
+            with self._lock:
+                self.active = False
+                self._tracked.clear()
+                try:
+                    result = session.describe()
+                    result['files'] = self._write(session)
+                    self._last = result
+                except Exception as e:
+                    log_error("Error writing profile: %s", e, exc_info=True)
+                self._session = None
+
+    def _write(self, session):
+        base = os.path.join(self.output_dir, 'profile-%s%03d-%d' % (
+            time.strftime('%Y%m%d-%H%M%S', time.localtime(session.started_at)),
+            session.started_at % 1 * 1000, os.getpid()))
+
+        collapsed_path = base + '.collapsed'
+        with open(collapsed_path, 'w') as f:
+            for (label, stack), count in sorted(session.samples.items(), key=lambda item: -item[1]):
+                names = [label.replace(';', ':').replace(' ', '_')] + [_collapsed_name(key) for key in stack]
+                f.write(f"{';'.join(names)} {count}\n")
+
+        pstats_path = base + '.pstats'
+        sampled = _SampledStats(session.samples, session.interval)
+        sampled.create_stats()
+        # Same layout as Stats.dump_stats, which refuses an empty profile
+        with open(pstats_path, 'wb') as f:
+            marshal.dump(sampled.stats, f)
+
+        log_info("Profile with %s samples written to %s", session.sample_count, base)
+        return [collapsed_path, pstats_path]
+
+profiler = SamplingProfiler(Config.PROFILES_DIR)
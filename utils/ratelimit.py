@@ -1,46 +1,288 @@
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
 import time
-from collections import defaultdict
-from utils.logutils import log_info, log_warning
+import threading
+from collections import OrderedDict
+from functools import wraps
+from flask import request
+from flask_jwt_extended import get_jwt_identity
+from utils.config import Config
+from utils.logutils import log_info, log_warning, log_error
+from utils.responseutils import api_response
 
 class RateLimiter:
     """
     Rate limiting utility to prevent abuse of API endpoints
-    
-    Tracks requests by key (e.g., IP address) and enforces
-    a maximum number of requests within a time window
+
+    Uses a sliding-window counter: each key keeps only the request
+    counts of the current and previous fixed windows, and the previous
+    count is weighted by how much of it still overlaps the sliding
+    window. Checks are O(1), idle keys are swept once per window and
+    the number of tracked keys is capped (least recently seen first).
     """
-    def __init__(self, limit=5, window=60):
+    def __init__(self, limit=5, window=60, max_keys=100000):
         """
         Initialize rate limiter
-        
+
         Args:
             limit: Maximum number of requests allowed in the window
             window: Time window in seconds
+            max_keys: Maximum number of keys tracked at once
         """
         self.limit = limit
         self.window = window
-        self.requests = defaultdict(list)
-        
+        self.max_keys = max_keys
+        self.requests = OrderedDict()  # key -> [window index, previous count, current count]
+        self._lock = threading.Lock()
+        self._next_sweep = 0
+
+    def _sweep(self, window_index):
+        # Keys untouched for two windows have no counts left that matter
+        stale = [key for key, entry in self.requests.items() if entry[0] < window_index - 1]
+        for key in stale:
+            del self.requests[key]
+        if stale:
+            log_info("Rate limiter swept %s idle keys", len(stale))
+
     def is_rate_limited(self, key):
         """
         Check if a key is rate limited
-        
+
         Args:
             key: Identifier for the client (e.g., IP address)
-            
+
+        Returns:
+            Boolean indicating if the request should be limited
+        """
+        now = time.time()
+        window_index, offset = divmod(now, self.window)
+        window_index = int(window_index)
+
+        with self._lock:
+            if now >= self._next_sweep:
+                self._sweep(window_index)
+                self._next_sweep = now + self.window
+
+            entry = self.requests.get(key)
+            if entry is None:
+                entry = [window_index, 0, 0]
+                self.requests[key] = entry
+                if len(self.requests) > self.max_keys:
+                    self.requests.popitem(last=False)
+            else:
+                self.requests.move_to_end(key)
+                if entry[0] != window_index:
+                    previous = entry[2] if entry[0] == window_index - 1 else 0
+                    entry[:] = [window_index, previous, 0]
+
+            weight = 1 - offset / self.window
+            if entry[1] * weight + entry[2] >= self.limit:
+                limited = True
+            else:
+                entry[2] += 1
+                limited = False
+
+        if limited:
+            log_warning("Rate limit exceeded for %s", key)
+        return limited
+
+# key hash, window index, previous count, current count, expiry (unix seconds)
+_SLOT = struct.Struct('<QqIIq')
+
+class SharedCounterTable:
+    """
+    Fixed-size hash table of sliding-window counters in a shared file
+
+    The file is mmap'd by every worker process, so all workers count
+    against the same budget. Keys are hashed to 64 bits and placed by
+    linear probing within a short run of slots; expired slots are
+    reused and a full run evicts its oldest entry, so the table never
+    grows. Each update holds a POSIX record lock on just the probed
+    byte range, making it atomic across processes.
+    """
+    PROBES = 16
+
+    def __init__(self, path, slots):
+        """
+        Initialize table, creating or extending the backing file
+
+        Args:
+            path: Path of the backing file, ideally on tmpfs
+            slots: Number of hash slots
+        """
+        self.path = path
+        self.slots = slots
+        self.size = (slots + self.PROBES) * _SLOT.size
+        self._open()
+        os.register_at_fork(after_in_child=self._reopen)
+
+    def _open(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self._fd).st_size < self.size:
+            os.ftruncate(self._fd, self.size)
+        self._map = mmap.mmap(self._fd, self.size)
+        # POSIX locks do not exclude threads of one process
+        self._lock = threading.Lock()
+
+    def _reopen(self):
+        # Runs in a forked child while it has a single thread: drop the
+        # parent's descriptor and mapping instead of leaking them
+        self._map.close()
+        os.close(self._fd)
+        self._open()
+
+    def _find_slot(self, key_hash, start, now):
+        free = None
+        oldest = None
+        for index in range(start, start + self.PROBES):
+            offset = index * _SLOT.size
+            slot_hash, _, _, _, expires = _SLOT.unpack_from(self._map, offset)
+            if slot_hash == key_hash:
+                return offset
+            if free is None and (slot_hash == 0 or expires <= now):
+                free = offset
+            if oldest is None or expires < oldest[0]:
+                oldest = (expires, offset)
+        return free if free is not None else oldest[1]
+
+    def hit(self, key, limit, window):
+        """
+        Count a request for a key unless it is over its limit
+
+        Args:
+            key: Identifier string, unique per policy and client
+            limit: Maximum requests per sliding window
+            window: Window length in seconds
+
         Returns:
             Boolean indicating if the request should be limited
         """
+        key_hash = int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'little') or 1
+        start = key_hash % self.slots
         now = time.time()
-        # Clean up old requests
-        self.requests[key] = [t for t in self.requests[key] if now - t < self.window]
-        
-        if len(self.requests[key]) >= self.limit:
-            log_warning(f"Rate limit exceeded for {key}")
-            return True
-            
-        self.requests[key].append(now)
-        return False
-
-# Singleton instances for different API endpoints
-login_limiter = RateLimiter(5, 60)  # 5 attempts per minute
+        window_index, elapsed = divmod(now, window)
+        window_index = int(window_index)
+
+        with self._lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, self.PROBES * _SLOT.size, start * _SLOT.size)
+            try:
+                offset = self._find_slot(key_hash, start, now)
+                slot_hash, slot_window, previous, current, _ = _SLOT.unpack_from(self._map, offset)
+                if slot_hash != key_hash:
+                    previous, current = 0, 0
+                elif slot_window != window_index:
+                    previous = current if slot_window == window_index - 1 else 0
+                    current = 0
+
+                limited = previous * (1 - elapsed / window) + current >= limit
+                if not limited:
+                    current += 1
+                _SLOT.pack_into(self._map, offset, key_hash, window_index, previous, current,
+                                int((window_index + 2) * window))
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, self.PROBES * _SLOT.size, start * _SLOT.size)
+        return limited
+
+class SharedMemoryRateLimiter:
+    """
+    Rate limiter whose counters live in a SharedCounterTable
+
+    Same interface and sliding-window semantics as RateLimiter, but
+    the budget is enforced across all worker processes
+    """
+    def __init__(self, limit, window, table, name):
+        """
+        Initialize shared limiter
+
+        Args:
+            limit: Maximum number of requests allowed in the window
+            window: Time window in seconds
+            table: SharedCounterTable holding the counters
+            name: Policy name, keeps keys of different policies apart
+        """
+        self.limit = limit
+        self.window = window
+        self.table = table
+        self.name = name
+
+    def is_rate_limited(self, key):
+        limited = self.table.hit(f"{self.name}\0{key}", self.limit, self.window)
+        if limited:
+            log_warning("Rate limit exceeded for %s", key)
+        return limited
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+_shared_table = None
+
+def _create_limiter(policy, limit, window):
+    global _shared_table
+    if Config.RATE_LIMIT_BACKEND == 'mmap':
+        try:
+            if _shared_table is None:
+                _shared_table = SharedCounterTable(Config.RATE_LIMIT_SHM_FILE, Config.RATE_LIMIT_SHM_SLOTS)
+            return SharedMemoryRateLimiter(limit, window, _shared_table, policy)
+        except OSError as e:
+            log_error("Shared rate limit table unavailable, using in-process limits: %s", e)
+    return RateLimiter(limit, window)
+
+def get_limiter(policy):
+    """
+    Get the shared limiter for a named policy from Config.RATE_LIMITS
+
+    Args:
+        policy: Policy name, e.g. 'login' or 'admin'
+
+    Returns:
+        RateLimiter instance
+    """
+    limiter = _limiters.get(policy)
+    if limiter is None:
+        with _limiters_lock:
+            limiter = _limiters.get(policy)
+            if limiter is None:
+                limit, window = Config.RATE_LIMITS[policy]
+                limiter = _limiters[policy] = _create_limiter(policy, limit, window)
+    return limiter
+
+def _client_key(key):
+    if key == 'user':
+        try:
+            identity = get_jwt_identity()
+            if identity:
+                return f"user:{identity}"
+        except Exception:
+            pass
+    return f"ip:{request.remote_addr}"
+
+def rate_limit(policy, key='ip', message='Too many requests. Please try again later.'):
+    """
+    Decorator to apply a named rate limit policy to a route
+
+    Place it below @jwt_required() when limiting per user
+
+    Args:
+        policy: Policy name from Config.RATE_LIMITS
+        key: 'ip' to limit per client address, 'user' to limit per
+            JWT identity (falls back to the address)
+        message: Error message for limited requests
+
+    Returns:
+        Decorator that rejects limited requests with a 429
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            if Config.RATE_LIMIT_ENABLED:
+                limiter = get_limiter(policy)
+                if limiter.is_rate_limited(f"{policy}:{_client_key(key)}"):
+                    response, status_code = api_response(False, message, status_code=429)
+                    response.headers['Retry-After'] = str(limiter.window)
+                    return response, status_code
+            return f(*args, **kwargs)
+        return decorated
+    return decorator
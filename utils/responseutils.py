@@ -19,3 +19,17 @@ def api_response(success, message=None, data=None, status_code=200):
     if data:
         response.update(data)
     return jsonify(response), status_code
+
+def busy_response(retry_after=1):
+    """
+    Response for requests rejected because a worker pool is saturated
+    
+    Args:
+        retry_after: Seconds the client should wait before retrying
+        
+    Returns:
+        tuple: (Flask response object, 503)
+    """
+    response, status_code = api_response(False, 'Server is busy, please try again shortly', status_code=503)
+    response.headers['Retry-After'] = str(retry_after)
+    return response, status_code
@@ -1,35 +1,271 @@
-from flask import current_app, request
-from flask_jwt_extended import verify_jwt_in_request, get_jwt_identity
+import threading
+import time
+from flask import current_app, request, g
+from flask_jwt_extended import verify_jwt_in_request, get_jwt, get_jwt_identity
+from utils.config import Config
+from utils.dbutils import SqliteConnectionPool
 from utils.userutils import load_users, get_user
 from utils.logutils import log_info, log_error
+from utils.socketqueue import queue_enabled
+
+class MemoryRevocationStore:
+    """
+    In-process map of per-user token generations
+
+    Every issued JWT carries the user's generation at issue time.
+    Revoking a user's sessions bumps the generation, so older tokens
+    are rejected with one integer comparison. Users that were never
+    revoked are not stored and sit at generation 0. Only visible to
+    the worker process that made the change.
+    """
+    def __init__(self):
+        self._generations = {}  # user ID -> current token generation
+
+    def generation(self, user_id):
+        """
+        Get the current token generation for a user
+
+        Args:
+            user_id: User ID to check
+
+        Returns:
+            int: Generation that valid tokens must carry
+        """
+        return self._generations.get(user_id, 0)
+
+    def revoke(self, user_id):
+        """
+        Invalidate all tokens issued to a user so far
+
+        Args:
+            user_id: User ID to revoke
+
+        Returns:
+            int: The new generation
+        """
+        generation = self._generations.get(user_id, 0) + 1
+        self._generations[user_id] = generation
+        return generation
+
+    def revoke_many(self, user_ids):
+        """
+        Invalidate all tokens issued to several users at once
+
+        Args:
+            user_ids: Iterable of user IDs to revoke
+
+        Returns:
+            dict: User ID -> new generation
+        """
+        return {user_id: self.revoke(user_id) for user_id in dict.fromkeys(user_ids)}
+
+    def user_ids(self):
+        """
+        Get the users that have a stored generation
+
+        Returns:
+            list: User IDs
+        """
+        return list(self._generations)
+
+    def forget(self, user_ids):
+        """
+        Drop the stored generations of deleted users
+
+        Only for users that no longer exist; a forgotten user is back
+        at generation 0. Other workers keep their cached copy until
+        they restart, which is harmless as the users are gone.
+
+        Args:
+            user_ids: Iterable of user IDs to drop
+        """
+        for user_id in user_ids:
+            self._generations.pop(user_id, None)
+
+_REVOCATION_SCHEMA = """
+CREATE TABLE IF NOT EXISTS token_generations (
+    user_id INTEGER PRIMARY KEY,
+    generation INTEGER NOT NULL,
+    revoked_at INTEGER NOT NULL,
+    seq INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS revocation_generation (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    generation INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO revocation_generation (id, generation) VALUES (1, 0);
+"""
+
+_UPSERT_GENERATION = ('INSERT INTO token_generations (user_id, generation, revoked_at, seq) VALUES (?, 1, ?, ?) '
+                      'ON CONFLICT (user_id) DO UPDATE SET generation = generation + 1, '
+                      'revoked_at = excluded.revoked_at, seq = excluded.seq')
+
+class SqliteRevocationStore(MemoryRevocationStore):
+    """
+    Token generations shared by all worker processes through SQLite
+
+    Stands in for Redis on a single host. The hot-path check is a
+    dict lookup against a local copy. Every write bumps a change
+    counter and stamps the rows it touched with the new value; the
+    counter is polled at most once per `cache_ttl` seconds and only
+    rows stamped since the last poll are read, so revocations reach
+    every worker within that delay.
+    """
+    def __init__(self, db_path, cache_ttl=1.0):
+        """
+        Initialize shared store
+
+        Args:
+            db_path: Path of the shared SQLite database
+            cache_ttl: Maximum seconds before changes from other workers are seen
+        """
+        super().__init__()
+        self.db = SqliteConnectionPool(db_path, _REVOCATION_SCHEMA)
+        self.cache_ttl = cache_ttl
+        self._checked_at = 0
+        self._changes = -1  # Rows from before the seq column carry 0
+        self._lock = threading.Lock()
+        self._upgrade_schema()
+
+    def _upgrade_schema(self):
+        with self.db.transaction() as conn:
+            columns = {row['name'] for row in conn.execute('PRAGMA table_info(token_generations)')}
+            if 'seq' not in columns:
+                conn.execute('ALTER TABLE token_generations ADD COLUMN seq INTEGER NOT NULL DEFAULT 0')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_token_generations_seq ON token_generations (seq)')
+
+    def _refresh(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.cache_ttl:
+            return
+        with self._lock:
+            if now - self._checked_at < self.cache_ttl:
+                return
+            changes = self.db.execute('SELECT generation FROM revocation_generation').fetchone()[0]
+            if changes != self._changes:
+                # Read-only, so polling never waits for or blocks writers
+                with self.db.snapshot() as conn:
+                    rows = conn.execute('SELECT user_id, generation FROM token_generations WHERE seq > ?',
+                                        (self._changes,)).fetchall()
+                    changes = conn.execute('SELECT generation FROM revocation_generation').fetchone()[0]
+                self._generations.update((row['user_id'], row['generation']) for row in rows)
+                self._changes = changes
+            self._checked_at = now
+
+    @staticmethod
+    def _next_seq(conn):
+        conn.execute('UPDATE revocation_generation SET generation = generation + 1')
+        return conn.execute('SELECT generation FROM revocation_generation').fetchone()[0]
+
+    def generation(self, user_id):
+        self._refresh()
+        return super().generation(user_id)
+
+    def revoke(self, user_id):
+        with self.db.transaction() as conn:
+            conn.execute(_UPSERT_GENERATION, (user_id, int(time.time()), self._next_seq(conn)))
+            generation = conn.execute('SELECT generation FROM token_generations WHERE user_id = ?',
+                                      (user_id,)).fetchone()[0]
+        self._generations[user_id] = generation
+        return generation
+
+    def revoke_many(self, user_ids):
+        user_ids = list(dict.fromkeys(user_ids))
+        if not user_ids:
+            return {}
+        now = int(time.time())
+        with self.db.transaction() as conn:
+            seq = self._next_seq(conn)
+            conn.executemany(_UPSERT_GENERATION, [(user_id, now, seq) for user_id in user_ids])
+            generations = {}
+            for start in range(0, len(user_ids), 500):
+                chunk = user_ids[start:start + 500]
+                rows = conn.execute(f"SELECT user_id, generation FROM token_generations WHERE user_id IN "
+                                    f"({', '.join('?' for _ in chunk)})", chunk).fetchall()
+                generations.update((row['user_id'], row['generation']) for row in rows)
+        self._generations.update(generations)
+        return generations
+
+    def user_ids(self):
+        return [row['user_id'] for row in self.db.execute('SELECT user_id FROM token_generations')]
+
+    def forget(self, user_ids):
+        user_ids = list(dict.fromkeys(user_ids))
+        with self.db.transaction() as conn:
+            for start in range(0, len(user_ids), 500):
+                chunk = user_ids[start:start + 500]
+                conn.execute(f"DELETE FROM token_generations WHERE user_id IN ({', '.join('?' for _ in chunk)})",
+                             chunk)
+        super().forget(user_ids)
+
+def create_revocation_store(name=None):
+    """
+    Create a session revocation store
+
+    Args:
+        name: 'memory' or 'sqlite', defaults to Config.SESSION_STORE
+
+    Returns:
+        Revocation store instance
+    """
+    name = name or Config.SESSION_STORE
+    if name == 'sqlite':
+        return SqliteRevocationStore(Config.SHARED_STATE_DB, Config.SESSION_REVOCATION_CACHE_TTL)
+    elif name == 'memory':
+        return MemoryRevocationStore()
+    raise ValueError(f"Unknown session store: {name}")
 
 # Centralized invalid sessions tracking
-invalid_sessions = set()
-exempt_sessions = {}
+revocation_store = create_revocation_store()
 
-def is_session_valid(username):
+def token_claims(user):
     """
-    Check if a user session is valid
+    Get the JWT claims that bind a token to the user's current generation
     
     Args:
-        username: Username to check
+        user: User object the token is issued for
         
     Returns:
-        Boolean indicating if session is valid
+        dict: Additional claims for create_access_token
+    """
+    return {'uid': user['id'], 'gen': revocation_store.generation(user['id'])}
+
+def get_request_user():
+    """
+    Resolve the JWT user and its session validity once per request
+    
+    Tokens carrying a stale generation are rejected before any user
+    lookup. The result is memoized on flask.g so stacked decorators
+    and helpers share a single lookup and session check.
+    
+    Returns:
+        tuple: (user_object, session_valid)
     """
-    user = get_user(username)
+    if g.get('auth_resolved'):
+        return g.auth_user, g.auth_session_valid
     
+    verify_jwt_in_request()
+    claims = get_jwt()
+    user_id = claims.get('uid')
+    
+    user = None
+    if user_id is None or revocation_store.generation(user_id) == claims.get('gen'):
+        username = get_jwt_identity()
+        user = get_user(username) if username else None
+        if user and user_id is not None and user['id'] != user_id:
+            user = None
+    
+    g.auth_user = user
+    # Tokens issued before generations existed carry none and count as 0
+    g.auth_session_valid = _check_session(user, claims.get('gen', 0))
+    g.auth_resolved = True
+    return user, g.auth_session_valid
+
+def _check_session(user, token_generation):
     if not user:
         return False
     
-    current_sid = None
-    if hasattr(request, 'sid'):
-        current_sid = request.sid
-    
-    user_id_str = str(user['id'])
-    if user_id_str in invalid_sessions:
-        if user_id_str in exempt_sessions and exempt_sessions[user_id_str] == current_sid:
-            return True
+    if revocation_store.generation(user['id']) != token_generation:
         return False
     
     if user.get('is_suspended', False):
@@ -45,57 +281,167 @@ def get_current_user():
         dict: User object if authenticated, None otherwise
     """
     try:
-        verify_jwt_in_request()
-        username = get_jwt_identity()
+        user, session_valid = get_request_user()
         
-        if not is_session_valid(username):
+        if not session_valid:
             return None
             
-        return get_user(username)
+        return user
     except Exception as e:
-        log_error(f"Error getting current user: {str(e)}")
+        log_error("Error getting current user: %s", e)
         return None
 
 def invalidate_session(user_id):
     """
-    Invalidate a user session by ID
+    Invalidate all sessions of a user by ID
+    
+    Bumps the user's token generation so every token issued so far
+    is rejected; logging in again issues a token for the new generation
     
     Args:
         user_id: User ID to invalidate
     """
-    user_id_str = str(user_id)
-    invalid_sessions.add(user_id_str)
-    if user_id_str in exempt_sessions:
-        del exempt_sessions[user_id_str]
-    log_info(f"Session invalidated for user ID: {user_id}")
+    revocation_store.revoke(user_id)
+    log_info("Session invalidated for user ID: %s", user_id)
 
-def validate_session(user_id):
+def invalidate_sessions(user_ids):
     """
-    Validate a previously invalidated session
+    Invalidate all sessions of several users in one store write
     
     Args:
-        user_id: User ID to validate
+        user_ids: Iterable of user IDs to invalidate
+    """
+    revoked = revocation_store.revoke_many(user_ids)
+    if revoked:
+        log_info("Sessions invalidated for %s users", len(revoked))
+
+def prune_revocations():
+    """
+    Drop the stored token generations of users that no longer exist
+
+    Returns:
+        int: Number of users pruned
+    """
+    deleted = [user_id for user_id in revocation_store.user_ids() if not get_user(user_id, 'id')]
+    if deleted:
+        revocation_store.forget(deleted)
+        log_info("Pruned token generations of %s deleted users", len(deleted))
+    return len(deleted)
+
+def get_session_ids(username):
+    """
+    Get all Socket.IO session IDs for a username
+    
+    Args:
+        username: Username to get session IDs for
+        
+    Returns:
+        set: Session IDs of the user's connected tabs and devices
     """
-    user_id_str = str(user_id)
-    if user_id_str in invalid_sessions:
-        invalid_sessions.remove(user_id_str)
-    if user_id_str in exempt_sessions:
-        del exempt_sessions[user_id_str]
-    log_info(f"Session validated for user ID: {user_id}")
+    if hasattr(current_app, 'user_sessions'):
+        return current_app.user_sessions.get_sids(username)
+    return set()
 
 def get_session_id(username):
     """
-    Get Socket.IO session ID for a username
+    Get a Socket.IO session ID for a username
     
     Args:
         username: Username to get session ID for
         
     Returns:
-        str: Session ID if found, None otherwise
+        str: One of the user's session IDs if connected, None otherwise
     """
-    if hasattr(current_app, 'user_sessions') and username in current_app.user_sessions:
-        return current_app.user_sessions[username]
-    return None
+    return next(iter(get_session_ids(username)), None)
+
+def rename_user_sessions(old_username, new_username):
+    """
+    Move a user's connected sessions and Socket.IO room to a new username
+    
+    Args:
+        old_username: Previous username
+        new_username: New username
+    """
+    if not hasattr(current_app, 'user_sessions'):
+        return
+    
+    sids = current_app.user_sessions.rename(old_username, new_username)
+    if sids and hasattr(current_app, 'socketio'):
+        server = current_app.socketio.server
+        for sid in sids:
+            server.enter_room(sid, new_username, namespace='/')
+            server.leave_room(sid, old_username, namespace='/')
+    if sids:
+        log_info("Session IDs %s remapped from %s to %s", sids, old_username, new_username)
+
+def emit_to_users(usernames, event, data):
+    """
+    Emit one Socket.IO event to many users
+    
+    Each user has a room named after them. The targets are grouped
+    into chunks of Config.SOCKETIO_EMIT_BATCH_SIZE rooms and each chunk
+    is sent with a single emit, so the payload is encoded once per
+    chunk (and published once per chunk with a message queue) instead
+    of once per user.
+    
+    Args:
+        usernames: Iterable of target usernames
+        event: Event name
+        data: Event data
+        
+    Returns:
+        dict: Username -> True if the event was sent to that user.
+            Without a message queue this is exactly the set of users
+            connected to this node; with one, every user in a published
+            chunk counts as sent since they may be connected elsewhere
+    """
+    usernames = list(dict.fromkeys(usernames))
+    results = dict.fromkeys(usernames, False)
+    if not usernames or not hasattr(current_app, 'socketio'):
+        return results
+    
+    # With a message queue users may be connected to another node,
+    # so the emit is published regardless of local presence
+    if queue_enabled():
+        targets = usernames
+    elif hasattr(current_app, 'user_sessions'):
+        targets = [username for username in usernames if current_app.user_sessions.is_online(username)]
+    else:
+        targets = []
+    
+    batch_size = Config.SOCKETIO_EMIT_BATCH_SIZE
+    for start in range(0, len(targets), batch_size):
+        rooms = targets[start:start + batch_size]
+        try:
+            current_app.socketio.emit(event, data, room=rooms if len(rooms) > 1 else rooms[0])
+        except Exception as e:
+            log_error("Error emitting event to %s users: %s", len(rooms), e)
+            continue
+        for username in rooms:
+            results[username] = True
+    
+    return results
+
+def broadcast(event, data):
+    """
+    Emit a Socket.IO event to every connected client
+    
+    Args:
+        event: Event name
+        data: Event data
+        
+    Returns:
+        bool: True if event was emitted, False otherwise
+    """
+    if not hasattr(current_app, 'socketio'):
+        return False
+    
+    try:
+        current_app.socketio.emit(event, data)
+        return True
+    except Exception as e:
+        log_error("Error broadcasting event: %s", e)
+        return False
 
 def emit_to_user(username, event, data):
     """
@@ -109,11 +455,4 @@ def emit_to_user(username, event, data):
     Returns:
         bool: True if event was emitted, False otherwise
     """
-    session_id = get_session_id(username)
-    if session_id and hasattr(current_app, 'socketio'):
-        try:
-            current_app.socketio.emit(event, data, room=username)
-            return True
-        except Exception as e:
-            log_error(f"Error emitting event to user: {str(e)}")
-    return False
+    return emit_to_users([username], event, data)[username]
@@ -0,0 +1,107 @@
+import time
+import socketio
+from utils.config import Config
+from utils.dbutils import SqliteConnectionPool
+
+_QUEUE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS socketio_messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    channel TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_socketio_messages_channel ON socketio_messages (channel, id);
+"""
+
+class SqliteQueueManager(socketio.PubSubManager):
+    """
+    Socket.IO client manager that fans out through a SQLite table
+
+    A local stand-in for Redis when running several workers on one
+    host or in tests: every node appends published messages to a
+    shared table and polls it for messages from other nodes. Use a
+    URL of the form sqlite:///path/to/file.db.
+    """
+    name = 'sqlite'
+
+    def __init__(self, url='sqlite://', channel='socketio', write_only=False, logger=None,
+                 poll_interval=0.05, retention=60):
+        """
+        Initialize queue manager
+
+        Args:
+            url: sqlite:// URL of the queue database; an empty path uses Config.SHARED_STATE_DB
+            channel: Channel name shared by all nodes
+            write_only: Only publish, do not listen (for background jobs)
+            logger: Optional logger
+            poll_interval: Seconds between polls for new messages
+            retention: Seconds published messages are kept
+        """
+        path = url[len('sqlite://'):] or Config.SHARED_STATE_DB
+        self.db = SqliteConnectionPool(path, _QUEUE_SCHEMA)
+        self.poll_interval = poll_interval
+        self.retention = retention
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+
+    def _publish(self, data):
+        self.db.execute('INSERT INTO socketio_messages (channel, payload, created_at) VALUES (?, ?, ?)',
+                        (self.channel, self.json.dumps(data), time.time()))
+
+    def _listen(self):
+        last_id = self.db.execute('SELECT COALESCE(MAX(id), 0) FROM socketio_messages').fetchone()[0]
+        next_cleanup = time.time() + self.retention
+        while True:
+            rows = self.db.execute('SELECT id, payload FROM socketio_messages WHERE channel = ? AND id > ? ORDER BY id',
+                                   (self.channel, last_id)).fetchall()
+            for row in rows:
+                last_id = row['id']
+                yield row['payload']
+
+            if time.time() >= next_cleanup:
+                self.db.execute('DELETE FROM socketio_messages WHERE created_at < ?', (time.time() - self.retention,))
+                next_cleanup = time.time() + self.retention
+            if self.server:
+                self.server.sleep(self.poll_interval)
+            else:
+                time.sleep(self.poll_interval)
+
+def queue_enabled():
+    return bool(Config.SOCKETIO_MESSAGE_QUEUE)
+
+def socketio_queue_options():
+    """
+    Get SocketIO constructor options for the configured message queue
+
+    Returns:
+        dict: Empty for single-process mode, otherwise the options that
+            make emits fan out to every node
+    """
+    url = Config.SOCKETIO_MESSAGE_QUEUE
+    if not url:
+        return {}
+    if url.startswith('sqlite://'):
+        return {'client_manager': SqliteQueueManager(url, channel=Config.SOCKETIO_QUEUE_CHANNEL)}
+    return {'message_queue': url, 'channel': Config.SOCKETIO_QUEUE_CHANNEL}
+
+def create_emitter(url=None):
+    """
+    Create a write-only emitter for use outside the socket server
+
+    Background jobs and scripts can notify connected users without
+    running a server, e.g.
+    create_emitter().emit('force_logout', data, room=username, namespace='/')
+
+    Args:
+        url: Message queue URL, defaults to Config.SOCKETIO_MESSAGE_QUEUE
+
+    Returns:
+        Object with an emit(event, data, room=..., namespace=...) method
+    """
+    url = url or Config.SOCKETIO_MESSAGE_QUEUE
+    if not url:
+        raise RuntimeError('SOCKETIO_MESSAGE_QUEUE must be configured to emit from outside the server')
+    if url.startswith('sqlite://'):
+        return SqliteQueueManager(url, channel=Config.SOCKETIO_QUEUE_CHANNEL, write_only=True)
+
+    from flask_socketio import SocketIO
+    return SocketIO(message_queue=url, channel=Config.SOCKETIO_QUEUE_CHANNEL)
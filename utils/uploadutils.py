@@ -0,0 +1,160 @@
+import fcntl
+import json
+import os
+import re
+import time
+import uuid
+from utils.config import Config
+from utils.logutils import log_info, log_error
+from utils.pfputils import UploadRejected
+
+_UPLOAD_ID = re.compile(r'^[0-9a-f]{32}$')
+_COPY_CHUNK_SIZE = 64 * 1024
+
+def _paths(upload_id):
+    base = os.path.join(Config.UPLOADS_DIR, upload_id)
+    return base + '.json', base + '.part'
+
+def _cleanup_expired():
+    cutoff = time.time() - Config.UPLOAD_SESSION_TTL
+    try:
+        for entry in os.scandir(Config.UPLOADS_DIR):
+            if entry.name.endswith('.json') and entry.stat().st_mtime < cutoff:
+                delete_upload(entry.name[:-len('.json')])
+    except FileNotFoundError:
+        pass
+
+def create_upload(user_id, size):
+    """
+    Start a resumable upload
+
+    The client then sends the file in any number of chunks, each at
+    the offset the server reports, and can resume after a dropped
+    connection by asking for the current offset
+
+    Args:
+        user_id: ID of the uploading user
+        size: Total size of the file in bytes
+
+    Returns:
+        dict: Upload state with 'upload_id', 'offset' and 'size'
+
+    Raises:
+        UploadRejected: If the size is not acceptable
+    """
+    if not isinstance(size, int) or size <= 0:
+        raise UploadRejected('size must be a positive integer')
+    if size > Config.PROFILE_PICTURE_MAX_BYTES:
+        raise UploadRejected('Profile picture is too large', status_code=413)
+
+    _cleanup_expired()
+    os.makedirs(Config.UPLOADS_DIR, exist_ok=True)
+
+    upload_id = uuid.uuid4().hex
+    meta_path, part_path = _paths(upload_id)
+    open(part_path, 'wb').close()
+    with open(meta_path, 'w') as f:
+        json.dump({'user_id': user_id, 'size': size, 'created_at': int(time.time())}, f)
+
+    log_info("Resumable upload %s started by user ID %s", upload_id, user_id)
+    return {'upload_id': upload_id, 'offset': 0, 'size': size}
+
+def get_upload(upload_id, user_id):
+    """
+    Get the state of a user's resumable upload
+
+    Args:
+        upload_id: Upload ID from create_upload
+        user_id: ID of the requesting user
+
+    Returns:
+        dict: Upload state, or None if there is no such upload for the user
+    """
+    if not _UPLOAD_ID.match(upload_id):
+        return None
+
+    meta_path, part_path = _paths(upload_id)
+    try:
+        with open(meta_path) as f:
+            meta = json.load(f)
+        offset = os.path.getsize(part_path)
+    except (FileNotFoundError, ValueError):
+        return None
+
+    if meta.get('user_id') != user_id:
+        return None
+    return {'upload_id': upload_id, 'offset': offset, 'size': meta['size']}
+
+def append_upload(upload_id, user_id, offset, stream):
+    """
+    Append a chunk to a resumable upload
+
+    The chunk is copied from the request stream in fixed-size pieces
+    and must start exactly at the current offset, so a retried chunk
+    is detected instead of being written twice
+
+    Args:
+        upload_id: Upload ID from create_upload
+        user_id: ID of the uploading user
+        offset: Offset the client claims the chunk starts at
+        stream: Readable stream with the chunk bytes
+
+    Returns:
+        dict: Upload state after the chunk, or None if there is no such upload
+
+    Raises:
+        UploadRejected: If the offset is stale or the chunk overruns the size
+    """
+    upload = get_upload(upload_id, user_id)
+    if not upload:
+        return None
+
+    _, part_path = _paths(upload_id)
+    with open(part_path, 'r+b') as f:
+        # One writer per upload, also across worker processes
+        fcntl.flock(f, fcntl.LOCK_EX)
+        current = os.fstat(f.fileno()).st_size
+        if offset != current:
+            raise UploadRejected(f'Upload is at offset {current}', status_code=409)
+
+        f.seek(current)
+        remaining = upload['size'] - current
+        for chunk in iter(lambda: stream.read(_COPY_CHUNK_SIZE), b''):
+            if len(chunk) > remaining:
+                f.truncate(current)
+                raise UploadRejected('Chunk exceeds the declared upload size', status_code=413)
+            f.write(chunk)
+            current += len(chunk)
+            remaining -= len(chunk)
+
+    upload['offset'] = current
+    return upload
+
+def completed_upload_path(upload):
+    """
+    Get the file of an upload if all bytes have arrived
+
+    Args:
+        upload: Upload state
+
+    Returns:
+        str: Path of the complete file, or None if still incomplete
+    """
+    if upload['offset'] < upload['size']:
+        return None
+    return _paths(upload['upload_id'])[1]
+
+def delete_upload(upload_id):
+    """
+    Remove a resumable upload and its data
+
+    Args:
+        upload_id: Upload ID to remove
+    """
+    for path in _paths(upload_id):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            log_error("Error deleting upload %s: %s", upload_id, e)
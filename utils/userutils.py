@@ -1,98 +1,1635 @@
-import json, os, time
-from utils.logutils import log_error
+import atexit, bisect, json, os, sqlite3, time, fcntl, threading
+from contextlib import contextmanager
+from utils.config import Config
+from utils.dbutils import SqliteConnectionPool
+from utils.logutils import log_error, log_info
+from utils.metrics import user_store_duration_seconds
 
-_users_cache = None
-_last_load_time = 0
-_cache_ttl = 5  # seconds
+_backend = None
+
+_MISSING = object()
+_HOT_FIELDS = ('id', 'username', 'is_admin', 'is_suspended', 'created_at', 'profile_picture')
+_HOT_FIELD_SET = frozenset(_HOT_FIELDS)
+
+class UsernameTaken(Exception):
+    """Raised when a new or renamed user would reuse a username or ID already in use"""
+    def __init__(self, message='Username already exists'):
+        super().__init__(message)
+
+class UserRecord:
+    """
+    Compact user record with dict-style access
+
+    The fields most requests need live in slots. The remaining cold
+    fields (password hash, change timestamps, ...) are kept as one
+    encoded JSON blob, or fetched through a loader callable, and are
+    only decoded when accessed.
+    """
+    __slots__ = _HOT_FIELDS + ('_cold',)
+
+    def __init__(self, fields=None, cold_loader=None):
+        """
+        Initialize record
+
+        Args:
+            fields: Optional mapping of user fields
+            cold_loader: Optional callable returning the cold fields
+        """
+        for name in _HOT_FIELDS:
+            setattr(self, name, _MISSING)
+        self._cold = cold_loader
+        if fields:
+            self.update(fields)
+
+    def _cold_fields(self):
+        cold = self._cold
+        if cold is None:
+            return {}
+        if callable(cold):
+            fields = cold()
+            self._set_cold_fields(fields)
+            return fields
+        return json.loads(cold)
+
+    def _set_cold_fields(self, fields):
+        self._cold = json.dumps(fields, separators=(',', ':')).encode() if fields else None
+
+    def __getitem__(self, key):
+        if key in _HOT_FIELD_SET:
+            value = getattr(self, key)
+            if value is _MISSING:
+                raise KeyError(key)
+            return value
+        return self._cold_fields()[key]
+
+    def __setitem__(self, key, value):
+        self.update({key: value})
+
+    def __delitem__(self, key):
+        if key in _HOT_FIELD_SET:
+            if getattr(self, key) is _MISSING:
+                raise KeyError(key)
+            setattr(self, key, _MISSING)
+            return
+        fields = self._cold_fields()
+        del fields[key]
+        self._set_cold_fields(fields)
+
+    def __contains__(self, key):
+        if key in _HOT_FIELD_SET:
+            return getattr(self, key) is not _MISSING
+        return key in self._cold_fields()
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def update(self, fields):
+        """
+        Update fields, re-encoding the cold blob at most once
+
+        Args:
+            fields: Mapping of field names to values
+        """
+        cold_updates = {}
+        for key, value in fields.items():
+            if key in _HOT_FIELD_SET:
+                setattr(self, key, value)
+            else:
+                cold_updates[key] = value
+
+        if cold_updates:
+            cold = self._cold_fields()
+            cold.update(cold_updates)
+            self._set_cold_fields(cold)
+
+    def to_dict(self):
+        """
+        Get a plain dictionary with all fields
+
+        Returns:
+            dict: Hot and cold fields
+        """
+        data = {name: getattr(self, name) for name in _HOT_FIELDS if getattr(self, name) is not _MISSING}
+        data.update(self._cold_fields())
+        return data
+
+    def keys(self):
+        return self.to_dict().keys()
+
+    def items(self):
+        return self.to_dict().items()
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.to_dict())
+
+    def __repr__(self):
+        return f"UserRecord(id={self.get('id')!r}, username={self.get('username')!r})"
+
+def _json_default(value):
+    if isinstance(value, UserRecord):
+        return value.to_dict()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def _to_record(user):
+    return user if isinstance(user, UserRecord) else UserRecord(user)
+
+# Sort orders for user listings: key function and the fields it reads
+USER_SORT_KEYS = {
+    'id': (lambda user: user['id'], ('id',)),
+    'username': (lambda user: user['username'], ('username',)),
+    'created_at': (lambda user: (user.get('created_at') or 0, user['id']), ('created_at', 'id')),
+}
+
+def prefix_upper_bound(prefix):
+    """
+    Get the smallest string greater than every string starting with prefix
+
+    Args:
+        prefix: Non-empty string prefix
+
+    Returns:
+        str: Exclusive upper bound for a prefix range scan
+    """
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+def matches_filters(user, filters):
+    """
+    Check a user against listing filters
+
+    Args:
+        user: User dict or record
+        filters: Dictionary with any of 'is_suspended', 'is_admin',
+            'created_after' (inclusive), 'created_before' (exclusive)
+            and 'username_prefix'
+
+    Returns:
+        Boolean indicating if the user matches every filter
+    """
+    if 'is_suspended' in filters and bool(user.get('is_suspended', False)) != filters['is_suspended']:
+        return False
+    if 'is_admin' in filters and bool(user.get('is_admin', False)) != filters['is_admin']:
+        return False
+    created_at = user.get('created_at') or 0
+    if 'created_after' in filters and created_at < filters['created_after']:
+        return False
+    if 'created_before' in filters and created_at >= filters['created_before']:
+        return False
+    if 'username_prefix' in filters and not user['username'].startswith(filters['username_prefix']):
+        return False
+    return True
+
+class SortedIndex:
+    """
+    User IDs kept sorted by a key of the user record
+
+    Maintained incrementally with bisect, so range scans start at the
+    right position instead of walking the whole user list. An optional
+    predicate restricts the index to matching users (e.g. suspended).
+    """
+    CHUNK = 256
+
+    def __init__(self, key, fields, lookup, predicate=None):
+        """
+        Initialize index
+
+        Args:
+            key: Function mapping a user record to its sort key
+            fields: Names of the fields the key and predicate read
+            lookup: Function mapping a user ID to its record
+            predicate: Optional function selecting the indexed users
+        """
+        self.key = key
+        self.fields = fields
+        self.lookup = lookup
+        self.predicate = predicate
+        self.ids = []
+        self._id_key = lambda user_id: key(lookup(user_id))
+
+    def rebuild(self, users):
+        self.ids = [user['id'] for user in sorted(
+            (user for user in users if self._includes(user)), key=self.key)]
+
+    def _includes(self, user):
+        return self.predicate is None or bool(self.predicate(user))
+
+    def add(self, user):
+        if self._includes(user):
+            bisect.insort(self.ids, user['id'], key=self._id_key)
+
+    def remove(self, user):
+        """Remove a user, which must still hold the values it was indexed with"""
+        if not self._includes(user):
+            return
+        user_key = self.key(user)
+        index = bisect.bisect_left(self.ids, user_key, key=self._id_key)
+        while index < len(self.ids) and self._id_key(self.ids[index]) == user_key:
+            if self.ids[index] == user['id']:
+                del self.ids[index]
+                return
+            index += 1
+
+    def scan(self, low=None, high=None, after=None, descending=False):
+        """
+        Iterate user records in key order within a range
+
+        The list is copied in small chunks and the position is found
+        again by key after each chunk, so concurrent writes never
+        invalidate the scan.
+
+        Args:
+            low: Optional inclusive lower key bound
+            high: Optional exclusive upper key bound
+            after: Optional key of the last record already returned
+            descending: Iterate from high to low
+
+        Yields:
+            User records
+        """
+        if not descending:
+            position = bisect.bisect_left(self.ids, low, key=self._id_key) if low is not None else 0
+            if after is not None:
+                position = max(position, bisect.bisect_right(self.ids, after, key=self._id_key))
+            while True:
+                chunk = self.ids[position:position + self.CHUNK]
+                if not chunk:
+                    return
+                user_key = None
+                for user_id in chunk:
+                    user = self.lookup(user_id)
+                    if user is None:
+                        continue
+                    user_key = self.key(user)
+                    if high is not None and user_key >= high:
+                        return
+                    yield user
+                if user_key is None:
+                    position += len(chunk)
+                else:
+                    position = bisect.bisect_right(self.ids, user_key, key=self._id_key)
+        else:
+            end = bisect.bisect_left(self.ids, high, key=self._id_key) if high is not None else len(self.ids)
+            if after is not None:
+                end = min(end, bisect.bisect_left(self.ids, after, key=self._id_key))
+            while end > 0:
+                chunk = self.ids[max(0, end - self.CHUNK):end]
+                user_key = None
+                for user_id in reversed(chunk):
+                    user = self.lookup(user_id)
+                    if user is None:
+                        continue
+                    user_key = self.key(user)
+                    if low is not None and user_key < low:
+                        return
+                    yield user
+                if user_key is None:
+                    end -= len(chunk)
+                else:
+                    end = bisect.bisect_left(self.ids, user_key, key=self._id_key)
+
+class UserRepository:
+    """
+    In-memory user repository with hash indexes
+
+    Holds the ordered user list together with O(1) indexes by
+    username and by id, so lookups never scan the whole list
+    """
+    def __init__(self, users=None):
+        """
+        Initialize repository
+
+        Args:
+            users: Optional list of user dictionaries to index
+        """
+        self.users = [_to_record(user) for user in users] if users else []
+        self._by_username = {}
+        self._by_id = {}
+        self._max_id = 0  # highest ID added, kept when that user is deleted
+        self._sorted = None  # secondary indexes, built on first listing
+        self.reindex()
+
+    def reset(self, users):
+        """Replace the user list in place and rebuild indexes"""
+        self.users[:] = [_to_record(user) for user in users]
+        self.reindex()
+
+    def reindex(self):
+        """Rebuild all indexes from the user list"""
+        self._by_username = {user['username']: user for user in self.users}
+        self._by_id = {user['id']: user for user in self.users}
+        self._max_id = max(self._by_id, default=0)
+        self._sorted = None
+
+    def get_by_username(self, username):
+        return self._by_username.get(username)
+
+    def get_by_id(self, user_id):
+        return self._by_id.get(user_id)
+
+    def exists(self, username):
+        return username in self._by_username
+
+    def next_id(self):
+        """
+        Get the next free user ID
+
+        IDs of deleted users are not handed out again while the
+        repository is loaded
+
+        Returns:
+            int: One more than the highest ID added so far
+        """
+        return self._max_id + 1
+
+    def add(self, user):
+        """
+        Add a new user and index it
+
+        Args:
+            user: User dictionary with at least 'id' and 'username'
+
+        Returns:
+            The added user record
+        """
+        user = _to_record(user)
+        self.users.append(user)
+        self._by_username[user['username']] = user
+        self._by_id[user['id']] = user
+        self._max_id = max(self._max_id, user['id'])
+        for index in self._sorted_indexes():
+            index.add(user)
+        return user
+
+    def update(self, user_id, updates):
+        """
+        Apply field updates to a user, keeping indexes in sync on rename
+
+        Args:
+            user_id: ID of user to update
+            updates: Dictionary of fields to update
+
+        Returns:
+            Updated user dict or None if not found
+        """
+        user = self._by_id.get(user_id)
+        if not user:
+            return None
+
+        old_username = user['username']
+        touched = [index for index in self._sorted_indexes() if any(field in updates for field in index.fields)]
+        for index in touched:
+            index.remove(user)
+        user.update(updates)
+        for index in touched:
+            index.add(user)
+
+        if user['username'] != old_username:
+            if self._by_username.get(old_username) is user:
+                del self._by_username[old_username]
+            self._by_username[user['username']] = user
+        return user
+
+    def delete(self, user_id):
+        """
+        Remove a user and drop it from the indexes
+
+        Args:
+            user_id: ID of user to delete
+
+        Returns:
+            Removed user dict or None if not found
+        """
+        user = self._by_id.get(user_id)
+        if not user:
+            return None
+
+        for index in self._sorted_indexes():
+            index.remove(user)
+        del self._by_id[user_id]
+
+        if self._by_username.get(user['username']) is user:
+            del self._by_username[user['username']]
+        self.users.remove(user)
+        return user
+
+    def _sorted_indexes(self):
+        return self._sorted.values() if self._sorted is not None else ()
+
+    def sorted_index(self, name):
+        """
+        Get a sorted secondary index, building all of them on first use
+
+        Args:
+            name: A USER_SORT_KEYS name, 'suspended' or 'admin'
+
+        Returns:
+            SortedIndex instance
+        """
+        if self._sorted is None:
+            lookup = self._by_id.get
+            indexes = {name: SortedIndex(key, fields, lookup) for name, (key, fields) in USER_SORT_KEYS.items()}
+            id_key = USER_SORT_KEYS['id'][0]
+            indexes['suspended'] = SortedIndex(id_key, ('id', 'is_suspended'), lookup,
+                                               lambda user: user.get('is_suspended', False))
+            indexes['admin'] = SortedIndex(id_key, ('id', 'is_admin'), lookup,
+                                           lambda user: user.get('is_admin', False))
+            for index in indexes.values():
+                index.rebuild(self.users)
+            self._sorted = indexes
+        return self._sorted[name]
+
+    def list_users(self, sort='id', descending=False, after=None, filters=None, limit=None):
+        """
+        Iterate users in a sort order, starting after a cursor key
+
+        The scan is driven by the index that matches the sort order
+        and is narrowed by the filters that index can answer (a
+        username prefix, a creation range, or the suspended/admin
+        sets); remaining filters are checked per user.
+
+        Args:
+            sort: A USER_SORT_KEYS name
+            descending: Reverse the sort order
+            after: Sort key of the last user of the previous page
+            filters: Optional filters, see matches_filters
+            limit: Optional maximum number of users
+
+        Yields:
+            User records
+        """
+        filters = filters or {}
+        low = high = None
+        if sort == 'username' and filters.get('username_prefix'):
+            low = filters['username_prefix']
+            high = prefix_upper_bound(low)
+            index = self.sorted_index('username')
+        elif sort == 'created_at':
+            if 'created_after' in filters:
+                low = (filters['created_after'],)
+            if 'created_before' in filters:
+                high = (filters['created_before'],)
+            index = self.sorted_index('created_at')
+        elif sort == 'id' and filters.get('is_suspended'):
+            index = self.sorted_index('suspended')
+        elif sort == 'id' and filters.get('is_admin'):
+            index = self.sorted_index('admin')
+        else:
+            index = self.sorted_index(sort)
+
+        count = 0
+        for user in index.scan(low, high, after, descending):
+            if limit is not None and count >= limit:
+                return
+            if matches_filters(user, filters):
+                count += 1
+                yield user
+
+def apply_record(repository, record):
+    """
+    Apply a single journal record to a repository
+
+    Updates and deletes are idempotent. An insert never merges into
+    an existing user: one whose ID or username is already in use fails,
+    as does a rename to a username another user holds
+
+    Args:
+        repository: UserRepository to modify
+        record: Dictionary with 'op' of 'insert', 'update' or 'delete'
+
+    Returns:
+        The affected user dict or None
+
+    Raises:
+        UsernameTaken: If an inserted user's ID or username, or a new
+            username, is in use
+    """
+    op = record.get('op')
+    if op == 'insert':
+        user = record['user']
+        if repository.get_by_id(user['id']) or repository.exists(user['username']):
+            raise UsernameTaken()
+        return repository.add(UserRecord(user))
+    elif op == 'update':
+        if 'username' in record['changes']:
+            owner = repository.get_by_username(record['changes']['username'])
+            if owner is not None and owner['id'] != record['id']:
+                raise UsernameTaken()
+        return repository.update(record['id'], record['changes'])
+    elif op == 'delete':
+        return repository.delete(record['id'])
+
+    log_error("Unknown user journal operation: %s", op)
+    return None
+
+def _record_user_id(record):
+    return record['user'].get('id') if record.get('op') == 'insert' else record.get('id')
+
+def _fsync_write(path, data):
+    """Write data to a temporary file and atomically rename it over path"""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+class UserJournal:
+    """
+    Users snapshot file plus an append-only change journal
+
+    Each mutation appends one small JSON line to the journal instead
+    of rewriting the whole snapshot. Loading replays the journal over
+    the snapshot and compaction folds it back into a fresh snapshot.
+    All file replacements are atomic (temp file plus rename).
+    """
+    def __init__(self, snapshot_path, journal_path):
+        """
+        Initialize journal
+
+        Args:
+            snapshot_path: Path of the users JSON snapshot
+            journal_path: Path of the JSON-lines change journal
+        """
+        self.snapshot_path = snapshot_path
+        self.journal_path = journal_path
+        self.lock_path = journal_path + '.lock'
+        self.offset = 0
+        self.records = 0
+        self.journal_inode = None
+        self.snapshot_identity = None
+        self.last_compaction = time.time()
+        self.pending = []
+        self._mutex = threading.RLock()
+
+    @contextmanager
+    def locked(self):
+        """Hold an exclusive cross-process lock on the journal"""
+        with self._mutex, open(self.lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _snapshot_identity(self):
+        try:
+            stat = os.stat(self.snapshot_path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+    def _journal_stat(self):
+        try:
+            return os.stat(self.journal_path)
+        except FileNotFoundError:
+            return None
+
+    def load(self, repository):
+        """
+        Reset a repository from the snapshot and replay the journal
+
+        Args:
+            repository: UserRepository to fill
+        """
+        try:
+            with open(self.snapshot_path, 'r') as f:
+                stat = os.fstat(f.fileno())
+                users = json.load(f)
+            self.snapshot_identity = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        except FileNotFoundError:
+            users = []
+            self.snapshot_identity = None
+        repository.reset(users)
+
+        self.offset = 0
+        self.records = 0
+        self.journal_inode = None
+        self.replay(repository)
+
+        # Changes staged in memory but not yet flushed stay visible
+        for record in self.pending:
+            try:
+                apply_record(repository, record)
+            except UsernameTaken:
+                log_error("Dropping unflushed user journal %s of user ID %s, username or ID taken by another process",
+                          record['op'], _record_user_id(record))
+
+    def refresh(self, repository):
+        """
+        Bring a loaded repository up to date with the files on disk
+
+        The snapshot identity (inode, size, mtime) and the journal
+        length are checked with stat(), so an unchanged store costs
+        no parsing. A replaced snapshot triggers a full reload and a
+        longer journal only replays the new records.
+
+        Args:
+            repository: UserRepository previously filled by load()
+        """
+        if not self._mutex.acquire(blocking=False):
+            # A flush is in progress; memory already holds its changes
+            return
+        try:
+            if self._snapshot_identity() != self.snapshot_identity:
+                self.load(repository)
+            else:
+                self.replay(repository)
+        finally:
+            self._mutex.release()
+
+    def replay(self, repository):
+        """
+        Apply journal records written since the last replay
+
+        Reloads from the snapshot if the journal was rotated by a
+        compaction in another process
+
+        Args:
+            repository: UserRepository to bring up to date
+        """
+        stat = self._journal_stat()
+        if stat is None:
+            return
+        if self.journal_inode is not None and stat.st_ino != self.journal_inode:
+            self.load(repository)
+            return
+        self.journal_inode = stat.st_ino
+        if stat.st_size <= self.offset:
+            return
+
+        with open(self.journal_path, 'rb') as f:
+            f.seek(self.offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    # Torn write from a crash, ignore the partial record
+                    break
+                self.offset += len(line)
+                try:
+                    record = json.loads(line)
+                except ValueError as e:
+                    log_error("Skipping corrupt user journal record: %s", e)
+                    continue
+                try:
+                    apply_record(repository, record)
+                except UsernameTaken:
+                    # An insert already in the snapshot when a compaction was
+                    # interrupted, or a rename that lost a race before renames
+                    # were checked under the journal lock
+                    log_error("Skipping user journal %s of user ID %s, username or ID in use",
+                              record['op'], _record_user_id(record))
+                self.records += 1
+
+    def stage(self, repository, records):
+        """
+        Apply records in memory and queue them for the next flush
+
+        Args:
+            repository: UserRepository to modify
+            records: List of journal record dictionaries
+
+        Returns:
+            List of affected user dicts, one per record
+        """
+        with self._mutex:
+            self.pending.extend(records)
+            return [apply_record(repository, record) for record in records]
+
+    def commit(self, repository, records):
+        """
+        Apply records and append them to the journal immediately
+
+        Args:
+            repository: UserRepository to modify
+            records: List of journal record dictionaries
+
+        Returns:
+            List of affected user dicts, one per record
+        """
+        with self._mutex:
+            results = self.stage(repository, records)
+            self.flush(repository)
+        return results
+
+    def insert(self, repository, user):
+        """
+        Add a new user and append it to the journal at once
+
+        The ID is allocated and the username checked while holding the
+        journal lock, after replaying what other processes appended,
+        so concurrent registrations in any process never collide
+
+        Args:
+            repository: UserRepository to modify
+            user: User dictionary; 'id' is assigned if missing
+
+        Returns:
+            The added user record
+
+        Raises:
+            UsernameTaken: If the username or given ID is already in use
+        """
+        with self.locked():
+            self.refresh(repository)
+            user_id = user['id'] if 'id' in user else repository.next_id()
+            record = {'op': 'insert', 'user': dict(user, id=user_id)}
+            result = apply_record(repository, record)
+            user['id'] = user_id
+            self.pending.append(record)
+            self._flush_locked(repository)
+
+        if self.needs_compaction():
+            self.compact(repository)
+        return result
+
+    def rename(self, repository, user_id, changes):
+        """
+        Apply an update that changes the username and append it at once
+
+        Like insert(), the username is checked while holding the journal
+        lock, after replaying what other processes appended, so two
+        processes can never hand out the same name
+
+        Args:
+            repository: UserRepository to modify
+            user_id: ID of user to update
+            changes: Dictionary of fields to update, including 'username'
+
+        Returns:
+            Updated user record or None if not found
+
+        Raises:
+            UsernameTaken: If another user holds the new username
+        """
+        with self.locked():
+            self.refresh(repository)
+            if not repository.get_by_id(user_id):
+                return None
+            record = {'op': 'update', 'id': user_id, 'changes': changes}
+            result = apply_record(repository, record)
+            self.pending.append(record)
+            self._flush_locked(repository)
+
+        if self.needs_compaction():
+            self.compact(repository)
+        return result
+
+    def flush(self, repository):
+        """
+        Append all staged records to the journal in one durable write
+
+        Args:
+            repository: UserRepository holding the staged changes
+        """
+        with self.locked():
+            self._flush_locked(repository)
+
+        if self.needs_compaction():
+            self.compact(repository)
+
+    def _flush_locked(self, repository):
+        records, self.pending = self.pending, []
+        if not records:
+            return
+
+        # Records from other processes precede ours in the file, so
+        # replay them first and re-apply ours on top to keep order.
+        # Inserts were applied under this lock by insert() already.
+        self.replay(repository)
+        for record in records:
+            if record.get('op') != 'insert':
+                apply_record(repository, record)
+
+        data = b''.join(json.dumps(record, separators=(',', ':'), default=_json_default).encode() + b'\n' for record in records)
+        try:
+            self._append(data)
+        except Exception:
+            self.pending[:0] = records
+            raise
+        self.records += len(records)
+
+    def _append(self, data):
+        with user_store_duration_seconds.time('journal_append'), open(self.journal_path, 'ab') as f:
+            if f.tell() > self.offset:
+                # Drop a torn record left behind by a crashed writer
+                f.truncate(self.offset)
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+            self.journal_inode = os.fstat(f.fileno()).st_ino
+        self.offset += len(data)
+
+    def needs_compaction(self):
+        if not self.records:
+            return False
+        return (self.records >= Config.USERS_JOURNAL_MAX_RECORDS or
+                time.time() - self.last_compaction >= Config.USERS_COMPACT_INTERVAL)
+
+    def compact(self, repository, users=None):
+        """
+        Fold the journal into a fresh snapshot and start an empty journal
+
+        Args:
+            repository: UserRepository holding the current state
+            users: Optional list to write instead of the repository contents
+        """
+        with self.locked(), user_store_duration_seconds.time('compact'):
+            if users is None:
+                self.replay(repository)
+                users = repository.users
+
+            _fsync_write(self.snapshot_path, json.dumps(users, default=_json_default).encode())
+            _fsync_write(self.journal_path, b'')
+
+            self.snapshot_identity = self._snapshot_identity()
+            stat = self._journal_stat()
+            self.journal_inode = stat.st_ino if stat else None
+            log_info("Compacted user journal (%s records)", self.records)
+            self.offset = 0
+            self.records = 0
+            self.last_compaction = time.time()
+
+class CommitTicket:
+    """Handle for a submitted write, resolved once it is durable"""
+    def __init__(self):
+        self._event = threading.Event()
+        self.result = None
+        self.error = None
+
+    def resolve(self, result=None, error=None):
+        self.result = result
+        self.error = error
+        self._event.set()
+
+    def wait(self, timeout=None):
+        """
+        Block until the write is durable
+
+        Args:
+            timeout: Optional maximum wait in seconds
+
+        Returns:
+            The result of the write
+
+        Raises:
+            TimeoutError: If the write was not committed in time
+        """
+        if not self._event.wait(timeout):
+            raise TimeoutError('User write was not committed in time')
+        if self.error:
+            raise self.error
+        return self.result
+
+class GroupCommitter:
+    """
+    Background flusher that coalesces concurrent writes
+
+    Submitted items are collected for up to `interval` seconds, or
+    until `batch_size` items are waiting, and then committed together
+    with a single call to the flush function
+    """
+    def __init__(self, flush, interval=0.005, batch_size=256):
+        """
+        Initialize group committer
+
+        Args:
+            flush: Callable taking a list of items and returning one
+                result per item; an Exception result fails that item
+            interval: Maximum seconds to wait for more items
+            batch_size: Number of items that triggers an immediate commit
+        """
+        self.flush = flush
+        self.interval = interval
+        self.batch_size = batch_size
+        self._items = []
+        self._last_ticket = None
+        self._cond = threading.Condition()
+        self._pid = None
+
+    def _ensure_thread(self):
+        # Started lazily and restarted in forked worker processes
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._items = []
+        threading.Thread(target=self._run, name='user-group-commit', daemon=True).start()
+
+    def submit(self, item):
+        """
+        Queue an item for the next group commit
+
+        Args:
+            item: Work item passed to the flush function
+
+        Returns:
+            CommitTicket resolved once the item is committed
+        """
+        ticket = CommitTicket()
+        with self._cond:
+            self._ensure_thread()
+            self._items.append((item, ticket))
+            self._last_ticket = ticket
+            if len(self._items) == 1 or len(self._items) >= self.batch_size:
+                self._cond.notify()
+        return ticket
+
+    def drain(self, timeout=None):
+        """
+        Wait until everything submitted so far is committed
+
+        Args:
+            timeout: Optional maximum wait in seconds
+        """
+        ticket = self._last_ticket
+        if ticket is None or self._pid != os.getpid():
+            return
+        try:
+            ticket.wait(timeout)
+        except TimeoutError:
+            raise
+        except Exception:
+            # Already logged by the flusher thread
+            pass
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._items:
+                    self._cond.wait()
+                deadline = time.monotonic() + self.interval
+                while len(self._items) < self.batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch, self._items = self._items, []
+            self._commit(batch)
+
+    def _commit(self, batch):
+        try:
+            results = self.flush([item for item, _ in batch])
+        except Exception as e:
+            log_error("Group commit of %s user writes failed: %s", len(batch), e)
+            for _, ticket in batch:
+                ticket.resolve(error=e)
+            return
+
+        for (_, ticket), result in zip(batch, results):
+            if isinstance(result, Exception):
+                ticket.resolve(error=result)
+            else:
+                ticket.resolve(result)
+
+class UserStorageBackend:
+    """
+    Interface for user persistence
+
+    Backends store user dictionaries and provide point lookups by
+    username and id plus single-user writes
+    """
+    def load_users(self):
+        """Return the full list of user dictionaries"""
+        raise NotImplementedError
+
+    def save_users(self, users):
+        """Replace all stored users, returning a success boolean"""
+        raise NotImplementedError
+
+    def get_user(self, identifier, identifier_type='username'):
+        raise NotImplementedError
+
+    def username_exists(self, username):
+        return self.get_user(username, 'username') is not None
+
+    def next_id(self):
+        raise NotImplementedError
+
+    def add_user(self, user, wait=False):
+        raise NotImplementedError
+
+    def update_user(self, user_id, updates, wait=False):
+        raise NotImplementedError
+
+    def update_users(self, changes, wait=False):
+        """
+        Apply (user_id, updates) pairs in one write, returning a result per pair
+
+        A pair that fails on its own, e.g. a rename to a taken username,
+        has its Exception as result and does not undo the other pairs
+        """
+        raise NotImplementedError
+
+    def delete_user(self, user_id, wait=False):
+        raise NotImplementedError
+
+    def list_users(self, sort='id', descending=False, after=None, filters=None, limit=None):
+        """Iterate users in a sort order after a cursor key, see UserRepository.list_users"""
+        raise NotImplementedError
+
+    def flush(self, timeout=None):
+        """Wait until all submitted writes are durable"""
+        pass
+
+class JsonUserBackend(UserStorageBackend):
+    """
+    Users JSON snapshot plus change journal, served from memory
+
+    All users are held in an indexed UserRepository. Each access
+    checks the files with stat() and only re-reads what another
+    process changed, so writes elsewhere are visible immediately.
+    Writes are applied in memory at once and appended to the journal
+    by a group committer, so a burst of updates costs one write.
+    """
+    def __init__(self, snapshot_path, journal_path):
+        """
+        Initialize JSON backend
+
+        Args:
+            snapshot_path: Path of the users JSON snapshot
+            journal_path: Path of the change journal
+        """
+        self.repository = UserRepository()
+        self.journal = UserJournal(snapshot_path, journal_path)
+        self.loaded = False
+        self.committer = GroupCommitter(self._flush_journal, Config.USERS_COMMIT_INTERVAL,
+                                        Config.USERS_COMMIT_BATCH_SIZE)
+        atexit.register(self.flush)
+
+    def get_repository(self):
+        """
+        Get the repository, picking up changes made by other processes
+
+        Returns:
+            UserRepository instance
+        """
+        try:
+            if self.loaded:
+                self.journal.refresh(self.repository)
+            else:
+                self.journal.load(self.repository)
+                self.loaded = True
+        except Exception as e:
+            log_error("Error loading users: %s", e)
+        return self.repository
+
+    def load_users(self):
+        return self.get_repository().users
+
+    def save_users(self, users):
+        repository = self.get_repository()
+        if users is not repository.users:
+            repository.reset(users)
+        else:
+            # Mutated in place by the caller, indexes may be stale
+            repository.reindex()
+
+        try:
+            self.journal.compact(repository, repository.users)
+            return True
+        except Exception as e:
+            log_error("Error saving users: %s", e)
+            return False
+
+    def _flush_journal(self, items):
+        with user_store_duration_seconds.time('commit'):
+            self.journal.flush(self.repository)
+        return [None] * len(items)
+
+    def _commit(self, records, wait=False):
+        results = self.journal.stage(self.get_repository(), records)
+        ticket = self.committer.submit(records)
+        if wait:
+            ticket.wait(Config.USERS_COMMIT_TIMEOUT)
+        return results
+
+    def flush(self, timeout=None):
+        self.committer.drain(timeout)
+
+    def get_user(self, identifier, identifier_type='username'):
+        repository = self.get_repository()
+        if identifier_type == 'username':
+            return repository.get_by_username(identifier)
+        elif identifier_type == 'id':
+            return repository.get_by_id(identifier)
+        return None
+
+    def username_exists(self, username):
+        return self.get_repository().exists(username)
+
+    def list_users(self, sort='id', descending=False, after=None, filters=None, limit=None):
+        if isinstance(after, list):
+            after = tuple(after)
+        return self.get_repository().list_users(sort, descending, after, filters, limit)
+
+    def next_id(self):
+        return self.get_repository().next_id()
+
+    def add_user(self, user, wait=False):
+        # Always durable on return, the ID must be claimed under the journal lock
+        return self.journal.insert(self.get_repository(), user)
+
+    def update_user(self, user_id, updates, wait=False):
+        if 'username' in updates:
+            # Always durable on return, the name must be claimed under the journal lock
+            return self.journal.rename(self.get_repository(), user_id, updates)
+        if not self.get_repository().get_by_id(user_id):
+            return None
+        return self._commit([{'op': 'update', 'id': user_id, 'changes': updates}], wait)[0]
+
+    def update_users(self, changes, wait=False):
+        if any('username' in updates for _, updates in changes):
+            # Renames are checked under the journal lock one at a time
+            results = []
+            for user_id, updates in changes:
+                try:
+                    results.append(self.update_user(user_id, updates, wait))
+                except UsernameTaken as e:
+                    results.append(e)
+            return results
+        repository = self.get_repository()
+        found = [repository.get_by_id(user_id) is not None for user_id, _ in changes]
+        records = [{'op': 'update', 'id': user_id, 'changes': updates}
+                   for (user_id, updates), exists in zip(changes, found) if exists]
+        if not records:
+            return [None] * len(changes)
+
+        # One journal batch, appended with a single write
+        results = iter(self._commit(records, wait))
+        return [next(results) if exists else None for exists in found]
+
+    def delete_user(self, user_id, wait=False):
+        if not self.get_repository().get_by_id(user_id):
+            return None
+        return self._commit([{'op': 'delete', 'id': user_id}], wait)[0]
+
+_USER_COLUMNS = ('id', 'username', 'password', 'is_admin', 'is_suspended', 'created_at',
+                 'suspended_at', 'password_changed_at', 'username_changed_at', 'profile_picture')
+_BOOLEAN_COLUMNS = ('is_admin', 'is_suspended')
+
+_USERS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY,
+    username TEXT NOT NULL,
+    password TEXT,
+    is_admin INTEGER NOT NULL DEFAULT 0,
+    is_suspended INTEGER NOT NULL DEFAULT 0,
+    created_at INTEGER,
+    suspended_at INTEGER,
+    password_changed_at INTEGER,
+    username_changed_at INTEGER,
+    profile_picture TEXT,
+    extra TEXT
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_users_username ON users (username);
+CREATE INDEX IF NOT EXISTS idx_users_created ON users (COALESCE(created_at, 0), id);
+CREATE INDEX IF NOT EXISTS idx_users_suspended ON users (is_suspended, id);
+CREATE INDEX IF NOT EXISTS idx_users_admin ON users (is_admin, id);
+"""
+
+# Sort columns per USER_SORT_KEYS order, matching the indexes above
+_SORT_COLUMNS = {
+    'id': ('id',),
+    'username': ('username',),
+    'created_at': ('COALESCE(created_at, 0)', 'id'),
+}
+
+_HOT_COLUMNS = ', '.join(_HOT_FIELDS)
+_COLD_COLUMNS = [column for column in _USER_COLUMNS if column not in _HOT_FIELD_SET]
+
+_SELECT_BY_USERNAME = f'SELECT {_HOT_COLUMNS} FROM users WHERE username = ?'
+_SELECT_BY_ID = 'SELECT * FROM users WHERE id = ?'
+_SELECT_HOT_BY_ID = f'SELECT {_HOT_COLUMNS} FROM users WHERE id = ?'
+_SELECT_COLD_BY_ID = f"SELECT {', '.join(_COLD_COLUMNS)}, extra FROM users WHERE id = ?"
+_SELECT_EXISTS = 'SELECT 1 FROM users WHERE username = ?'
+_INSERT_USER = (f"INSERT INTO users ({', '.join(_USER_COLUMNS)}, extra) "
+                f"VALUES ({', '.join('?' for _ in _USER_COLUMNS)}, ?)")
+# Only for bulk imports, which replace the whole table
+_REPLACE_USER = _INSERT_USER.replace('INSERT INTO', 'INSERT OR REPLACE INTO', 1)
+
+def _user_to_row(user):
+    extra = {key: value for key, value in user.items() if key not in _USER_COLUMNS}
+    return tuple(user.get(column) if column not in _BOOLEAN_COLUMNS else int(bool(user.get(column)))
+                 for column in _USER_COLUMNS) + (json.dumps(extra) if extra else None,)
+
+def _row_to_user(row):
+    user = {}
+    for column in row.keys():
+        value = row[column]
+        if column == 'extra':
+            if value:
+                user.update(json.loads(value))
+        elif column in _BOOLEAN_COLUMNS:
+            user[column] = bool(value)
+        elif value is not None:
+            user[column] = value
+    return user
+
+class SqliteUserBackend(UserStorageBackend):
+    """
+    SQLite user store for large user counts
+
+    Lookups and single-row updates go straight to indexed tables, so
+    nothing scales with the number of users. Uses WAL mode and one
+    connection per thread. Reads go to the database, so writers
+    always wait, but concurrent writes share one transaction.
+    """
+    def __init__(self, db_path):
+        """
+        Initialize SQLite backend
+
+        Args:
+            db_path: Path of the SQLite database file
+        """
+        self.db = SqliteConnectionPool(db_path, _USERS_SCHEMA)
+        self.committer = GroupCommitter(self._run_batch, Config.USERS_COMMIT_INTERVAL,
+                                        Config.USERS_COMMIT_BATCH_SIZE)
+
+    def _run_batch(self, operations):
+        results = []
+        with user_store_duration_seconds.time('commit'), self.db.transaction() as conn:
+            for operation in operations:
+                # A savepoint per operation so one failure does not undo the batch
+                conn.execute('SAVEPOINT user_write')
+                try:
+                    results.append(operation(conn))
+                    conn.execute('RELEASE user_write')
+                except Exception as e:
+                    conn.execute('ROLLBACK TO user_write')
+                    conn.execute('RELEASE user_write')
+                    results.append(e)
+        return results
+
+    def _write(self, operation):
+        return self.committer.submit(operation).wait(Config.USERS_COMMIT_TIMEOUT)
+
+    def flush(self, timeout=None):
+        self.committer.drain(timeout)
+
+    def _record(self, row):
+        """Build a record from hot columns, fetching cold ones on first access"""
+        user_id = row['id']
+
+        def load_cold():
+            cold_row = self.db.execute(_SELECT_COLD_BY_ID, (user_id,)).fetchone()
+            return _row_to_user(cold_row) if cold_row else {}
+
+        return UserRecord(_row_to_user(row), cold_loader=load_cold)
+
+    def load_users(self):
+        return [self._record(row) for row in self.db.execute(f'SELECT {_HOT_COLUMNS} FROM users ORDER BY id')]
+
+    def save_users(self, users):
+        try:
+            # Records from load_users fetch their cold fields lazily, so
+            # they must be read before the rows are deleted
+            rows = [_user_to_row(user) for user in users]
+            with self.db.transaction() as conn:
+                conn.execute('DELETE FROM users')
+                conn.executemany(_REPLACE_USER, rows)
+            return True
+        except Exception as e:
+            log_error("Error saving users: %s", e)
+            return False
+
+    def get_user(self, identifier, identifier_type='username'):
+        if identifier_type == 'username':
+            row = self.db.execute(_SELECT_BY_USERNAME, (identifier,)).fetchone()
+        elif identifier_type == 'id':
+            row = self.db.execute(_SELECT_HOT_BY_ID, (identifier,)).fetchone()
+        else:
+            return None
+        return self._record(row) if row else None
+
+    def username_exists(self, username):
+        return self.db.execute(_SELECT_EXISTS, (username,)).fetchone() is not None
+
+    def next_id(self):
+        return self.db.execute('SELECT COALESCE(MAX(id), 0) + 1 FROM users').fetchone()[0]
+
+    def add_user(self, user, wait=False):
+        def insert(conn):
+            if 'id' not in user:
+                user['id'] = conn.execute('SELECT COALESCE(MAX(id), 0) + 1 FROM users').fetchone()[0]
+            try:
+                conn.execute(_INSERT_USER, _user_to_row(user))
+            except sqlite3.IntegrityError:
+                raise UsernameTaken()
+            return user
+        return self._write(insert)
+
+    @staticmethod
+    def _update_statement(updates):
+        """Build the UPDATE statement and parameters for a set of field changes"""
+        columns = [key for key in updates if key in _USER_COLUMNS and key != 'id']
+        extra = {key: value for key, value in updates.items() if key not in _USER_COLUMNS}
+
+        assignments = [f"{column} = ?" for column in columns]
+        params = [int(bool(updates[column])) if column in _BOOLEAN_COLUMNS else updates[column]
+                  for column in columns]
+        if extra:
+            assignments.append("extra = json_patch(COALESCE(extra, '{}'), ?)")
+            params.append(json.dumps(extra))
+        if not assignments:
+            return None, params
+        return f"UPDATE users SET {', '.join(assignments)} WHERE id = ?", params
+
+    @staticmethod
+    def _apply_update(conn, user_id, sql, params):
+        if sql is not None:
+            try:
+                if not conn.execute(sql, params + [user_id]).rowcount:
+                    return None
+            except sqlite3.IntegrityError:
+                # The unique username index rejected a rename
+                raise UsernameTaken()
+        row = conn.execute(_SELECT_BY_ID, (user_id,)).fetchone()
+        return UserRecord(_row_to_user(row)) if row else None
+
+    def update_user(self, user_id, updates, wait=False):
+        sql, params = self._update_statement(updates)
+        if sql is None:
+            return self.get_user(user_id, 'id')
+        return self._write(lambda conn: self._apply_update(conn, user_id, sql, params))
+
+    def update_users(self, changes, wait=False):
+        statements = [(user_id,) + self._update_statement(updates) for user_id, updates in changes]
+        if not statements:
+            return []
+
+        # One transaction, with a savepoint per row so one bad row fails alone
+        def update(conn):
+            results = []
+            for user_id, sql, params in statements:
+                conn.execute('SAVEPOINT user_row')
+                try:
+                    results.append(self._apply_update(conn, user_id, sql, params))
+                except Exception as e:
+                    conn.execute('ROLLBACK TO user_row')
+                    results.append(e)
+                conn.execute('RELEASE user_row')
+            return results
+        return self._write(update)
+
+    def list_users(self, sort='id', descending=False, after=None, filters=None, limit=None):
+        filters = filters or {}
+        columns = _SORT_COLUMNS[sort]
+        where, params = [], []
+        for field in ('is_suspended', 'is_admin'):
+            if field in filters:
+                where.append(f"{field} = ?")
+                params.append(int(bool(filters[field])))
+        if 'created_after' in filters:
+            where.append('COALESCE(created_at, 0) >= ?')
+            params.append(filters['created_after'])
+        if 'created_before' in filters:
+            where.append('COALESCE(created_at, 0) < ?')
+            params.append(filters['created_before'])
+        if filters.get('username_prefix'):
+            where.append('username >= ? AND username < ?')
+            params += [filters['username_prefix'], prefix_upper_bound(filters['username_prefix'])]
+
+        # Keyset pagination: seek past the cursor through the sort index.
+        # The leading column gets its own bound so SQLite can seek on it.
+        if after is not None:
+            after = list(after) if isinstance(after, (list, tuple)) else [after]
+            op = '<' if descending else '>'
+            if len(columns) == 1:
+                where.append(f"{columns[0]} {op} ?")
+            else:
+                where.append(f"{columns[0]} {op}= ? AND ({columns[0]} {op} ? OR {columns[1]} {op} ?)")
+                after = [after[0], after[0], after[1]]
+            params += after
+
+        sql = f'SELECT {_HOT_COLUMNS} FROM users'
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += ' ORDER BY ' + ', '.join(f"{column} {'DESC' if descending else 'ASC'}" for column in columns)
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params.append(limit)
+
+        for row in self.db.execute(sql, params):
+            yield self._record(row)
+
+    def delete_user(self, user_id, wait=False):
+        def delete(conn):
+            row = conn.execute(_SELECT_BY_ID, (user_id,)).fetchone()
+            if not row:
+                return None
+            conn.execute('DELETE FROM users WHERE id = ?', (user_id,))
+            return UserRecord(_row_to_user(row))
+        return self._write(delete)
+
+def create_backend(name=None):
+    """
+    Create a user storage backend
+
+    Args:
+        name: 'json' or 'sqlite', defaults to Config.USER_STORAGE_BACKEND
+
+    Returns:
+        UserStorageBackend instance
+    """
+    name = name or Config.USER_STORAGE_BACKEND
+    if name == 'sqlite':
+        return SqliteUserBackend(Config.USERS_DB_FILE)
+    elif name == 'json':
+        return JsonUserBackend(Config.USERS_FILE, Config.USERS_JOURNAL_FILE)
+    raise ValueError(f"Unknown user storage backend: {name}")
+
+def get_backend():
+    """
+    Get the configured user storage backend
+
+    Returns:
+        UserStorageBackend instance
+    """
+    global _backend
+    if _backend is None:
+        _backend = create_backend()
+    return _backend
+
+def migrate_users_to_sqlite(json_path=None, db_path=None):
+    """
+    Import a users JSON snapshot (and its journal) into SQLite
+
+    Args:
+        json_path: Users JSON file, defaults to Config.USERS_FILE
+        db_path: Target database, defaults to Config.USERS_DB_FILE
+
+    Returns:
+        int: Number of imported users
+    """
+    json_path = json_path or Config.USERS_FILE
+    source = JsonUserBackend(json_path, os.path.splitext(json_path)[0] + '.journal')
+    users = source.load_users()
+
+    target = SqliteUserBackend(db_path or Config.USERS_DB_FILE)
+    if not target.save_users(users):
+        raise RuntimeError('Failed to write users to SQLite')
+
+    log_info("Migrated %s users from %s", len(users), json_path)
+    return len(users)
 
 def load_users():
     """
-    Load users from JSON file with caching
-    
+    Load all users from the configured backend
+
     Returns:
         List of user dictionaries
     """
-    global _users_cache, _last_load_time
-    current_time = time.time()
-    
-    if _users_cache and current_time - _last_load_time < _cache_ttl:
-        return _users_cache
-    
-    users_file = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'users.json')
-    try:
-        with open(users_file, 'r') as f:
-            _users_cache = json.load(f)
-            _last_load_time = current_time
-            return _users_cache
-    except Exception as e:
-        log_error(f"Error loading users: {str(e)}")
-        _users_cache = []
-        _last_load_time = current_time
-        return _users_cache
+    with user_store_duration_seconds.time('load_users'):
+        return get_backend().load_users()
 
 def save_users(users):
     """
-    Save users to JSON file and update cache
-    
+    Save the full user list through the configured backend
+
     Args:
         users: List of user dictionaries
-    
+
     Returns:
         Boolean indicating success or failure
     """
-    global _users_cache, _last_load_time
-    _users_cache = users
-    _last_load_time = time.time()
-    
-    users_file = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'users.json')
-    try:
-        with open(users_file, 'w') as f:
-            json.dump(users, f)
-        return True
-    except Exception as e:
-        log_error(f"Error saving users: {str(e)}")
-        return False
+    with user_store_duration_seconds.time('save_users'):
+        return get_backend().save_users(users)
 
 def get_user(identifier, identifier_type='username', users=None):
     """
     Get user by identifier (username or id)
-    
+
     Args:
         identifier: Username string or user ID
         identifier_type: 'username' or 'id'
         users: Optional pre-loaded users list
-        
+
     Returns:
         User dict or None if not found
     """
-    if users is None:
-        users = load_users()
-    
-    if identifier_type == 'username':
-        return next((user for user in users if user['username'] == identifier), None)
-    elif identifier_type == 'id':
-        return next((user for user in users if user['id'] == identifier), None)
-    return None
+    if users is not None:
+        # Caller-supplied list, fall back to a scan
+        key = 'username' if identifier_type == 'username' else 'id'
+        return next((user for user in users if user.get(key) == identifier), None)
+
+    with user_store_duration_seconds.time('get_user'):
+        return get_backend().get_user(identifier, identifier_type)
+
+def username_exists(username):
+    """
+    Check whether a username is already taken
+
+    Args:
+        username: Username to check
 
-def update_user(user_id, updates, users=None):
+    Returns:
+        Boolean indicating if the username is in use
+    """
+    with user_store_duration_seconds.time('username_exists'):
+        return get_backend().username_exists(username)
+
+def add_user(user, wait=False):
+    """
+    Add a new user and persist the change
+
+    Args:
+        user: User dictionary; 'id' is assigned if missing
+        wait: Block until the write is durable
+
+    Returns:
+        The added user dict
+
+    Raises:
+        UsernameTaken: If the username is already in use
+    """
+    with user_store_duration_seconds.time('add_user'):
+        return get_backend().add_user(user, wait)
+
+def update_user(user_id, updates, users=None, wait=False):
     """
     Update user with specified changes
-    
+
+    Only the changed fields are written, never the whole user list.
+    Writes are group-committed in the background unless `wait` is set.
+
     Args:
         user_id: ID of user to update
         updates: Dictionary of fields to update
         users: Optional pre-loaded users list
-        
+        wait: Block until the write is durable
+
     Returns:
         Updated user dict or None if not found
+
+    Raises:
+        UsernameTaken: If a rename would reuse a username already in use
     """
-    if users is None:
-        users = load_users()
-    
-    for i, user in enumerate(users):
-        if user['id'] == user_id:
-            users[i].update(updates)
-            save_users(users)
-            return users[i]
-    
-    return None
+    backend = get_backend()
+    if users is not None and users is not backend.load_users():
+        backend.save_users(users)
+    with user_store_duration_seconds.time('update_user'):
+        return backend.update_user(user_id, updates, wait)
+
+def update_users(changes, wait=False):
+    """
+    Update many users with a single store write
+
+    The JSON backend appends all changes as one journal batch and the
+    SQLite backend applies them in one transaction, with a savepoint
+    per pair so a failing pair does not undo the others
+
+    Args:
+        changes: List of (user_id, updates) pairs
+        wait: Block until the write is durable
+
+    Returns:
+        List with the updated user dict, None if not found, or the
+        Exception that failed the pair, per pair
+    """
+    with user_store_duration_seconds.time('update_users'):
+        return get_backend().update_users(changes, wait)
+
+def list_users(sort='id', descending=False, after=None, filters=None, limit=None):
+    """
+    Iterate users for paginated listings
+
+    Served from sorted indexes by both backends, never by sorting or
+    scanning the full user list
+
+    Args:
+        sort: 'id', 'username' or 'created_at'
+        descending: Reverse the sort order
+        after: Sort key of the last user of the previous page
+        filters: Optional filters, see matches_filters
+        limit: Optional maximum number of users
+
+    Returns:
+        Iterator of user records
+    """
+    return get_backend().list_users(sort, descending, after, filters, limit)
+
+def delete_user(user_id, wait=False):
+    """
+    Delete a user and persist the change
+
+    Args:
+        user_id: ID of user to delete
+        wait: Block until the write is durable
+
+    Returns:
+        Removed user dict or None if not found
+    """
+    with user_store_duration_seconds.time('delete_user'):
+        return get_backend().delete_user(user_id, wait)
+
+def flush_users(timeout=None):
+    """
+    Wait until all pending user writes are durable
+
+    Args:
+        timeout: Optional maximum wait in seconds
+    """
+    get_backend().flush(timeout)
@@ -0,0 +1,104 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from utils.logutils import log_error
+
+class PoolSaturated(Exception):
+    """Raised when a worker pool has its maximum of pending jobs or a job did not finish in time"""
+    pass
+
+class BoundedProcessPool:
+    """
+    Process pool with a cap on queued work
+
+    CPU-heavy jobs run in worker processes so request threads only
+    wait on a future. Once `max_pending` jobs are queued or running,
+    new submissions fail fast with PoolSaturated instead of piling up.
+    Workers are spawned, not forked: the pool starts on first use, when
+    the server already runs threads whose held locks a fork would copy.
+    """
+    def __init__(self, name, workers, max_pending):
+        """
+        Initialize pool
+
+        Args:
+            name: Name used in log messages
+            workers: Number of worker processes
+            max_pending: Maximum number of queued plus running jobs
+        """
+        self.name = name
+        self.workers = workers
+        self.max_pending = max_pending
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        # Created lazily so each forked server worker gets its own pool
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+                self._pid = os.getpid()
+            return self._executor
+
+    def submit(self, fn, *args):
+        """
+        Submit a job to the pool
+
+        Args:
+            fn: Picklable module-level function
+            *args: Arguments for fn
+
+        Returns:
+            concurrent.futures.Future
+
+        Raises:
+            PoolSaturated: If the pool is already at max_pending jobs
+        """
+        if not self._slots.acquire(blocking=False):
+            raise PoolSaturated(f"{self.name} pool is saturated")
+
+        try:
+            future = self._submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def _submit(self, fn, *args):
+        try:
+            return self._get_executor().submit(fn, *args)
+        except BrokenProcessPool as e:
+            log_error("%s pool broken, restarting: %s", self.name, e)
+            with self._lock:
+                self._executor = None
+            return self._get_executor().submit(fn, *args)
+
+    def run(self, fn, *args, timeout=None):
+        """
+        Run a job in the pool and wait for its result
+
+        Args:
+            fn: Picklable module-level function
+            *args: Arguments for fn
+            timeout: Optional maximum wait in seconds
+
+        Returns:
+            The job's return value
+
+        Raises:
+            PoolSaturated: If the pool is full or the job did not finish within timeout
+        """
+        future = self.submit(fn, *args)
+        try:
+            return future.result(timeout)
+        except FutureTimeoutError:
+            # Still queued jobs give up their slot, running ones finish unobserved
+            future.cancel()
+            raise PoolSaturated(f"{self.name} job did not finish within {timeout}s")